@@ -1,58 +1,353 @@
-import core.stateparser
+import core.cache
+import core.diagnostics
+import core.pipeline
+import core.scanner
+import core.shard
+import core.stats
+import argparse
 import os
 import pathlib
-import jinja2
 import sys
-import mmap
+import time
 
-def parse(inputfile: pathlib.WindowsPath, cpp_template, hpp_template):
-    outputpath = inputfile.parent.joinpath("generated")
 
-    print(f"parsing {str(inputfile)}")
+def parse_arguments(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=f"python {sys.argv[0]}",
+        description="Generate hierarchical state machines from plantuml")
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        type=pathlib.Path,
+        metavar="path",
+        help="input file or directory to search for diagrams")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="number of worker processes, 0 uses every available core")
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="regenerate every file, ignoring the build manifests")
+    parser.add_argument(
+        "--ext",
+        dest="extensions",
+        action="append",
+        metavar="EXT",
+        help="file extension to search directories for, may be repeated "
+        f"(default: {' '.join(core.scanner.DEFAULT_EXTENSIONS)})")
+    parser.add_argument(
+        "--exclude",
+        dest="excludes",
+        action="append",
+        metavar="GLOB",
+        help="skip files and directories matching GLOB, may be repeated. "
+        "A trailing / only matches directories, a / elsewhere matches the "
+        "path relative to the searched directory "
+        f"(default: {' '.join(core.scanner.DEFAULT_EXCLUDES)})")
+    parser.add_argument(
+        "--backend",
+        choices=tuple(core.pipeline.BACKENDS),
+        help="code to generate: hsm dispatches through the templates in "
+        "resources/hsm, table through constant transition tables resolved "
+        "when generating, crtp generates a class template to derive the "
+        "implementation from, without virtual calls. A diagram can choose "
+        "its own with a \"' yahsmg: backend=table\" line (default: hsm)")
+    parser.add_argument(
+        "--paths",
+        dest="transition_paths",
+        choices=core.pipeline.OPTIONS["paths"],
+        help="precomputed makes the hsm backend emit the exit and entry "
+        "actions of every transition as straight line code, which compiles "
+        "much faster than instantiating the transition templates "
+        "(default: template)")
+    parser.add_argument(
+        "--layout",
+        choices=core.pipeline.OPTIONS["layout"],
+        help="compact stores the current state as a small state id instead "
+        "of a pointer and picks the smallest integer types for Signal and "
+        "StateId, see resources/hsm/instances.hpp (default: default)")
+    parser.add_argument(
+        "--queue",
+        type=core.pipeline.capacity,
+        metavar="N",
+        help="give the machines an event queue of N signals with post(), "
+        "dispatch_all() and dispatch_batch() for run to completion "
+        "processing, 0 for none (default: 0)")
+    parser.add_argument(
+        "--trace",
+        type=core.pipeline.capacity,
+        metavar="N",
+        help="record the transitions of hsm backend machines in a ring "
+        "buffer of N records (resources/hsm/trace.hpp) and write a "
+        "<name>_HSM.trace.json file to decode its dumps with "
+        "python -m tools.trace, 0 for none (default: 0)")
+    parser.add_argument(
+        "--prune",
+        choices=core.pipeline.OPTIONS["prune"],
+        help="report the states the machines can never be in and the "
+        "transitions that can never fire, on also leaves them out of the "
+        "generated code (default: off)")
+    parser.add_argument(
+        "--unity",
+        choices=core.pipeline.OPTIONS["unity"],
+        help="render the .cpp code of all diagrams of an input file (file) "
+        "or of all input files of a directory (directory) into a single "
+        "translation unit, keeping a header per diagram (default: off)")
+    parser.add_argument(
+        "--bench",
+        choices=core.pipeline.OPTIONS["bench"],
+        help="also write <name>_HSM.bench.cpp, a driver timing the machine "
+        "on random or recorded signals with stub conditions and actions, "
+        "see python -m benchmark.machines (default: off)")
+    parser.add_argument(
+        "--diagnostics",
+        choices=("text", "json"),
+        default="text",
+        help="how to report the lines of the diagrams that are not "
+        "understood: as text with the progress messages, or as a JSON line "
+        "per file on stdout with the progress messages on stderr "
+        "(default: text)")
+    parser.add_argument(
+        "--max-diagnostics",
+        type=core.pipeline.capacity,
+        default=core.diagnostics.DEFAULT_LIMIT,
+        metavar="N",
+        help="report at most N diagnostics per file and count the others, 0 "
+        f"for all (default: {core.diagnostics.DEFAULT_LIMIT})")
+    parser.add_argument(
+        "--shard",
+        type=core.shard.shard,
+        metavar="I/N",
+        help="only generate shard I of N (counting from 1) of the input "
+        "files, chosen by a hash of their path relative to the searched "
+        "directory, so N machines can split a run without overlap")
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="print the input files that would be generated, one per line, "
+        "without generating them")
+    parser.add_argument(
+        "--manifest",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="write the outputs of every input file to FILE as JSON, the "
+        "manifests of all shards of a run are combined with "
+        "python -m tools.manifest")
+    parser.add_argument(
+        "--stats",
+        choices=("json", ),
+        help="report per file timings of every phase and counts of lines, "
+        "diagrams, states, events and written bytes on stdout, the "
+        "progress messages go to stderr instead")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="run under cProfile and print the functions taking the most "
+        "time to stderr. Only the main process is profiled, use -j 1 to "
+        "include parsing and rendering")
+    parser.add_argument("--profile-output",
+                        metavar="FILE",
+                        help="also save the raw profile to FILE for pstats "
+                        "or other viewers")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep running, regenerate changed files in the given directories "
+        "and answer requests on a unix socket")
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="socket to serve on (default: .yahsmg.sock in the first "
+        "directory)")
+    parser.add_argument("--poll",
+                        action="store_true",
+                        help="watch by polling file stats instead of inotify")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="how often the watcher checks for changes (default: 1)")
 
-    with open(str(inputfile), "r") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmap_file:
-        if (mmap_file.find(b"@startuml")) == -1:
-            return
+    args = parser.parse_args(argv)
+    if args.serve and not all(path.is_dir() for path in args.paths):
+        parser.error("--serve needs directories to watch")
+    if args.jobs < 0:
+        parser.error("--jobs must be zero or positive")
+    if args.serve and (args.shard or args.list or args.manifest):
+        parser.error("--shard, --list and --manifest need a single run, "
+                     "not --serve")
+    if args.serve and (args.stats or args.diagnostics == "json"):
+        parser.error("--serve logs the diagnostics as text and keeps no "
+                     "--stats")
+    if args.stats and args.diagnostics == "json":
+        parser.error("--stats and --diagnostics json both write to stdout")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
 
-        all_diagrams = core.stateparser.parse_data(f.read())
+    return args
 
-        outputpath.mkdir(parents=True, exist_ok=True)
 
-        for diagram in all_diagrams:
-            outputcpp = outputpath.joinpath(diagram["name"] + "_HSM.cpp")
-            outputhpp = outputpath.joinpath(diagram["name"] + "_HSM.hpp")
+def options(args: argparse.Namespace) -> dict:
+    # the generator options given on the command line
+    options = {}
+    if args.backend:
+        options["backend"] = args.backend
+    if args.transition_paths:
+        options["paths"] = args.transition_paths
+    if args.layout:
+        options["layout"] = args.layout
+    if args.queue is not None:
+        options["queue"] = args.queue
+    if args.trace is not None:
+        options["trace"] = args.trace
+    if args.prune:
+        options["prune"] = args.prune
+    if args.unity:
+        options["unity"] = args.unity
+    if args.bench:
+        options["bench"] = args.bench
+    return options
 
-            with open(str(outputcpp), "w") as cppout:
-                cppout.writelines(cpp_template.render(diagram))
-                print(f"generated {str(outputcpp)}")
 
-            with open(str(outputhpp), "w") as hppout:
-                hppout.writelines(hpp_template.render(diagram))
-                print(f"generated {str(outputhpp)}")
+def generate(args: argparse.Namespace) -> int:
+    scanner = core.scanner.Scanner(
+        extensions=args.extensions or core.scanner.DEFAULT_EXTENSIONS,
+        excludes=(core.scanner.DEFAULT_EXCLUDES
+                  if args.excludes is None else args.excludes))
 
+    if args.serve:
+        import core.server as server
+        server.serve(args.paths,
+                     args.socket
+                     or str(args.paths[0].joinpath(".yahsmg.sock")),
+                     scanner,
+                     cache=args.cache,
+                     poll=args.poll,
+                     interval=args.interval,
+                     options=options(args),
+                     max_diagnostics=args.max_diagnostics)
+        return 0
 
-def main():
-    template = pathlib.Path(__file__).parent.resolve().joinpath("template")
+    # with --stats stdout only carries the statistics, with --diagnostics json
+    # only the diagnostics
+    json_diagnostics = args.diagnostics == "json"
+    messages = sys.stderr if args.stats or json_diagnostics else sys.stdout
+
+    start = time.perf_counter()
+    # the path of every input relative to the common folder of the searched
+    # directories. Different files get different names, the first one is
+    # kept for the same file given twice or found below two of the given
+    # directories.
+    root = core.shard.common_root(path if path.is_dir() else path.parent
+                                  for path in args.paths)
+    keep = None
+    if args.shard:
+        by_directory = options(args).get("unity") == "directory"
+
+        def keep(candidate):
+            # the files of the other shards are dropped before the scanner
+            # reads them
+            return core.shard.in_shard(
+                core.shard.relative_name(candidate, root), *args.shard,
+                by_directory)
+
+    names = {}
+    seen = set()
+    for path in args.paths:
+        for inputfile in core.pipeline.collect_inputs(path, scanner,
+                                                      args.jobs, keep):
+            name = core.shard.relative_name(inputfile, root)
+            if name not in seen:
+                seen.add(name)
+                names[inputfile] = name
+    inputs = list(names)
+    scan_time = time.perf_counter() - start
+
+    if args.list:
+        for inputfile in inputs:
+            print(str(inputfile))
+        return 0
+
+    cache = None
+    if args.cache:
+        cache = core.cache.BuildCache(
+            core.pipeline.template_path,
+            core.pipeline.options_key(options(args)))
+
+    results = []
+    entries = {}
+    failed = 0
+    for result in core.pipeline.generate_files(inputs, args.jobs, cache,
+                                               args.stats is not None,
+                                               options(args),
+                                               args.max_diagnostics):
+        for message in result.messages:
+            print(message, file=messages)
+        if json_diagnostics:
+            if result.diagnostics:
+                print(result.diagnostics.json())
+        elif result.diagnostics:
+            print("\n".join(result.diagnostics.lines()), file=messages)
+
+        if not result.ok:
+            failed += 1
+            print(f"error: {str(result.inputfile)}: {result.error}",
+                  file=sys.stderr)
 
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template),
-                             trim_blocks=True)
+        if args.stats:
+            results.append(result)
+        if args.manifest:
+            entries[names[result.inputfile]] = core.shard.manifest_entry(
+                result, root)
 
-    cpp = env.get_template("template.cpp.jinja")
-    hpp = env.get_template("template.hpp.jinja")
+    if args.manifest:
+        core.shard.write_manifest(
+            args.manifest, core.shard.run_manifest(entries, args.shard))
 
-    if len(sys.argv) != 2:
-        print(f"Usage: python {sys.argv[0]} <inputfile-or-directory>")
-        sys.exit(1)
+    if args.stats:
+        import json
+        summary = core.stats.summary(results, scan_time,
+                                     time.perf_counter() - start, args.jobs)
+        print(json.dumps(summary, indent=2))
 
-    path = pathlib.Path(sys.argv[1])
-    if path.is_dir():
-        for root, _, files in os.walk(path):
-            for file in files:
-                if file.endswith(".puml"):
-                    parse(pathlib.Path(root).joinpath(file), cpp, hpp)
+    if failed:
+        print(f"{failed} of {len(inputs)} file(s) failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+def profile(args: argparse.Namespace) -> int:
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(generate, args)
+    finally:
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+            pstats.SortKey.CUMULATIVE,
+            pstats.SortKey.TIME).print_stats(40)
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+
+    if args.profile or args.profile_output:
+        status = profile(args)
     else:
-        parse(path, cpp, hpp)
+        status = generate(args)
+
+    if status:
+        sys.exit(status)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
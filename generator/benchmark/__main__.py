@@ -0,0 +1,226 @@
+# Times every phase of a generator run on a synthetic corpus and writes the
+# results as JSON, so runs on different commits can be compared.
+#
+# usage (from the generator directory):
+#   python -m benchmark [corpus options] [--output FILE] [--compare FILE]
+#
+# --compare exits with status 1 when a phase got slower than --threshold
+# relative to the given earlier result, for use in CI.
+
+import benchmark.corpus as corpus
+import core
+import core.output
+import core.pipeline
+import core.scanner
+import core.stateparser
+import argparse
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+RESULT_FORMAT = 1
+
+PHASES = ("scan", "parse", "finalise", "render", "write", "total")
+
+
+class _UnfinishedStateObject(core.stateparser.StateObject):
+    # hands the parsed state object out at @enduml, so finalising it into
+    # the model can be timed on its own
+    def finish(self):
+        return self
+
+
+class _UnfinishedParser(core.stateparser.DiagramParser):
+    state_object_type = _UnfinishedStateObject
+
+
+def timed(function, repeat: int, setup=None) -> tuple:
+    # returns the run times and the result of the last run
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def summary(times: list) -> dict:
+    return {
+        "best": min(times),
+        "median": statistics.median(times),
+        "runs": times
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              cwd=pathlib.Path(__file__).parent,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(root: pathlib.Path, scanner: core.scanner.Scanner,
+        repeat: int) -> tuple:
+    # returns (phase timings, corpus counts)
+    templates = core.pipeline.Templates()
+    templates.load()
+    phases = {}
+
+    times, inputs = timed(lambda: scanner.scan(root), repeat)
+    phases["scan"] = summary(times)
+
+    def parse():
+        return [(inputfile, state_object)
+                for inputfile in inputs for state_object in
+                core.stateparser.iter_diagrams(
+                    inputfile, parser_type=_UnfinishedParser)]
+
+    times, parsed = timed(parse, repeat)
+    phases["parse"] = summary(times)
+
+    def finalise():
+        return [(inputfile,
+                 core.stateparser.StateObject.finish(state_object))
+                for inputfile, state_object in parsed]
+
+    times, diagrams = timed(finalise, repeat)
+    phases["finalise"] = summary(times)
+
+    def render():
+        rendered = []
+        for inputfile, diagram in diagrams:
+            outputpath = core.pipeline.output_directory(inputfile)
+            options = templates.options_for(diagram)
+            context = {"diagram": diagram, "options": options}
+            for name, template in core.pipeline.diagram_files(
+                    diagram, options, templates):
+                rendered.append((outputpath.joinpath(name),
+                                 "".join(template.generate(context))))
+        return rendered
+
+    times, rendered = timed(render, repeat)
+    phases["render"] = summary(times)
+
+    outputpaths = sorted({output.parent for output, _ in rendered})
+
+    def clean():
+        for outputpath in outputpaths:
+            shutil.rmtree(outputpath, ignore_errors=True)
+
+    def write():
+        for outputpath in outputpaths:
+            outputpath.mkdir(parents=True, exist_ok=True)
+        for output, text in rendered:
+            core.output.write_chunks(output, (text, ))
+        return sum(len(text.encode()) for _, text in rendered)
+
+    times, written = timed(write, repeat, clean)
+    phases["write"] = summary(times)
+
+    def total():
+        return sum(1 for result in core.pipeline.generate_files(
+            scanner.scan(root)) if result.ok)
+
+    times, _ = timed(total, repeat, clean)
+    phases["total"] = summary(times)
+
+    counts = {
+        "files": len(inputs),
+        "bytes": sum(path.stat().st_size for path in inputs),
+        "lines": sum(path.read_bytes().count(b"\n") for path in inputs),
+        "diagrams": len(diagrams),
+        "states": sum(len(d.states) - 1 for _, d in diagrams),
+        "transitions": sum(
+            len(s.transitions) for _, d in diagrams for s in d.states),
+        "outputs": len(rendered),
+        "bytes_written": written
+    }
+
+    return phases, counts
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    # prints both results side by side, returns False on a regression
+    ok = True
+    print(f"{'best (ms)':12}{'baseline':>12}{'current':>12}{'change':>10}")
+    for phase in PHASES:
+        if phase not in baseline["phases"] or phase not in result["phases"]:
+            continue
+        before = baseline["phases"][phase]["best"]
+        after = result["phases"][phase]["best"]
+        change = after / before - 1 if before else 0.0
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{phase:12}{before * 1000:12.2f}{after * 1000:12.2f}"
+              f"{change:+9.1%}{'  slower' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    corpus.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="write the results to FILE instead of stdout")
+    parser.add_argument("--compare",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="compare against the results in FILE")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="allowed slowdown per phase for --compare (default: 0.1)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("corpus") != corpus.options(args):
+            parser.error(f"{args.compare} was measured on another corpus")
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory)
+        corpus.write_corpus(root, **corpus.options(args))
+        scanner = core.scanner.Scanner(
+            extensions=(".hpp", ) if args.header else (".puml", ))
+        phases, counts = run(root, scanner, args.repeat)
+
+    result = {
+        "format": RESULT_FORMAT,
+        "version": core.__version__,
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus.options(args),
+        "counts": counts,
+        "repeat": args.repeat,
+        "phases": phases
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    elif baseline is None:
+        print(text)
+
+    if baseline is not None and not compare(result, baseline, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
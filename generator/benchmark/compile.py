@@ -0,0 +1,101 @@
+# Measures how long g++ takes to compile the code generated for a large
+# synthetic diagram, and how big the object file gets, for every variant in
+# benchmark.dispatch.VARIANTS.
+#
+# usage (from the generator directory):
+#   python -m benchmark.compile [--states 500] [--depth N] [--cxx g++] ...
+
+import benchmark.corpus as corpus
+import benchmark.dispatch as dispatch
+import argparse
+import json
+import os
+import pathlib
+import shlex
+import subprocess
+import tempfile
+import time
+
+
+def compile_time(command: list, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark.compile")
+    parser.add_argument("--states", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--events", type=int, default=2)
+    parser.add_argument("--guards", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--cxx",
+                        default=os.environ.get("CXX", "g++"),
+                        help="compiler command (default: $CXX or g++)")
+    parser.add_argument("--cxxflags", default="-std=c++17 -O2")
+    parser.add_argument("--output",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="also write the results to FILE")
+    args = parser.parse_args()
+
+    lines = corpus.diagram_source("bench",
+                                  states=args.states,
+                                  depth=args.depth,
+                                  events=args.events,
+                                  guards=args.guards,
+                                  seed=args.seed)
+    # a crtp machine is a class template, compiled where it is instantiated
+    variants = [
+        variant for variant in dispatch.variants()
+        if variant.options.get("backend") != "crtp"
+    ]
+    cxx = shlex.split(args.cxx) + shlex.split(args.cxxflags)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        sources = dispatch.write_variants(directory, lines, variants)
+
+        for variant, source in zip(variants, sources):
+            obj = directory.joinpath(f"{variant.name}.o")
+            command = cxx + [
+                f"-I{dispatch.resources_path}", f"-I{source.parent}", "-c",
+                str(source), "-o",
+                str(obj)
+            ]
+            results[variant.label] = {
+                "seconds": compile_time(command, args.repeat),
+                "source_bytes": source.stat().st_size,
+                "object_bytes": obj.stat().st_size
+            }
+
+    baseline = results["hsm"]
+    print(f"{'':16}{'seconds':>10}{'speedup':>10}{'object KiB':>12}")
+    for label, result in results.items():
+        print(f"{label:16}{result['seconds']:10.2f}"
+              f"{baseline['seconds'] / result['seconds']:9.2f}x"
+              f"{result['object_bytes'] / 1024:12.0f}")
+
+    if args.output:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "states": args.states,
+                    "depth": args.depth,
+                    "events": args.events,
+                    "cxx": args.cxx,
+                    "cxxflags": args.cxxflags,
+                    "variants": results
+                },
+                indent=2) + "\n")
+
+
+if __name__ == '__main__':
+    main()
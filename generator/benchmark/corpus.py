@@ -0,0 +1,190 @@
+# Synthetic plantuml corpus for the benchmarks.
+#
+# usage (from the generator directory):
+#   python -m benchmark.corpus DIRECTORY [--files N] [--states N] ...
+
+import argparse
+import pathlib
+import random
+
+
+def state_tree(states: int, depth: int, rng: random.Random) -> dict:
+    # maps every state name to its parent name (None for the top level). The
+    # first `depth` states form a chain so the deepest state really is
+    # `depth` levels down, the others get a random parent above that level.
+    parents = {}
+    levels = {}
+    for n in range(states):
+        name = f"S{n}"
+        if n < depth:
+            parent = f"S{n - 1}" if n else None
+        else:
+            candidates = [None] + [
+                state for state, level in levels.items() if level < depth - 1
+            ]
+            parent = rng.choice(candidates)
+        parents[name] = parent
+        levels[name] = 0 if parent is None else levels[parent] + 1
+    return parents
+
+
+def diagram_source(name: str,
+                   states: int = 20,
+                   depth: int = 3,
+                   events: int = 2,
+                   guards: float = 0.5,
+                   actions: bool = True,
+                   seed: int = 0) -> list:
+    # returns the lines of one diagram, from @startuml to @enduml
+    rng = random.Random(seed)
+    depth = max(1, min(depth, states))
+    parents = state_tree(states, depth, rng)
+
+    children = {}
+    for state, parent in parents.items():
+        children.setdefault(parent, []).append(state)
+
+    lines = [f"@startuml {name}"]
+
+    def declare(parent, indent):
+        # a state is nested in the composite it is first mentioned in
+        lines.append(f"{indent}[*] --> {children[parent][0]}")
+        for state in children[parent]:
+            if state in children:
+                lines.append(f"{indent}state {state} {{")
+                declare(state, indent + "    ")
+                lines.append(f"{indent}}}")
+            else:
+                lines.append(f"{indent}state {state}")
+
+    declare(None, "")
+
+    names = list(parents)
+    event_pool = max(3, events * 4)
+    for state in names:
+        if actions:
+            lines.append(f"{state} : Entry / enter_{state}")
+            lines.append(f"{state} : Exit / leave_{state}")
+            lines.append(f"{state} : tick / count_{state}")
+
+        # a state handles an event at most once, like the generated switch
+        for event in rng.sample(range(event_pool), events):
+            line = f"{state} --> {rng.choice(names)} : event_{event}"
+            if rng.random() < guards:
+                line += f" [guard_{rng.randrange(event_pool)}]"
+            if actions:
+                line += f" / action_{rng.randrange(event_pool)}"
+            lines.append(line)
+
+    lines.append("@enduml")
+    return lines
+
+
+def header_source(diagrams: list, padding: int) -> list:
+    # a C++ header with every diagram in a comment, separated by `padding`
+    # lines of code the scanner and the parser have to skip
+    lines = ["#pragma once", ""]
+    for n, diagram in enumerate(diagrams):
+        lines.append("/*")
+        lines += diagram
+        lines.append("*/")
+        lines.append(f"class Machine{n} {{")
+        for member in range(padding):
+            lines.append(f"    int member_{member}; // not part of a diagram")
+        lines.append("};")
+    return lines
+
+
+def write_corpus(directory: pathlib.Path,
+                 files: int = 20,
+                 diagrams: int = 1,
+                 header: bool = False,
+                 padding: int = 2000,
+                 seed: int = 0,
+                 **diagram_options) -> list:
+    # writes `files` inputs of `diagrams` diagrams each, .hpp headers when
+    # `header` is set and plain .puml files otherwise, and returns their paths
+    paths = []
+    for n in range(files):
+        sources = [
+            diagram_source(f"machine_{n}_{d}",
+                           seed=seed * 1000003 + n * 101 + d,
+                           **diagram_options) for d in range(diagrams)
+        ]
+
+        if header:
+            path = directory.joinpath(f"machine_{n}.hpp")
+            lines = header_source(sources, padding)
+        else:
+            path = directory.joinpath(f"machine_{n}.puml")
+            lines = [line for source in sources for line in source]
+
+        # a few files per directory, like a real source tree
+        path = path.parent.joinpath(f"group_{n // 8}", path.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(lines) + "\n")
+        paths.append(path)
+
+    return paths
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--diagrams",
+                        type=int,
+                        default=1,
+                        help="diagrams per file")
+    parser.add_argument("--states", type=int, default=20)
+    parser.add_argument("--depth",
+                        type=int,
+                        default=3,
+                        help="nesting depth of the composite states")
+    parser.add_argument("--events",
+                        type=int,
+                        default=2,
+                        help="transitions per state")
+    parser.add_argument("--guards",
+                        type=float,
+                        default=0.5,
+                        help="fraction of transitions with a guard")
+    parser.add_argument("--no-actions",
+                        dest="actions",
+                        action="store_false",
+                        help="no entry/exit, internal or transition actions")
+    parser.add_argument("--header",
+                        action="store_true",
+                        help="embed the diagrams in C++ headers")
+    parser.add_argument("--padding",
+                        type=int,
+                        default=2000,
+                        help="lines of C++ around every embedded diagram")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def options(args: argparse.Namespace) -> dict:
+    return {
+        "files": args.files,
+        "diagrams": args.diagrams,
+        "states": args.states,
+        "depth": args.depth,
+        "events": args.events,
+        "guards": args.guards,
+        "actions": args.actions,
+        "header": args.header,
+        "padding": args.padding,
+        "seed": args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=pathlib.Path)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    paths = write_corpus(args.directory, **options(args))
+    print(f"wrote {len(paths)} file(s) to {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
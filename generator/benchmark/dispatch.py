@@ -0,0 +1,180 @@
+# Compares the ns/event of dispatching signals with every backend: the same
+# synthetic diagram is generated once per variant in VARIANTS, a driver runs
+# them all on the same random signals and checks they call the same actions
+# and guards.
+#
+# usage (from the generator directory):
+#   python -m benchmark.dispatch [--states N] [--depth N] [--cxx g++] ...
+
+import benchmark.corpus as corpus
+import core.pipeline
+import core.stateparser
+import argparse
+import json
+import os
+import pathlib
+import shlex
+import subprocess
+import tempfile
+
+resources_path = pathlib.Path(__file__).parent.parent.parent.resolve().joinpath(
+    "resources")
+
+
+class Variant:
+    # one generated copy of the benchmark machine
+    def __init__(self, label: str, **options):
+        self.label = label
+        self.name = f"bench_{label}"
+        self.options = options
+
+
+# every backend, and every mode of them worth comparing
+VARIANTS = (
+    ("hsm", {"backend": "hsm"}),
+    ("hsm_precomputed", {"backend": "hsm", "paths": "precomputed"}),
+    ("table", {"backend": "table"}),
+    ("hsm_compact", {"backend": "hsm", "layout": "compact"}),
+    ("table_compact", {"backend": "table", "layout": "compact"}),
+    ("crtp", {"backend": "crtp"}),
+)
+
+
+def variants() -> list:
+    return [Variant(label, **options) for label, options in VARIANTS]
+
+
+def write_variants(directory: pathlib.Path, lines: list,
+                   variants: list) -> list:
+    # writes the diagram once per variant, with its options set in the
+    # diagram, generates the code and returns the generated .cpp files
+    inputs = []
+    for variant in variants:
+        options = ", ".join(f"{name}={value}"
+                            for name, value in variant.options.items())
+        source = [f"@startuml {variant.name}", f"' yahsmg: {options}"]
+        source += lines[1:]
+        inputfile = directory.joinpath(f"{variant.name}.puml")
+        inputfile.write_text("\n".join(source) + "\n")
+        inputs.append(inputfile)
+
+    for result in core.pipeline.generate_files(inputs):
+        if not result.ok:
+            raise SystemExit(f"{result.inputfile}: {result.error}")
+
+    generated = core.pipeline.output_directory(inputs[0])
+    return [
+        generated.joinpath(f"{variant.name}_HSM.cpp") for variant in variants
+    ]
+
+
+def compile_and_run(cxx: list, sources: list, include: list,
+                    directory: pathlib.Path) -> str:
+    executable = directory.joinpath("bench")
+    command = cxx + [f"-I{path}" for path in include]
+    command += [str(source) for source in sources]
+    command += ["-o", str(executable)]
+    subprocess.run(command, check=True)
+    return subprocess.run([str(executable)],
+                          check=True,
+                          capture_output=True,
+                          text=True).stdout
+
+
+def render_driver(template_name: str, **context) -> str:
+    import jinja2
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(
+        str(pathlib.Path(__file__).parent)),
+                             trim_blocks=True)
+    return env.get_template(template_name).render(**context)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark.dispatch")
+    parser.add_argument("--states", type=int, default=40)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--events", type=int, default=2)
+    parser.add_argument("--guards", type=float, default=0.5)
+    parser.add_argument("--no-actions",
+                        dest="actions",
+                        action="store_false",
+                        help="no entry/exit, internal or transition actions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count",
+                        type=int,
+                        default=1000000,
+                        help="signals dispatched per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cxx",
+                        default=os.environ.get("CXX", "g++"),
+                        help="compiler command (default: $CXX or g++)")
+    parser.add_argument("--cxxflags", default="-std=c++17 -O2")
+    parser.add_argument("--output",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="also write the results to FILE")
+    args = parser.parse_args()
+
+    lines = corpus.diagram_source("bench",
+                                  states=args.states,
+                                  depth=args.depth,
+                                  events=args.events,
+                                  guards=args.guards,
+                                  actions=args.actions,
+                                  seed=args.seed)
+    diagram, = core.stateparser.iter_diagrams(lines)
+    machines = variants()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        sources = write_variants(directory, lines, machines)
+
+        driver = directory.joinpath("driver.cpp")
+        driver.write_text(
+            render_driver("dispatch.cpp.jinja",
+                          variants=machines,
+                          conditions=diagram.conditions,
+                          actions=diagram.actions,
+                          signals=len(diagram.events),
+                          seed=args.seed,
+                          count=args.count,
+                          repeat=args.repeat))
+
+        output = compile_and_run(
+            shlex.split(args.cxx) + shlex.split(args.cxxflags),
+            [driver] + sources, [resources_path, sources[0].parent],
+            directory)
+
+    timings = json.loads(output)
+    if len({timing["trace"] for timing in timings.values()}) != 1:
+        raise SystemExit(f"variants behaved differently: {timings}")
+
+    result = {
+        "diagram": {
+            "states": len(diagram.states) - 1,
+            "depth": max(state.depth for state in diagram.states),
+            "leaves": len(diagram.leaves),
+            "signals": len(diagram.events),
+            "transitions":
+            sum(len(state.transitions) for state in diagram.states)
+        },
+        "count": args.count,
+        "cxx": args.cxx,
+        "cxxflags": args.cxxflags,
+        "ns_per_event": {
+            label: timing["ns_per_event"]
+            for label, timing in timings.items()
+        }
+    }
+
+    baseline = result["ns_per_event"]["hsm"]
+    for label, ns in result["ns_per_event"].items():
+        print(f"{label:16}{ns:10.2f} ns/event{baseline / ns:9.2f}x")
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Compares the single pass line tokenizer of core.stateparser against trying
+# the line regexes one at a time, as parse_data used to do.
+#
+# usage (from the generator directory):
+#   python -m benchmark.lexer [--lines N] [--repeat N]
+
+import core.stateparser as stateparser
+import argparse
+import contextlib
+import io
+import random
+import time
+
+_sequential = (
+    (stateparser.END, stateparser.end_diagram_regex),
+    (stateparser.EVENT, stateparser.event_regex),
+    (stateparser.INIT, stateparser.init_regex),
+    (stateparser.STATE, stateparser.state_regex),
+    (stateparser.STATE_END, stateparser.composite_state_end_regex),
+    (stateparser.STATE_ACTION, stateparser.state_action_regex),
+    (stateparser.INNER_ACTION, stateparser.state_inner_action_regex),
+)
+
+
+def sequential_tokenize(line: str) -> tuple:
+    for token, regex in _sequential:
+        match = regex.match(line)
+        if match:
+            return token, match
+    return None, None
+
+
+class SequentialDiagramParser(stateparser.DiagramParser):
+    tokenize = staticmethod(sequential_tokenize)
+
+
+def parse_with(parser_type, lines: list) -> list:
+    diagrams = []
+    parser = parser_type()
+    for line in lines:
+        diagram = parser.feed(line)
+        if diagram is not None:
+            diagrams.append(diagram)
+    return diagrams
+
+
+def synthetic_lines(count: int, seed: int = 0) -> list:
+    # a header embedding one diagram per ~2000 lines; every diagram mixes
+    # transitions, inits, composite states, actions and the comment and code
+    # lines that end up inside diagrams embedded in C++ comments
+    rng = random.Random(seed)
+    lines = []
+    diagram = 0
+    while len(lines) < count:
+        lines.append("/*")
+        lines.append(f"@startuml machine {diagram}")
+        lines.append("[*] -> S0")
+        for n in range(40):
+            state = f"S{n}"
+            lines.append(f"state {state} {{")
+            lines.append(f"    [*] --> {state}_inner")
+            lines.append(f"    {state}_inner -> {state}_other : event_{n}")
+            lines.append("}")
+            lines.append(f"{state} : Entry / enter_{n}")
+            lines.append(f"{state} : handle tick [is_ready] / on_tick_{n}")
+            lines.append(f"{state} --> S{rng.randrange(40)} : "
+                         f"go next [guard {n}] / act {n}")
+            lines.append(f" * note: {state} handles event_{n} // comment")
+            lines.append(f"#define STATE_{n}_ID {n} // generated id")
+        lines.append("@enduml")
+        lines.append("*/")
+        for n in range(1600):
+            lines.append(f"    int member_{n}; // plain C++ outside diagrams")
+        diagram += 1
+    return lines[:count]
+
+
+def measure(parser_type, lines: list, repeat: int) -> tuple:
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            diagrams = parse_with(parser_type, lines)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, diagrams
+
+
+def measure_tokenize(tokenize, lines: list, repeat: int) -> float:
+    lines = [line.strip() for line in lines]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            tokenize(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def diagram_lines(lines: list) -> list:
+    # only the lines between @startuml and @enduml, where tokenizing happens
+    inside = []
+    in_diagram = False
+    for line in lines:
+        if "@startuml" in line:
+            in_diagram = True
+        if in_diagram:
+            inside.append(line)
+            if "@enduml" in line:
+                in_diagram = False
+    return inside
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = synthetic_lines(args.lines)
+
+    before, expected = measure(SequentialDiagramParser, lines, args.repeat)
+    after, diagrams = measure(stateparser.DiagramParser, lines, args.repeat)
+
+    if [d.as_dict() for d in diagrams] != [d.as_dict() for d in expected]:
+        raise SystemExit("tokenizers produced different diagrams")
+
+    inside = diagram_lines(lines)
+    inside_before, _ = measure(SequentialDiagramParser, inside, args.repeat)
+    inside_after, _ = measure(stateparser.DiagramParser, inside, args.repeat)
+
+    print(f"{len(lines)} lines, {len(diagrams)} diagrams, "
+          f"{len(inside)} lines inside diagrams")
+    print(f"{'lines/s':32}{'before':>12}{'after':>12}{'speedup':>10}")
+    rows = (
+        ("tokenize, diagram lines", len(inside),
+         measure_tokenize(sequential_tokenize, inside, args.repeat),
+         measure_tokenize(stateparser.tokenize_line, inside, args.repeat)),
+        ("parse_data, diagram lines", len(inside), inside_before,
+         inside_after),
+        ("parse_data, whole file", len(lines), before, after),
+    )
+    for label, count, b, a in rows:
+        print(f"{label:32}{count / b:12.0f}{count / a:12.0f}{b / a:9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
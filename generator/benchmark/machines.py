@@ -0,0 +1,213 @@
+# Measures how fast the generated machines dispatch signals: every diagram of
+# the given files, or a synthetic one without any, is generated with the bench
+# option and its <name>_HSM.bench.cpp driver compiled with g++ and run. The
+# ns/event, transitions per second and ns/event per state depth they report
+# are written as JSON, so runs on different commits of hsm.hpp and the
+# templates can be compared.
+#
+# usage (from the generator directory):
+#   python -m benchmark.machines [FILE ...] [--backend hsm] [--replay FILE]
+#                                [--output FILE] [--compare FILE]
+#
+# --compare exits with status 1 when a machine got slower than --threshold
+# relative to the given earlier result, for use in CI.
+
+import benchmark.corpus as corpus
+import benchmark.dispatch
+import core
+import core.api
+import core.pipeline
+import argparse
+import json
+import os
+import pathlib
+import platform
+import shlex
+import subprocess
+import tempfile
+
+RESULT_FORMAT = 1
+
+
+def commit() -> str:
+    import benchmark.__main__
+    return benchmark.__main__.commit()
+
+
+def build(artifacts: list, cxx: list, directory: pathlib.Path) -> dict:
+    # compiles the driver of every diagram with its machine, returns the
+    # executables by diagram name
+    executables = {}
+    for driver in artifacts:
+        if driver.kind != "benchmark":
+            continue
+        name = driver.diagram.name
+        if name in executables:
+            raise SystemExit(f"two diagrams are named {name}")
+        sources = [driver.path] + [
+            artifact.path for artifact in artifacts
+            if artifact.kind == "source" and artifact.diagram is driver.diagram
+        ]
+        executable = directory.joinpath(f"{name}_bench")
+        command = cxx + [
+            f"-I{benchmark.dispatch.resources_path}", f"-I{directory}"
+        ]
+        command += [str(source) for source in sources]
+        command += ["-o", str(executable)]
+        subprocess.run(command, check=True)
+        executables[name] = executable
+    return executables
+
+
+def measure(executable: pathlib.Path, arguments: list) -> dict:
+    output = subprocess.run([str(executable), *arguments],
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    return json.loads(output)
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    # prints both results side by side, returns False on a regression
+    ok = True
+    print(f"{'ns/event':24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, machine in result["machines"].items():
+        if name not in baseline["machines"]:
+            continue
+        before = baseline["machines"][name]["ns_per_event"]
+        after = machine["ns_per_event"]
+        change = after / before - 1 if before else 0.0
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{name:24}{before:12.2f}{after:12.2f}"
+              f"{change:+9.1%}{'  slower' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark.machines")
+    parser.add_argument("files",
+                        type=pathlib.Path,
+                        nargs="*",
+                        help="files with diagrams (default: a synthetic "
+                        "diagram)")
+    parser.add_argument("--backend", choices=tuple(core.pipeline.BACKENDS))
+    parser.add_argument("--paths",
+                        dest="transition_paths",
+                        choices=core.pipeline.OPTIONS["paths"])
+    parser.add_argument("--layout", choices=core.pipeline.OPTIONS["layout"])
+    parser.add_argument("--states", type=int, default=40)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--events", type=int, default=2)
+    parser.add_argument("--guards", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count",
+                        type=int,
+                        default=1000000,
+                        help="random signals dispatched per run")
+    parser.add_argument("--replay",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="dispatch the signal names or numbers in FILE "
+                        "instead of random signals")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cxx",
+                        default=os.environ.get("CXX", "g++"),
+                        help="compiler command (default: $CXX or g++)")
+    parser.add_argument("--cxxflags", default="-std=c++17 -O2")
+    parser.add_argument("--output",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="write the results to FILE instead of stdout")
+    parser.add_argument("--compare",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="compare against the results in FILE")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="allowed slowdown per machine for --compare (default: 0.1)")
+    args = parser.parse_args()
+
+    options = {}
+    if args.backend:
+        options["backend"] = args.backend
+    if args.transition_paths:
+        options["paths"] = args.transition_paths
+    if args.layout:
+        options["layout"] = args.layout
+
+    if args.files:
+        sources = args.files
+        corpus_options = None
+    else:
+        corpus_options = {
+            "states": args.states,
+            "depth": args.depth,
+            "events": args.events,
+            "guards": args.guards,
+            "seed": args.seed
+        }
+        lines = corpus.diagram_source("bench", **corpus_options)
+        sources = [("bench.puml", "\n".join(lines) + "\n")]
+
+    arguments = ["--seed", str(args.seed), "--repeat", str(args.repeat)]
+    if args.replay:
+        arguments += ["--replay", str(args.replay.resolve())]
+    else:
+        arguments += ["--count", str(args.count)]
+
+    settings = {
+        "files": [str(path) for path in args.files],
+        "corpus": corpus_options,
+        "options": options,
+        "count": None if args.replay else args.count,
+        "replay": str(args.replay) if args.replay else None,
+        "seed": args.seed
+    }
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("settings") != settings:
+            parser.error(f"{args.compare} was measured with other settings")
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        artifacts = core.api.generate(sources,
+                                      options=dict(options, bench="on"),
+                                      output_dir=directory,
+                                      write=True)
+        executables = build(
+            artifacts,
+            shlex.split(args.cxx) + shlex.split(args.cxxflags), directory)
+        machines = {
+            name: measure(executable, arguments)
+            for name, executable in executables.items()
+        }
+
+    result = {
+        "format": RESULT_FORMAT,
+        "version": core.__version__,
+        "commit": commit(),
+        "platform": platform.platform(),
+        "cxx": args.cxx,
+        "cxxflags": args.cxxflags,
+        "settings": settings,
+        "repeat": args.repeat,
+        "machines": machines
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    elif baseline is None:
+        print(text)
+
+    if baseline is not None and not compare(result, baseline, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Feeds the parser single diagram lines built to make backtracking regexes
+# slow (long runs of spaces, words, arrows and brackets after the start of
+# every kind of line) and fails when any of them takes more than a bound on
+# the time per kilobyte. With the line regexes of core.stateparser linear in
+# the length of a line, that time does not grow with --kib.
+#
+# usage (from the generator directory):
+#   python -m benchmark.stress [--kib N] [--repeat N] [--max-us-per-kib N]
+
+import core.stateparser as stateparser
+import argparse
+import time
+
+# (prefix, repeated unit, suffix) of every adversarial line
+CASES = (
+    ("A : ", " ", "x"),
+    ("A : ", " ", "x !"),
+    ("A : x", " ", "/"),
+    ("A : ", "x ", "["),
+    ("A : ", "x\t", "!"),
+    ("A : x [", "a ", "/"),
+    ("A : entry", " ", "!"),
+    ("A : ", "entry ", "/"),
+    ("A ", " ", ": x / y"),
+    ("A ", "-", ">"),
+    ("A ", "-", " B"),
+    ("A <", "-", "!"),
+    ("A --> B : ", "x ", "["),
+    ("A --> B : x", " ", "/"),
+    ("A --> B : x [", "a ", "!"),
+    ("A --> B : x [a]", " ", "!"),
+    ("[*] -> ", "a", "!"),
+    ("[*] ", "-", "!"),
+    ("state ", "a", " as"),
+    ("state ", " ", "{"),
+    ('state "', "a", "!"),
+    ("' yahsmg: ", "a", "!"),
+    ("' yahsmg: ", "a ", "="),
+    ("' yahsmg: ", "a=", "!"),
+    ("", "a", ""),
+    ("", "a ", "!"),
+)
+
+
+def stress_line(case: tuple, size: int) -> str:
+    # the line of a case, `size` characters long give or take a unit
+    prefix, unit, suffix = case
+    count = max(1, (size - len(prefix) - len(suffix)) // len(unit))
+    return prefix + unit * count + suffix
+
+
+def parse_line(line: str) -> None:
+    parser = stateparser.DiagramParser()
+    parser.feed("@startuml stress")
+    parser.feed(line)
+
+
+def measure(line: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_line(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def us_per_kib(case: tuple, kib: int, repeat: int) -> float:
+    line = stress_line(case, kib * 1024)
+    return measure(line, repeat) * 1e6 / (len(line) / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kib", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-us-per-kib", type=float, default=1000)
+    args = parser.parse_args()
+
+    worst = 0
+    print(f"{'line':36}{'us/KiB':>10}")
+    for case in CASES:
+        result = us_per_kib(case, args.kib, args.repeat)
+        worst = max(worst, result)
+        label = repr(stress_line(case, 0)[:32])
+        print(f"{label:36}{result:10.1f}")
+
+    if worst > args.max_us_per_kib:
+        raise SystemExit(f"{worst:.1f} us/KiB is above the bound of "
+                         f"{args.max_us_per_kib:g} us/KiB")
+
+
+if __name__ == '__main__':
+    main()
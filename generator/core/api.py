@@ -0,0 +1,166 @@
+import core.diagnostics
+import core.output
+import core.pipeline
+import core.stateparser
+import os
+import pathlib
+
+# Generating from Python without starting the generator: generate() parses
+# the diagrams of any number of sources and returns the rendered files as
+# Artifacts, leaving it to the caller whether and where to write them.
+#
+# A source is a path (pathlib.Path or another os.PathLike) to read, a str of
+# diagram text, or a (name, text) pair naming in-memory text like the file it
+# would be read from. Artifacts of a path or named text go to its generated
+# directory like the command line generator's output, those of unnamed text
+# to the current directory, and all of them to `output_dir` when it is given.
+#
+# Pass the same core.pipeline.Templates to every call to compile the
+# templates only once.
+
+
+class Artifact:
+    __slots__ = ("path", "kind", "text", "diagram", "source", "written")
+
+    def __init__(self, path: pathlib.Path, kind: str, text: str, diagram,
+                 source):
+        self.path = path
+        # "header", "source" (a .cpp file), "trace" (the trace metadata),
+        # "benchmark" (the bench=on driver) or "unity" (the .cpp code of
+        # several diagrams)
+        self.kind = kind
+        self.text = text
+        self.diagram = diagram  # the core.model.Diagram, None for unity
+        self.source = source  # the path or name of the source, None for text
+        self.written = None  # with write=True, whether the file changed
+
+    def write(self) -> bool:
+        # writes the file unless it already holds the same text
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.written = core.output.write_chunks(self.path, [self.text])
+        return self.written
+
+    def __repr__(self) -> str:
+        return f"Artifact({self.kind}, {str(self.path)})"
+
+
+def _read(source, diagnostics) -> tuple:
+    # (name, diagrams) of a source
+    if isinstance(source, os.PathLike):
+        name = pathlib.Path(source)
+        text = name
+    elif isinstance(source, str):
+        name = None
+        text = source
+    else:
+        name, text = source
+        name = pathlib.Path(name)
+    diagnostics.file = None if name is None else str(name)
+    return name, core.stateparser.iter_diagrams(text,
+                                                diagnostics=diagnostics)
+
+
+def generate(sources,
+             *,
+             templates: core.pipeline.Templates = None,
+             options: dict = None,
+             output_dir=None,
+             write: bool = False,
+             log=None,
+             diagnostics: list = None) -> list:
+    # returns the Artifacts of every diagram of the sources, in order.
+    # `options` override the defaults when no `templates` are given. `log` is
+    # called with the messages of the analyses, like prune=report, and the
+    # diagnostics of every source. `diagnostics` gets the
+    # core.diagnostics.Diagnostics of every source.
+    if templates is None:
+        templates = core.pipeline.Templates(options=options)
+    elif options:
+        raise ValueError("options are set by the templates given")
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+    if log is None:
+        log = lambda message: None
+    if output_dir is not None:
+        output_dir = pathlib.Path(output_dir)
+    unity = templates.options["unity"]
+
+    artifacts = []
+    directories = {}
+    for source in sources:
+        source_diagnostics = core.diagnostics.Diagnostics()
+        if diagnostics is not None:
+            diagnostics.append(source_diagnostics)
+        name, diagrams = _read(source, source_diagnostics)
+        if output_dir is not None:
+            directory = output_dir
+        elif name is not None:
+            directory = core.pipeline.output_directory(name)
+        else:
+            directory = pathlib.Path()
+        # the unity=directory file is named after the directory holding a
+        # generated directory, and after any other directory itself
+        if output_dir is None and name is not None:
+            unity_name = None
+        else:
+            unity_name = directory.resolve().name
+
+        units = []
+        for diagram in diagrams:
+            diagram, diagram_options = core.pipeline.prepare_diagram(
+                diagram, templates, log)
+            context = {"diagram": diagram, "options": diagram_options}
+            files = core.pipeline.diagram_files(diagram, diagram_options,
+                                                templates)
+            if unity != "off":
+                units.append(files.pop(0)[1].render(context))
+            for file_name, template in files:
+                artifacts.append(
+                    Artifact(directory.joinpath(file_name),
+                             _kind(file_name), template.render(context),
+                             diagram, name))
+
+        if units:
+            stem = name.stem if name is not None else "diagrams"
+            suffix = ".cpp" if unity == "file" else ".inc"
+            part = directory.joinpath(f"{stem}_unity{suffix}")
+            artifacts.append(
+                Artifact(part, "unity", core.pipeline.unity_source(units),
+                         None, name))
+            directories.setdefault((directory, unity_name),
+                                   []).append(part.name)
+
+        for line in source_diagnostics.lines():
+            log(line)
+
+    if unity == "directory":
+        for (directory, unity_name), parts in directories.items():
+            artifacts.append(
+                Artifact(
+                    core.pipeline.directory_unity_output(
+                        directory, unity_name), "unity",
+                    core.pipeline.unity_directory_source(parts), None, None))
+
+    # two artifacts with the same path would overwrite each other, as the
+    # unity files of two unnamed texts do
+    paths = set()
+    for artifact in artifacts:
+        if artifact.path in paths:
+            raise ValueError(
+                f"two artifacts would be written to {str(artifact.path)}")
+        paths.add(artifact.path)
+
+    if write:
+        for artifact in artifacts:
+            artifact.write()
+    return artifacts
+
+
+def _kind(file_name: str) -> str:
+    if file_name.endswith(".bench.cpp"):
+        return "benchmark"
+    if file_name.endswith(".cpp"):
+        return "source"
+    if file_name.endswith(".hpp"):
+        return "header"
+    return "trace"
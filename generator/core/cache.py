@@ -0,0 +1,163 @@
+import core
+import hashlib
+import json
+import os
+import pathlib
+
+# every directory receiving generated files gets a manifest describing which
+# input produced which outputs and under what key
+MANIFEST_NAME = ".yahsmg_manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def _hash_file(path: pathlib.Path, digest) -> None:
+    with open(str(path), "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+
+
+def template_digest(template_dir: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    for template in sorted(template_dir.rglob("*.jinja")):
+        digest.update(str(template.relative_to(template_dir)).encode())
+        digest.update(b"\0")
+        _hash_file(template, digest)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def generator_digest() -> str:
+    # the Python code shaping the output, so that upgrading the generator
+    # regenerates everything without anyone bumping core.__version__
+    digest = hashlib.sha256()
+    directory = pathlib.Path(core.__file__).parent
+    for source in sorted(directory.glob("*.py")):
+        digest.update(source.name.encode())
+        digest.update(b"\0")
+        _hash_file(source, digest)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def input_key(inputfile: pathlib.Path,
+              templates: str,
+              options: str = "",
+              generator: str = "",
+              data: bytes = None) -> str:
+    # `data` is the content of the input when it was already read
+    digest = hashlib.sha256()
+    digest.update(core.__version__.encode())
+    digest.update(b"\0")
+    digest.update(generator.encode())
+    digest.update(b"\0")
+    digest.update(templates.encode())
+    digest.update(b"\0")
+    digest.update(options.encode())
+    digest.update(b"\0")
+    if data is None:
+        _hash_file(inputfile, digest)
+    else:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+        self.path = directory.joinpath(MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False
+
+        try:
+            with open(str(self.path), "r") as f:
+                data = json.load(f)
+            if data.get("format") == MANIFEST_FORMAT:
+                self.entries = data["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            # a missing or unreadable manifest only costs a regeneration
+            self.entries = {}
+
+    def is_fresh(self, name: str, key: str) -> bool:
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key:
+            return False
+
+        return all(
+            self.directory.joinpath(output).is_file()
+            for output in entry["outputs"])
+
+    def update(self, name: str, key: str, outputs: list) -> None:
+        self.entries[name] = {
+            "key": key,
+            "outputs": sorted(str(o.relative_to(self.directory)) for o in outputs)
+        }
+        self.dirty = True
+
+    def forget(self, name: str) -> None:
+        if self.entries.pop(name, None) is not None:
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty or not self.directory.is_dir():
+            return
+
+        import tempfile
+
+        data = {"format": MANIFEST_FORMAT, "entries": self.entries}
+        fd, tmp = tempfile.mkstemp(dir=str(self.directory),
+                                   prefix=MANIFEST_NAME,
+                                   suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp, str(self.path))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+
+class BuildCache:
+    def __init__(self, template_dir: pathlib.Path, options: str = ""):
+        self.generator = generator_digest()
+        self.templates = template_digest(template_dir)
+        self.options = options
+        self.manifests = {}
+
+    def manifest(self, outputpath: pathlib.Path) -> Manifest:
+        manifest = self.manifests.get(outputpath)
+        if manifest is None:
+            manifest = self.manifests[outputpath] = Manifest(outputpath)
+        return manifest
+
+    def key(self, inputfile: pathlib.Path, data: bytes = None) -> str:
+        return input_key(inputfile, self.templates, self.options,
+                         self.generator, data)
+
+    def is_fresh(self, inputfile: pathlib.Path, outputpath: pathlib.Path,
+                 key: str) -> bool:
+        return self.manifest(outputpath).is_fresh(inputfile.name, key)
+
+    def record(self, inputfile: pathlib.Path, outputpath: pathlib.Path,
+               key: str, outputs: list) -> None:
+        manifest = self.manifest(outputpath)
+        if outputs:
+            manifest.update(inputfile.name, key, outputs)
+        else:
+            manifest.forget(inputfile.name)
+
+    def outputs(self, inputfile: pathlib.Path,
+                outputpath: pathlib.Path) -> list:
+        # the outputs recorded for an input
+        entry = self.manifest(outputpath).entries.get(inputfile.name)
+        if entry is None:
+            return []
+        return [outputpath.joinpath(output) for output in entry["outputs"]]
+
+    def forget(self, inputfile: pathlib.Path,
+               outputpath: pathlib.Path) -> None:
+        self.manifest(outputpath).forget(inputfile.name)
+
+    def save(self) -> None:
+        for manifest in self.manifests.values():
+            manifest.save()
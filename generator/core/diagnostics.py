@@ -0,0 +1,84 @@
+import json
+
+# Messages about an input file, like the diagram lines the parser does not
+# understand. They are collected while the file is processed and reported
+# together once it is done, as text or as JSON, instead of being printed one
+# by one. Only diagram lines are ever looked at: the text outside
+# @startuml ... @enduml (most of a C++ header) is skipped unparsed.
+
+SEVERITIES = ("error", "warning", "note")
+
+# diagnostics kept per file, the others are only counted
+DEFAULT_LIMIT = 20
+
+
+class Diagnostic:
+    __slots__ = ("file", "line", "severity", "diagram", "message")
+
+    def __init__(self, file: str, line: int, severity: str, diagram: str,
+                 message: str):
+        self.file = file  # None for text that was not read from a file
+        self.line = line  # 1 based, None when not about a line
+        self.severity = severity
+        self.diagram = diagram  # None outside a diagram
+        self.message = message
+
+    def as_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "line": self.line,
+            "severity": self.severity,
+            "diagram": self.diagram,
+            "message": self.message
+        }
+
+    def __str__(self) -> str:
+        location = self.file or "<text>"
+        if self.line is not None:
+            location += f":{self.line}"
+        text = f"{location}: {self.severity}: {self.message}"
+        if self.diagram is not None:
+            text += f" (diagram {self.diagram})"
+        return text
+
+
+class Diagnostics:
+    __slots__ = ("file", "limit", "entries", "dropped")
+
+    def __init__(self, file: str = None, limit: int = DEFAULT_LIMIT):
+        self.file = file
+        self.limit = limit  # 0 keeps all
+        self.entries = []
+        self.dropped = 0
+
+    def add(self,
+            severity: str,
+            message: str,
+            line: int = None,
+            diagram: str = None) -> None:
+        if self.limit and len(self.entries) >= self.limit:
+            self.dropped += 1
+            return
+        self.entries.append(
+            Diagnostic(self.file, line, severity, diagram, message))
+
+    def __len__(self) -> int:
+        return len(self.entries) + self.dropped
+
+    def lines(self) -> list:
+        lines = [str(entry) for entry in self.entries]
+        if self.dropped:
+            lines.append(f"{self.file or '<text>'}: note: {self.dropped} more "
+                         "diagnostics not shown")
+        return lines
+
+    def as_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "diagnostics": [entry.as_dict() for entry in self.entries],
+            "dropped": self.dropped
+        }
+
+    def json(self) -> str:
+        # a single line
+        return json.dumps(self.as_dict())
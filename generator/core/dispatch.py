@@ -0,0 +1,166 @@
+# Resolves the runtime behaviour of resources/hsm/hsm.hpp at generation time:
+# which transition handles a signal in a leaf state, and which exit, entry and
+# initial actions a transition runs, in the exact order Tran<C, S, T> and
+# Init<T> would run them.
+#
+# hsm.hpp decides with std::is_base_of_v, is_base() below is its equivalent:
+# a state "is a base of" itself and of every state nested in it. None stands
+# for TopState<H>, the base of Top.
+
+
+def is_base(base, state) -> bool:
+    if base is None:
+        return True
+    while state is not None:
+        if state is base:
+            return True
+        state = state.parent
+    return False
+
+
+def exit_path(current, source, target) -> list:
+    # the states Tran<current, source, target> exits, innermost first
+    states = []
+    state = current
+    while True:
+        states.append(state)
+        if is_base(state.parent, target.parent) and is_base(state, source):
+            return states
+        state = state.parent
+
+
+def entry_path(source, target) -> list:
+    # the states Tran<..., source, target> enters, outermost first
+    states = []
+    state = target
+    while True:
+        states.append(state)
+        if is_base(state, source) or (is_base(state.parent, source)
+                                      and not is_base(source, state)):
+            break
+        state = state.parent
+    states.reverse()
+    return states
+
+
+def init_path(diagram, state) -> list:
+    # the states entered by the initial transitions below `state`, which is
+    # not entered itself, ending in the leaf state the machine settles in
+    states = []
+    while not state.is_leaf:
+        if state.init is None:
+            raise ValueError(f"diagram {diagram.name}: composite state "
+                             f"{state.name} has no initial state")
+        state = state.init
+        states.append(state)
+    return states
+
+
+class Routine:
+    # straight line code for one way of handling a signal: the actions to
+    # call in order, then the leaf state to settle in (None to stay). target
+    # is the target state of the transition, None for internal transitions
+    # and the initial routine.
+    __slots__ = ("index", "actions", "leaf", "target")
+
+    def __init__(self, index: int, actions: tuple, leaf, target=None):
+        self.index = index
+        self.actions = actions
+        self.leaf = leaf
+        self.target = target
+
+
+class Handler:
+    # how a leaf state handles a signal: the (guard, routine) candidates to
+    # try in order, the first whose guard (a condition name, or None) holds
+    # runs its routine (None to do nothing)
+    __slots__ = ("index", "candidates")
+
+    def __init__(self, index: int, candidates: tuple):
+        self.index = index
+        self.candidates = candidates
+
+
+class DispatchTable:
+    def __init__(self, diagram):
+        if not diagram.leaves:
+            raise ValueError(f"diagram {diagram.name}: has no states")
+
+        self.diagram = diagram
+        self.leaves = diagram.leaves
+        self.signals = diagram.events
+        self.routines = []
+        self._routines = {}
+        # handler 0 means the signal is ignored
+        self.handlers = [Handler(0, ())]
+        self._handlers = {}
+
+        self.initial = self._routine(self._init_actions(diagram.top))
+
+        # rows[leaf][signal] is the index of the handler
+        self.rows = [[self._handler(leaf, signal) for signal in self.signals]
+                     for leaf in self.leaves]
+
+    def _init_actions(self, state) -> tuple:
+        states = init_path(self.diagram, state)
+        actions = tuple(action for entered in states
+                        for action in entered.entry)
+        return actions, states[-1] if states else state
+
+    def _routine(self, key: tuple) -> Routine:
+        routine = self._routines.get(key)
+        if routine is None:
+            routine = Routine(len(self.routines), *key)
+            self.routines.append(routine)
+            self._routines[key] = routine
+        return routine
+
+    def _transition_routine(self, leaf, transition) -> Routine:
+        if transition.is_internal:
+            if not transition.action:
+                return None
+            return self._routine(((transition.action, ), None))
+
+        source = transition.source
+        target = transition.target
+        actions = [
+            action for state in exit_path(leaf, source, target)
+            for action in state.exit
+        ]
+        if transition.action:
+            actions.append(transition.action)
+        for state in entry_path(source, target):
+            actions += state.entry
+
+        init_actions, settled = self._init_actions(target)
+        return self._routine((tuple(actions) + init_actions, settled, target))
+
+    def _handler(self, leaf, signal: str) -> int:
+        # the leaf handles the signal first, then each enclosing state
+        candidates = []
+        for state in (leaf, *leaf.ancestors()):
+            for transition in state.transitions:
+                if transition.event != signal:
+                    continue
+                candidates.append(
+                    (transition.condition,
+                     self._transition_routine(leaf, transition)))
+                if not transition.condition:
+                    break
+            if candidates and not candidates[-1][0]:
+                break
+
+        if not candidates:
+            return 0
+
+        candidates = tuple(candidates)
+        handler = self._handlers.get(candidates)
+        if handler is None:
+            handler = Handler(len(self.handlers), candidates)
+            self.handlers.append(handler)
+            self._handlers[candidates] = handler
+        return handler.index
+
+
+def build(diagram) -> DispatchTable:
+    return DispatchTable(diagram)
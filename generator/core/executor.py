@@ -0,0 +1,259 @@
+import core.dispatch
+
+# Runs a parsed diagram in process, with the semantics of the generated
+# machines: core.dispatch resolves which transition handles a signal in a leaf
+# state and which exit, transition, entry and initial actions it runs, in the
+# order hsm.hpp runs them.
+#
+# Executor runs one machine. Its guards are callables taking the executor and
+# returning a bool (or plain bools), its actions callables taking the
+# executor. BatchExecutor advances many independent machines a signal each
+# per step with NumPy, its guards are callables taking the batch and an array
+# of instance indices and returning a bool mask for those instances (or bool
+# arrays with a value per instance, or plain bools), its actions callables
+# taking the batch and the array of instance indices. Actions that are not
+# given do nothing, every condition needs a guard.
+
+
+def _check_names(diagram, kind: str, given: dict, known: list,
+                 required: bool) -> None:
+    unknown = set(given) - set(known)
+    if unknown:
+        raise ValueError(f"diagram {diagram.name}: unknown {kind} "
+                         f"{', '.join(sorted(unknown))}")
+    if required:
+        missing = [name for name in known if name not in given]
+        if missing:
+            raise ValueError(f"diagram {diagram.name}: no guard for "
+                             f"{', '.join(missing)}")
+
+
+class Executor:
+    def __init__(self,
+                 diagram,
+                 guards: dict = None,
+                 actions: dict = None,
+                 table=None):
+        guards = guards or {}
+        actions = actions or {}
+        _check_names(diagram, "guard", guards, diagram.conditions, True)
+        _check_names(diagram, "action", actions, diagram.actions, False)
+
+        self.diagram = diagram
+        self.table = table or core.dispatch.build(diagram)
+        self.leaves = [leaf.name for leaf in self.table.leaves]
+        self.signals = {name: n for n, name in enumerate(self.table.signals)}
+        self.state = None  # index in leaves, None before init()
+        self.signal = None  # being dispatched
+
+        leaves = {leaf: n for n, leaf in enumerate(self.table.leaves)}
+
+        def routine(routine):
+            # (actions, leaf index or None), without the actions doing nothing
+            if routine is None:
+                return (), None
+            return (tuple(actions[action] for action in routine.actions
+                          if action in actions),
+                    None if routine.leaf is None else leaves[routine.leaf])
+
+        def guard(name):
+            if name is None:
+                return None
+            value = guards[name]
+            if callable(value):
+                return value
+            return lambda executor, value=bool(value): value
+
+        handlers = [None] + [
+            tuple((guard(condition), *routine(candidate))
+                  for condition, candidate in handler.candidates)
+            for handler in self.table.handlers[1:]
+        ]
+        self._initial = routine(self.table.initial)
+        # _rows[leaf][signal] is None for an ignored signal, else the
+        # (guard, actions, leaf) candidates to try in order
+        self._rows = [[handlers[handler] for handler in row]
+                      for row in self.table.rows]
+
+    @property
+    def state_name(self) -> str:
+        return None if self.state is None else self.leaves[self.state]
+
+    def init(self) -> None:
+        actions, leaf = self._initial
+        for action in actions:
+            action(self)
+        self.state = leaf
+
+    def signal_index(self, signal) -> int:
+        if isinstance(signal, int):
+            return signal
+        try:
+            return self.signals[signal]
+        except KeyError:
+            raise ValueError(f"diagram {self.diagram.name}: unknown signal "
+                             f"{signal!r}") from None
+
+    def dispatch(self, signal) -> bool:
+        # returns whether a transition handled the signal
+        if self.state is None:
+            raise RuntimeError("dispatch() before init()")
+        signal = self.signal_index(signal)
+        self.signal = signal
+        candidates = self._rows[self.state][signal]
+        if candidates is None:
+            return False
+        for guard, actions, leaf in candidates:
+            if guard is None or guard(self):
+                for action in actions:
+                    action(self)
+                if leaf is not None:
+                    self.state = leaf
+                return True
+        return False
+
+    def replay(self, signals) -> int:
+        # dispatches every signal in turn, returns how many were handled
+        dispatch = self.dispatch
+        return sum(dispatch(signal) for signal in signals)
+
+
+class BatchExecutor:
+    def __init__(self,
+                 diagram,
+                 count: int,
+                 guards: dict = None,
+                 actions: dict = None,
+                 table=None):
+        import numpy
+
+        guards = guards or {}
+        actions = actions or {}
+        _check_names(diagram, "guard", guards, diagram.conditions, True)
+        _check_names(diagram, "action", actions, diagram.actions, False)
+
+        self.np = numpy
+        self.diagram = diagram
+        self.count = count
+        self.table = table or core.dispatch.build(diagram)
+        self.leaves = [leaf.name for leaf in self.table.leaves]
+        self.signals = {name: n for n, name in enumerate(self.table.signals)}
+        self.state = None  # leaf index of every instance, None before init()
+
+        leaves = {leaf: n for n, leaf in enumerate(self.table.leaves)}
+
+        def routine(routine):
+            if routine is None:
+                return (), -1
+            return (tuple(actions[action] for action in routine.actions
+                          if action in actions),
+                    -1 if routine.leaf is None else leaves[routine.leaf])
+
+        handlers = self.table.handlers
+        self._initial = routine(self.table.initial)
+        self._candidates = [
+            tuple((condition and guards[condition], *routine(candidate))
+                  for condition, candidate in handler.candidates)
+            for handler in handlers
+        ]
+
+        # the dense transition table: _rows[leaf, signal] is a handler, the
+        # extra last column (signal -1, no signal this step) ignores it
+        rows = numpy.zeros((len(self.leaves), len(self.table.signals) + 1),
+                           dtype=numpy.intp)
+        rows[:, :-1] = self.table.rows
+        self._rows = rows
+
+        # handlers that do not need a guard nor an action are applied to all
+        # instances at once, with the leaf they go to (-1 to stay)
+        self._plain = numpy.array([
+            not candidates or
+            (candidates[0][0] is None and not candidates[0][1])
+            for candidates in self._candidates
+        ])
+        self._target = numpy.array([
+            candidates[0][2] if candidates else -1
+            for candidates in self._candidates
+        ],
+                                   dtype=numpy.intp)
+
+    def state_names(self) -> list:
+        return [self.leaves[state] for state in self.state]
+
+    def encode(self, sequences, length: int = None):
+        # a (steps, count) signal index array of one sequence of signal names
+        # or indices per instance, shorter sequences padded with -1
+        np = self.np
+        if len(sequences) != self.count:
+            raise ValueError(f"{len(sequences)} sequences for "
+                             f"{self.count} instances")
+        if length is None:
+            length = max((len(sequence) for sequence in sequences), default=0)
+        signals = np.full((length, self.count), -1, dtype=np.intp)
+        for instance, sequence in enumerate(sequences):
+            sequence = [
+                signal if isinstance(signal, int) else self.signals[signal]
+                for signal in sequence
+            ]
+            signals[:len(sequence), instance] = sequence
+        return signals
+
+    def _mask(self, guard, instances):
+        np = self.np
+        if callable(guard):
+            return np.asarray(guard(self, instances), dtype=bool)
+        if isinstance(guard, np.ndarray):
+            return guard[instances]
+        return np.full(len(instances), bool(guard))
+
+    def init(self) -> None:
+        np = self.np
+        actions, leaf = self._initial
+        instances = np.arange(self.count)
+        for action in actions:
+            action(self, instances)
+        self.state = np.full(self.count, leaf, dtype=np.intp)
+
+    def step(self, signals) -> None:
+        # dispatches signals[i] to instance i, -1 for no signal
+        np = self.np
+        if self.state is None:
+            raise RuntimeError("step() before init()")
+        state = self.state
+        handlers = self._rows[state, np.asarray(signals)]
+
+        target = self._target[handlers]
+        next_state = np.where(self._plain[handlers] & (target >= 0), target,
+                              state)
+
+        instances = np.flatnonzero(~self._plain[handlers])
+        if len(instances):
+            # the others, grouped by handler
+            order = np.argsort(handlers[instances], kind="stable")
+            instances = instances[order]
+            present, starts = np.unique(handlers[instances], return_index=True)
+            ends = list(starts[1:]) + [len(instances)]
+            for handler, start, end in zip(present, starts, ends):
+                remaining = instances[start:end]
+                for guard, actions, leaf in self._candidates[handler]:
+                    if guard is None:
+                        taken = remaining
+                        remaining = remaining[:0]
+                    else:
+                        mask = self._mask(guard, remaining)
+                        taken = remaining[mask]
+                        remaining = remaining[~mask]
+                    if len(taken):
+                        for action in actions:
+                            action(self, taken)
+                        if leaf >= 0:
+                            next_state[taken] = leaf
+                    if not len(remaining):
+                        break
+
+        self.state = next_state
+
+    def run(self, signals) -> None:
+        # steps through a (steps, count) array like encode() returns
+        for row in signals:
+            self.step(row)
@@ -0,0 +1,222 @@
+import sys
+
+TOP = "Top"
+
+
+class Transition:
+    __slots__ = ("source", "target", "event", "condition", "action")
+
+    def __init__(self, source, target, event: str, condition: str,
+                 action: str):
+        self.source = source
+        self.target = target  # None for an internal transition
+        self.event = event
+        self.condition = condition
+        self.action = action
+
+    @property
+    def is_internal(self) -> bool:
+        return self.target is None
+
+    def __repr__(self) -> str:
+        target = self.target.name if self.target else None
+        return f"Transition({self.source.name} -> {target} : {self.event})"
+
+
+class State:
+    __slots__ = ("index", "name", "parent", "children", "depth", "init",
+                 "entry", "exit", "transitions")
+
+    def __init__(self, index: int, name: str, parent, depth: int):
+        self.index = index
+        self.name = name
+        self.parent = parent  # None for Top
+        self.children = []
+        self.depth = depth  # Top is 0, its children 1, ...
+        self.init = None
+        self.entry = []
+        self.exit = []
+        self.transitions = []
+
+    @property
+    def is_top(self) -> bool:
+        return self.parent is None
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.children
+
+    def ancestors(self):
+        # parent first, Top last
+        state = self.parent
+        while state is not None:
+            yield state
+            state = state.parent
+
+    def __repr__(self) -> str:
+        return f"State({self.index}, {self.name})"
+
+
+class Diagram:
+    __slots__ = ("name", "states", "index", "events", "actions",
+                 "conditions", "options")
+
+    def __init__(self,
+                 name: str,
+                 states: list,
+                 events: list,
+                 actions: list,
+                 conditions: list,
+                 options: dict = None):
+        self.name = name
+        # topological order: Top first, then by depth and name, so that
+        # states[i].index == i and every parent precedes its children
+        self.states = states
+        self.index = {state.name: state for state in states}
+        self.events = events
+        self.actions = actions
+        self.conditions = conditions
+        # generator options set in the diagram itself
+        self.options = options or {}
+
+    @property
+    def top(self) -> State:
+        return self.states[0]
+
+    @property
+    def leaves(self) -> list:
+        return [state for state in self.states[1:] if state.is_leaf]
+
+    def as_dict(self) -> dict:
+        # the loose dict format returned by stateparser.parse_data
+        states = self.states[1:]
+
+        depth = {}
+        for state in states:
+            depth.setdefault(state.depth - 1, []).append(state.name)
+
+        def optional(state):
+            return state.name if state is not None else None
+
+        events = {}
+        for state in self.states:
+            if state.transitions:
+                events[state.name] = [{
+                    "source": t.source.name,
+                    "target": optional(t.target),
+                    "event": t.event,
+                    "condition": t.condition,
+                    "action": t.action
+                } for t in state.transitions]
+
+        return {
+            "name": self.name,
+            "states": sorted(state.name for state in states),
+            "state_parents":
+            {state.name: state.parent.name
+             for state in states},
+            "state_actions": {
+                "entry":
+                {state.name: list(state.entry)
+                 for state in self.states if state.entry},
+                "exit":
+                {state.name: list(state.exit)
+                 for state in self.states if state.exit}
+            },
+            "is_leaf_state":
+            {state.name: state.is_leaf
+             for state in self.states},
+            "depth": depth,
+            "allEvents": list(self.events),
+            "allActions": list(self.actions),
+            "allConditions": list(self.conditions),
+            "events": events,
+            "inits": {
+                state.name: state.init.name
+                for state in self.states if state.init is not None
+            }
+        }
+
+
+def _intern(name):
+    return sys.intern(name) if name else name
+
+
+def build(name: str,
+          parents: dict,
+          transitions: list,
+          inits: dict,
+          entry: dict,
+          exit: dict,
+          options: dict = None) -> Diagram:
+    # parents maps every state name to its parent name, transitions are
+    # (source, target, event, condition, action) tuples of names in diagram
+    # order, inits map a composite name to its initial state name and
+    # entry/exit map a state name to its list of actions.
+    #
+    # Runs in O(N + T) besides sorting the names of every hierarchy level.
+    child_names = {}
+    for child, parent in parents.items():
+        if child != TOP:
+            child_names.setdefault(parent, []).append(child)
+
+    top = State(0, TOP, None, 0)
+    states = [top]
+    level = [top]
+    while level:
+        next_level = [
+            State(0, sys.intern(child), parent, parent.depth + 1)
+            for parent in level for child in child_names.get(parent.name, ())
+        ]
+        next_level.sort(key=lambda state: state.name)
+        for state in next_level:
+            state.index = len(states)
+            state.parent.children.append(state)
+            states.append(state)
+        level = next_level
+
+    if len(states) != len(parents) - (TOP in parents) + 1:
+        nested = sorted(parents.keys() - {state.name for state in states})
+        if len(nested) > 5:
+            nested[5:] = [f"and {len(nested) - 5} more"]
+        raise ValueError(f"diagram {name}: states {', '.join(nested)} "
+                         "are nested in each other")
+
+    diagram = Diagram(name, states, [], [], [], options)
+    index = diagram.index
+
+    events = set()
+    actions = set()
+    conditions = set()
+
+    for source, target, event, condition, action in transitions:
+        state = index[source]
+        event = _intern(event)
+        condition = _intern(condition)
+        action = _intern(action)
+        state.transitions.append(
+            Transition(state, index[target] if target else None, event,
+                       condition, action))
+        if event:
+            events.add(event)
+        if condition:
+            conditions.add(condition)
+        if action:
+            actions.add(action)
+
+    for parent, init in inits.items():
+        index[parent].init = index[init]
+
+    for state_name, state_actions in entry.items():
+        index[state_name].entry = [_intern(a) for a in state_actions]
+        actions.update(index[state_name].entry)
+
+    for state_name, state_actions in exit.items():
+        index[state_name].exit = [_intern(a) for a in state_actions]
+        actions.update(index[state_name].exit)
+
+    diagram.events = sorted(events)
+    diagram.actions = sorted(actions)
+    diagram.conditions = sorted(conditions)
+
+    return diagram
@@ -0,0 +1,50 @@
+import os
+import pathlib
+
+BUFFER_SIZE = 1 << 16
+
+# the temporary file is created like a plain open(path, "w") would, so the
+# kernel applies the umask and the generated file gets the usual permissions
+_TMP_FLAGS = (os.O_CREAT | os.O_EXCL | os.O_WRONLY
+              | getattr(os, "O_BINARY", 0))
+
+
+def _create_tmp(path: pathlib.Path) -> tuple:
+    # (fd, name) of a new temporary file next to `path`
+    while True:
+        tmp = str(path.parent.joinpath(
+            f".{path.name}.{os.urandom(4).hex()}.tmp"))
+        try:
+            return os.open(tmp, _TMP_FLAGS, 0o666), tmp
+        except FileExistsError:
+            continue
+
+
+def write_chunks(path: pathlib.Path, chunks) -> bool:
+    # streams the chunks into a temporary file next to `path`, then either
+    # drops it when `path` already holds identical content (keeping its mtime
+    # so dependent C++ translation units are not rebuilt) or atomically moves
+    # it into place. Returns True when `path` was (re)written.
+    import filecmp
+
+    fd, tmp = _create_tmp(path)
+    try:
+        with open(fd, "w", buffering=BUFFER_SIZE) as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+        if path.is_file() and filecmp.cmp(tmp, str(path), shallow=False):
+            os.unlink(tmp)
+            return False
+
+        os.replace(tmp, str(path))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    return True
+
+
+def write_template(path: pathlib.Path, template, context) -> bool:
+    return write_chunks(path, template.generate(context))
@@ -0,0 +1,572 @@
+import core.diagnostics
+import core.output
+import core.reachability
+import core.scanner
+import core.stateparser
+import core.stats
+import mmap
+import os
+import pathlib
+
+# jinja2, concurrent.futures and traceback are imported where they are used:
+# the generator is often started once per file, and most of those runs find
+# nothing to render
+
+template_path = pathlib.Path(__file__).parent.parent.resolve().joinpath(
+    "template")
+
+
+# template set of every backend: <name>.cpp.jinja and <name>.hpp.jinja
+BACKENDS = {"hsm": "template", "table": "table", "crtp": "crtp"}
+
+# generator options, set for a whole run on the command line or for a single
+# diagram with a `' yahsmg: name=value` line, and the values they accept.
+# paths=precomputed makes the hsm backend emit every transition as straight
+# line code instead of instantiating the Tran/Init templates of hsm.hpp.
+# layout=compact stores the state of a machine as the smallest integer type
+# that fits its leaf states (resources/hsm/instances.hpp keeps many of them)
+# and makes Signal that small too.
+# queue=N gives the machine an N signal event queue (resources/hsm/queue.hpp)
+# and the post() / dispatch_all() / dispatch_batch() functions.
+# trace=N records the transitions of the hsm backend in an N record ring
+# buffer (resources/hsm/trace.hpp) and writes <name>_HSM.trace.json, which
+# names the ids in the records.
+# prune=report logs the states the machine can never be in and the
+# transitions that can never fire (core/reachability.py), prune=on also
+# leaves them out of the generated code.
+# unity=file renders the .cpp code of all diagrams of an input file into one
+# <stem>_unity.cpp, unity=directory into one <directory>_unity.cpp for all
+# inputs of a directory, keeping a header per diagram. It is only set for a
+# whole run.
+# bench=on also writes <name>_HSM.bench.cpp, a driver with stub conditions and
+# actions that times dispatching random or recorded signals, see
+# benchmark/machines.py.
+
+
+def capacity(value) -> int:
+    capacity = int(value)
+    if capacity < 0:
+        raise ValueError(value)
+    return capacity
+
+
+# a tuple of the accepted values, or a function converting the value
+OPTIONS = {
+    "backend": tuple(BACKENDS),
+    "paths": ("template", "precomputed"),
+    "layout": ("default", "compact"),
+    "queue": capacity,
+    "trace": capacity,
+    "prune": ("off", "report", "on"),
+    "unity": ("off", "file", "directory"),
+    "bench": ("off", "on")
+}
+DEFAULT_OPTIONS = {
+    "backend": "hsm",
+    "paths": "template",
+    "layout": "default",
+    "queue": 0,
+    "trace": 0,
+    "prune": "off",
+    "unity": "off",
+    "bench": "off"
+}
+
+
+def check_options(options: dict, where: str) -> dict:
+    checked = {}
+    for name, value in options.items():
+        if name not in OPTIONS:
+            raise ValueError(f"{where}: unknown option {name!r}")
+        allowed = OPTIONS[name]
+        if callable(allowed):
+            try:
+                value = allowed(value)
+            except ValueError:
+                raise ValueError(f"{where}: {name} must be a "
+                                 f"{allowed.__name__.replace('_', ' ')}, "
+                                 f"not {value!r}") from None
+        elif value not in allowed:
+            raise ValueError(f"{where}: {name} must be one of "
+                             f"{', '.join(allowed)}, not {value!r}")
+        checked[name] = value
+
+    if checked.get("trace") and checked.get("backend", "hsm") != "hsm":
+        raise ValueError(f"{where}: trace needs backend hsm")
+    return checked
+
+
+def options_key(options: dict) -> str:
+    # identifies the output of a set of options for the build cache
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    return ",".join(f"{name}={value}"
+                    for name, value in sorted(options.items()))
+
+
+def uint_type(maximum: int) -> str:
+    # the smallest unsigned integer type holding 0 to maximum
+    for bits in (8, 16, 32):
+        if maximum < 1 << bits:
+            return f"std::uint{bits}_t"
+    return "std::uint64_t"
+
+
+def environment(template_dir: pathlib.Path = template_path):
+    import jinja2
+    import core.dispatch
+
+    # compiled templates are cached across runs, by default in jinja's per
+    # user temporary directory, YAHSMG_CACHE_DIR selects another directory
+    cache_directory = os.environ.get("YAHSMG_CACHE_DIR") or None
+    if cache_directory:
+        os.makedirs(cache_directory, exist_ok=True)
+    bytecode_cache = jinja2.FileSystemBytecodeCache(cache_directory)
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir),
+                             bytecode_cache=bytecode_cache,
+                             trim_blocks=True)
+    env.globals["dispatch_table"] = core.dispatch.build
+    env.filters["uint_type"] = uint_type
+    return env
+
+
+def load_templates(template_dir: pathlib.Path = template_path,
+                   backend: str = "hsm",
+                   env=None) -> tuple:
+    if env is None:
+        env = environment(template_dir)
+    name = BACKENDS[backend]
+    return (env.get_template(f"{name}.cpp.jinja"),
+            env.get_template(f"{name}.hpp.jinja"))
+
+
+class Templates:
+    # compiles the templates of a backend on first use only
+    def __init__(self,
+                 template_dir: pathlib.Path = template_path,
+                 options: dict = None):
+        self.template_dir = template_dir
+        self.options = check_options(dict(DEFAULT_OPTIONS, **(options or {})),
+                                     "options")
+        self.env = None
+        self.loaded = {}
+
+    def load(self, backend: str = None) -> tuple:
+        if backend is None:
+            backend = self.options["backend"]
+        if backend not in self.loaded:
+            if self.env is None:
+                self.env = environment(self.template_dir)
+            self.loaded[backend] = load_templates(self.template_dir, backend,
+                                                  self.env)
+        return self.loaded[backend]
+
+    def get(self, name: str):
+        # a template that is not part of a backend
+        if self.env is None:
+            self.env = environment(self.template_dir)
+        return self.env.get_template(name)
+
+    def options_for(self, diagram) -> dict:
+        # the run's options, overridden by the diagram's own
+        if not diagram.options:
+            return self.options
+        if "unity" in diagram.options:
+            raise ValueError(f"diagram {diagram.name}: unity can only be set "
+                             "for a whole run")
+        return check_options(dict(self.options, **diagram.options),
+                             f"diagram {diagram.name}")
+
+    @property
+    def cpp(self):
+        return self.load()[0]
+
+    @property
+    def hpp(self):
+        return self.load()[1]
+
+
+def output_directory(inputfile: pathlib.Path) -> pathlib.Path:
+    return inputfile.parent.joinpath("generated")
+
+
+def unity_output(inputfile: pathlib.Path, unity: str) -> pathlib.Path:
+    # the .cpp code of every diagram of an input, compiled on its own with
+    # unity=file and included by the directory's unity file otherwise
+    suffix = ".cpp" if unity == "file" else ".inc"
+    return output_directory(inputfile).joinpath(
+        f"{inputfile.stem}_unity{suffix}")
+
+
+def directory_unity_output(outputpath: pathlib.Path,
+                           name: str = None) -> pathlib.Path:
+    # named after the directory holding the generated directory unless a
+    # name is given
+    if name is None:
+        name = outputpath.resolve().parent.name
+    return outputpath.joinpath(f"{name}_unity.cpp")
+
+
+def prepare_diagram(diagram, templates: Templates, log=print) -> tuple:
+    # the diagram to render, pruned when asked, and its options
+    options = templates.options_for(diagram)
+    if options["prune"] != "off":
+        reachability = core.reachability.analyse(diagram)
+        for message in reachability.report():
+            log(message)
+        if options["prune"] == "on":
+            diagram = core.reachability.prune(diagram, reachability)
+    return diagram, options
+
+
+def diagram_files(diagram, options: dict, templates: Templates) -> list:
+    # a (file name, template) pair for every file generated for the diagram,
+    # the .cpp file first
+    cpp, hpp = templates.load(options["backend"])
+    files = [(diagram.name + "_HSM.cpp", cpp), (diagram.name + "_HSM.hpp", hpp)]
+    if options["trace"]:
+        files.append((diagram.name + "_HSM.trace.json",
+                      templates.get("trace.json.jinja")))
+    if options["bench"] == "on":
+        files.append((diagram.name + "_HSM.bench.cpp",
+                      templates.get("bench.cpp.jinja")))
+    return files
+
+
+def render_diagram(diagram,
+                   outputpath: pathlib.Path,
+                   templates: Templates,
+                   log=print,
+                   stats=None,
+                   sources: list = None) -> list:
+    # returns an (output, written) pair for every generated file. With
+    # `sources` the .cpp code is appended to it instead of written to
+    # <name>_HSM.cpp.
+    diagram, options = prepare_diagram(diagram, templates, log)
+    context = {"diagram": diagram, "options": options}
+    files = diagram_files(diagram, options, templates)
+
+    if sources is not None:
+        chunks = files.pop(0)[1].generate(context)
+        if stats is not None:
+            chunks = stats.timed_chunks(chunks)
+        sources.append("".join(chunks))
+
+    return [
+        _write(outputpath.joinpath(name), template.generate(context), log,
+               stats) for name, template in files
+    ]
+
+
+def render_diagrams(diagrams,
+                    inputfile: pathlib.Path,
+                    templates: Templates,
+                    log=print,
+                    stats=None) -> list:
+    # renders the diagrams of an input file, `diagrams` can be a lazy
+    # iterator. Returns an (output, written) pair for every generated file.
+    outputpath = output_directory(inputfile)
+    unity = templates.options["unity"]
+    sources = None if unity == "off" else []
+
+    outputs = []
+    for diagram in diagrams:
+        outputs += render_diagram(diagram, outputpath, templates, log, stats,
+                                  sources)
+    if sources:
+        outputs.append(
+            _write(unity_output(inputfile, unity), [unity_source(sources)],
+                   log, stats))
+    return outputs
+
+
+def unity_source(sources: list) -> str:
+    # the .cpp code of several diagrams as one translation unit
+    return "\n".join(sources)
+
+
+def unity_directory_source(parts: list) -> str:
+    # includes the unity=directory output of the inputs of a directory
+    return "".join(f'#include "{part}"\n' for part in sorted(parts))
+
+
+def write_unity_directory(outputpath: pathlib.Path,
+                          inputs: list,
+                          log=print) -> tuple:
+    # <directory>_unity.cpp including the unity=directory output of the given
+    # inputs of a directory, returns its (output, written) pair or None when
+    # none of them has diagrams
+    parts = [unity_output(inputfile, "directory") for inputfile in inputs]
+    parts = [part.name for part in parts if part.is_file()]
+    if not parts:
+        return None
+    return _write(directory_unity_output(outputpath),
+                  [unity_directory_source(parts)], log)
+
+
+def _write(output: pathlib.Path, chunks, log, stats=None) -> tuple:
+    if stats is None:
+        written = core.output.write_chunks(output, chunks)
+    else:
+        written = _write_with_stats(output, chunks, stats)
+
+    if written:
+        log(f"generated {str(output)}")
+    else:
+        log(f"unchanged {str(output)}")
+    return output, written
+
+
+def _write_with_stats(output: pathlib.Path, chunks, stats) -> bool:
+    render_time = stats.times["render"]
+    start = core.stats.clock()
+    written = core.output.write_chunks(output, stats.timed_chunks(chunks))
+    stats.times["write"] += (core.stats.clock() - start -
+                             (stats.times["render"] - render_time))
+
+    stats.outputs += 1
+    if written:
+        stats.written += 1
+        stats.bytes_written += output.stat().st_size
+    return written
+
+
+def parse(inputfile: pathlib.Path,
+          templates: Templates,
+          log=print,
+          stats=None,
+          diagnostics=None) -> list:
+    # `stats` is a core.stats.FileStats to fill in, or None. The lines that
+    # are not understood go to `diagnostics`, a core.diagnostics.Diagnostics.
+    outputpath = output_directory(inputfile)
+    outputs = []
+
+    log(f"parsing {str(inputfile)}")
+
+    if stats is not None:
+        start = core.stats.clock()
+
+    with open(str(inputfile), "rb") as f:
+        # an empty file cannot be mapped, and has nothing to generate anyway
+        if os.fstat(f.fileno()).st_size == 0:
+            return outputs
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmap_file:
+            found = mmap_file.find(b"@startuml") != -1
+
+            if stats is not None:
+                stats.times["scan"] = core.stats.clock() - start
+                stats.lines = core.stateparser.count_lines(mmap_file)
+
+            if not found:
+                return outputs
+
+            outputpath.mkdir(parents=True, exist_ok=True)
+
+            if stats is None:
+                diagrams = core.stateparser.iter_diagrams(
+                    mmap_file, diagnostics=diagnostics)
+            else:
+                # compile the templates up front, that is not parse time
+                templates.load()
+                diagrams = core.stateparser.iter_diagrams(
+                    mmap_file,
+                    parser_type=stats.parser,
+                    diagnostics=diagnostics)
+                start = core.stats.clock()
+
+            # each diagram is rendered as soon as its @enduml has been parsed
+            outputs += [
+                output for output, _ in render_diagrams(
+                    diagrams, inputfile, templates, log, stats)
+            ]
+
+            if stats is not None:
+                # whatever the other phases did not take was spent parsing
+                times = stats.times
+                times["parse"] = (core.stats.clock() - start -
+                                  times["finalise"] - times["render"] -
+                                  times["write"])
+
+    return outputs
+
+
+def collect_inputs(path: pathlib.Path,
+                   scanner=None,
+                   jobs: int = 1,
+                   keep=None) -> list:
+    if scanner is None:
+        scanner = core.scanner.Scanner()
+    return scanner.scan(path, jobs, keep)
+
+
+class FileResult:
+    __slots__ = ("inputfile", "messages", "diagnostics", "error", "outputs",
+                 "skipped", "stats")
+
+    def __init__(self, inputfile: pathlib.Path):
+        self.inputfile = inputfile
+        self.messages = []
+        self.diagnostics = core.diagnostics.Diagnostics(str(inputfile))
+        self.error = None
+        self.outputs = []
+        self.skipped = False
+        self.stats = None  # core.stats.FileStats when asked for
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def generate_file(inputfile: pathlib.Path,
+                  templates: Templates,
+                  stats: bool = False,
+                  max_diagnostics: int = core.diagnostics.DEFAULT_LIMIT
+                  ) -> FileResult:
+    result = FileResult(inputfile)
+    result.diagnostics.limit = max_diagnostics
+    if stats:
+        result.stats = core.stats.FileStats()
+
+    try:
+        result.outputs = parse(inputfile, templates, result.messages.append,
+                               result.stats, result.diagnostics)
+    except Exception as e:
+        import traceback
+        result.error = "".join(traceback.format_exception_only(
+            type(e), e)).strip()
+
+    return result
+
+
+# per worker process state, created by the pool initializer so the templates
+# are compiled at most once per worker and reused for every file it receives
+_worker_templates = None
+
+
+def _init_worker(options: dict) -> None:
+    global _worker_templates
+    _worker_templates = Templates(options=options)
+
+
+def _generate_in_worker(inputfile: pathlib.Path,
+                        stats: bool = False,
+                        max_diagnostics: int = core.diagnostics.DEFAULT_LIMIT
+                        ) -> FileResult:
+    return generate_file(inputfile, _worker_templates, stats, max_diagnostics)
+
+
+def _generate_serial(inputs: list, stats: bool, options: dict,
+                     max_diagnostics: int):
+    templates = Templates(options=options)
+    for inputfile in inputs:
+        yield generate_file(inputfile, templates, stats, max_diagnostics)
+
+
+def _generate_parallel(inputs: list, jobs: int, stats: bool, options: dict,
+                       max_diagnostics: int):
+    import concurrent.futures
+    import functools
+
+    jobs = min(jobs, len(inputs))
+    chunksize = max(1, len(inputs) // (jobs * 4))
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(options, )) as executor:
+        work = functools.partial(_generate_in_worker,
+                                 stats=stats,
+                                 max_diagnostics=max_diagnostics)
+        yield from executor.map(work, inputs, chunksize=chunksize)
+
+
+def _skipped(inputfile: pathlib.Path, outputs: list) -> FileResult:
+    result = FileResult(inputfile)
+    result.skipped = True
+    result.outputs = outputs
+    result.messages.append(f"up to date {str(inputfile)}")
+    return result
+
+
+def _finish_directory(result: FileResult, last: dict,
+                      directories: dict) -> None:
+    directory = last.get(result.inputfile)
+    if directory is None:
+        return
+    try:
+        output = write_unity_directory(directory, directories[directory],
+                                       result.messages.append)
+    except OSError as e:
+        if result.ok:
+            result.error = f"{type(e).__name__}: {e}"
+        return
+    if output is not None and output[0] not in result.outputs:
+        result.outputs.append(output[0])
+
+
+def generate_files(inputs: list,
+                   jobs: int = 1,
+                   cache=None,
+                   stats: bool = False,
+                   options: dict = None,
+                   max_diagnostics: int = core.diagnostics.DEFAULT_LIMIT):
+    # yields a FileResult per input, always in the order of `inputs`. With
+    # `stats` every generated result carries a core.stats.FileStats.
+    # `options` overrides DEFAULT_OPTIONS for every diagram. Every result
+    # carries at most `max_diagnostics` diagnostics, 0 for all. The results
+    # of inputs the cache finds up to date carry the outputs it recorded.
+    keys = {}
+    stale = inputs
+    if cache is not None:
+        stale = []
+        for inputfile in inputs:
+            try:
+                key = cache.key(inputfile)
+            except OSError:
+                # unreadable input, let the generator report the error
+                key = None
+            if key is None or not cache.is_fresh(
+                    inputfile, output_directory(inputfile), key):
+                keys[inputfile] = key
+                stale.append(inputfile)
+
+    # with unity=directory the directory's unity file is written once the
+    # last input of the directory has been generated
+    directories = {}
+    if (options or {}).get("unity") == "directory":
+        for inputfile in inputs:
+            directories.setdefault(output_directory(inputfile),
+                                   []).append(inputfile)
+    last = {files[-1]: directory for directory, files in directories.items()}
+
+    if jobs == 1 or len(stale) < 2:
+        generated = _generate_serial(stale, stats, options, max_diagnostics)
+    else:
+        generated = _generate_parallel(stale, jobs, stats, options,
+                                       max_diagnostics)
+
+    try:
+        for inputfile in inputs:
+            if cache is not None and inputfile not in keys:
+                result = _skipped(
+                    inputfile,
+                    cache.outputs(inputfile, output_directory(inputfile)))
+                _finish_directory(result, last, directories)
+                yield result
+                continue
+
+            result = next(generated)
+            _finish_directory(result, last, directories)
+            if cache is not None and keys[inputfile] is not None:
+                outputpath = output_directory(inputfile)
+                if result.ok:
+                    cache.record(inputfile, outputpath, keys[inputfile],
+                                 result.outputs)
+                else:
+                    cache.forget(inputfile, outputpath)
+            yield result
+    finally:
+        generated.close()
+        if cache is not None:
+            cache.save()
@@ -0,0 +1,156 @@
+import core.model
+
+# Which states of a diagram the machine can ever be in, and which transitions
+# can ever fire, for the prune option.
+#
+# The machine starts in the initial states below Top, and a reached state can
+# take any of its transitions: guards are not evaluated, so a guarded
+# transition is assumed to fire sometimes. Entering a state enters its
+# enclosing states and the initial states below it. Every state and every
+# transition is visited once, in O(N + T).
+#
+# A transition of a reached state can still never fire: when every reached
+# leaf below it handles the signal first without a guard, or when an earlier
+# transition of the same state takes the signal without a guard.
+
+
+class Reachability:
+    __slots__ = ("diagram", "reached", "live")
+
+    def __init__(self, diagram, reached: set, live: set):
+        self.diagram = diagram
+        self.reached = reached
+        self.live = live  # transitions that can fire
+
+    @property
+    def unreachable_states(self) -> list:
+        return [
+            state for state in self.diagram.states
+            if state not in self.reached
+        ]
+
+    @property
+    def dead_transitions(self) -> list:
+        # the transitions of reached states that can never fire, those of
+        # the unreachable states are dead as well
+        return [
+            transition for state in self.diagram.states
+            if state in self.reached for transition in state.transitions
+            if transition not in self.live
+        ]
+
+    def report(self) -> list:
+        name = self.diagram.name
+        messages = [
+            f"diagram {name}: state {state.name} is unreachable"
+            for state in self.unreachable_states
+        ]
+        for transition in self.dead_transitions:
+            target = transition.target.name if transition.target else None
+            messages.append(
+                f"diagram {name}: {transition.source.name} --> {target} : "
+                f"{transition.event} never fires")
+        return messages
+
+
+def analyse(diagram) -> Reachability:
+    reached = set()
+    pending = []
+
+    def reach(state):
+        # the state and its enclosing states
+        while state is not None and state not in reached:
+            reached.add(state)
+            pending.append(state)
+            state = state.parent
+
+    reach(diagram.top)
+    for state in pending:
+        # the initial state of every reached composite state counts as
+        # reached, even when the transitions only go to other states below
+        # it: the generated code needs the initial transition regardless
+        if state.init is not None:
+            reach(state.init)
+        for transition in state.transitions:
+            if transition.target is not None:
+                reach(transition.target)
+
+    # covered[state]: the signals every reached leaf below the state takes
+    # without a guard before they get to it, None when no reached leaf is
+    # below it. Children come after their parent in diagram.states, so going
+    # backwards a state's children are done before the state. A child's set
+    # is not needed once its transitions are done and becomes the parent's,
+    # so no set is copied.
+    covered = {}
+    live = set()
+    for state in reversed(diagram.states):
+        if state not in reached:
+            continue
+        if state.is_leaf and state.parent is not None:
+            signals = set()
+        else:
+            signals = None
+            for child in state.children:
+                below = covered.pop(child, None)
+                if below is None:
+                    continue
+                below.update(transition.event
+                             for transition in child.transitions
+                             if transition.event and not transition.condition)
+                if signals is None:
+                    signals = below
+                else:
+                    signals &= below
+        covered[state] = signals
+        if signals is None:
+            continue
+
+        # the signals taken by an earlier transition of the state
+        taken = set()
+        for transition in state.transitions:
+            if not transition.event:
+                live.add(transition)
+            elif (transition.event not in signals
+                  and transition.event not in taken):
+                live.add(transition)
+                if not transition.condition:
+                    taken.add(transition.event)
+
+    return Reachability(diagram, reached, live)
+
+
+def prune(diagram, reachability: Reachability = None):
+    # a copy of the diagram without the unreachable states and the
+    # transitions that never fire. It keeps every signal, action and
+    # condition, which are the interface of the generated class.
+    if reachability is None:
+        reachability = analyse(diagram)
+    reached = reachability.reached
+    live = reachability.live
+
+    states = [state for state in diagram.states if state in reached]
+
+    def optional(state):
+        return state.name if state is not None else None
+
+    pruned = core.model.build(
+        diagram.name,
+        {state.name: state.parent.name
+         for state in states[1:]},
+        [(transition.source.name, optional(transition.target),
+          transition.event, transition.condition, transition.action)
+         for state in states for transition in state.transitions
+         if transition in live],
+        {
+            state.name: state.init.name
+            for state in states if state.init is not None
+        },
+        {state.name: state.entry
+         for state in states if state.entry},
+        {state.name: state.exit
+         for state in states if state.exit},
+        diagram.options)
+    pruned.events = diagram.events
+    pruned.actions = diagram.actions
+    pruned.conditions = diagram.conditions
+    return pruned
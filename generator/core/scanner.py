@@ -0,0 +1,160 @@
+import fnmatch
+import os
+import pathlib
+
+DEFAULT_EXTENSIONS = (".puml", ".h", ".hpp", ".cpp")
+
+# the version control metadata and our own output directories never hold
+# diagrams that need generating
+DEFAULT_EXCLUDES = (".git", "generated")
+
+MARKER = b"@startuml"
+BLOCK_SIZE = 1 << 20
+
+
+def contains_diagram(path: str) -> bool:
+    # byte level prefilter, nothing is decoded. The end of the previous
+    # blocks is kept so a marker spanning two blocks is still found.
+    overlap = len(MARKER) - 1
+    try:
+        with open(path, "rb") as f:
+            tail = b""
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                if MARKER in block or MARKER in tail + block[:overlap]:
+                    return True
+                tail = (tail + block[-overlap:])[-overlap:]
+    except OSError:
+        return False
+    return False
+
+
+class Scanner:
+    def __init__(self,
+                 extensions: tuple = DEFAULT_EXTENSIONS,
+                 excludes: tuple = DEFAULT_EXCLUDES,
+                 prefilter: bool = True):
+        self.extensions = tuple(extensions)
+        self.prefilter = prefilter
+
+        # patterns ending in "/" only exclude directories, patterns containing
+        # a "/" are matched against the path relative to the scanned root and
+        # any other pattern against the file or directory name
+        self.name_excludes = []
+        self.path_excludes = []
+        self.dir_name_excludes = []
+        self.dir_path_excludes = []
+        for pattern in excludes:
+            directories_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if "/" in pattern and directories_only:
+                self.dir_path_excludes.append(pattern)
+            elif "/" in pattern:
+                self.path_excludes.append(pattern)
+            elif directories_only:
+                self.dir_name_excludes.append(pattern)
+            else:
+                self.name_excludes.append(pattern)
+
+    def _excluded(self, name: str, relative: str, is_dir: bool) -> bool:
+        for pattern in self.name_excludes:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        for pattern in self.path_excludes:
+            if fnmatch.fnmatchcase(relative, pattern):
+                return True
+        if is_dir:
+            for pattern in self.dir_name_excludes:
+                if fnmatch.fnmatchcase(name, pattern):
+                    return True
+            for pattern in self.dir_path_excludes:
+                if fnmatch.fnmatchcase(relative, pattern):
+                    return True
+        return False
+
+    def entries(self, root, start=None):
+        # yields (is_directory, path) for start (root by default), for every
+        # directory below it and for every file with a matching extension,
+        # leaving out whatever is excluded relative to root
+        start = str(root) if start is None else str(start)
+        prefix = os.path.relpath(start, str(root)).replace(os.sep, "/")
+        prefix = "" if prefix == "." else prefix + "/"
+
+        yield True, start
+        stack = [(start, prefix)]
+        while stack:
+            directory, prefix = stack.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+
+            with entries:
+                for entry in entries:
+                    name = entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            relative = prefix + name
+                            if not self._excluded(name, relative, True):
+                                yield True, entry.path
+                                stack.append((entry.path, relative + "/"))
+                        elif (name.endswith(self.extensions)
+                              and entry.is_file() and not self._excluded(
+                                  name, prefix + name, False)):
+                            yield False, entry.path
+                    except OSError:
+                        continue
+
+    def walk(self, root: pathlib.Path, start: pathlib.Path = None):
+        # yields the path of every file with a matching extension below root
+        return (path for is_dir, path in self.entries(root, start)
+                if not is_dir)
+
+    def directories(self, root: pathlib.Path, start: pathlib.Path = None):
+        return (path for is_dir, path in self.entries(root, start) if is_dir)
+
+    def accepts(self, root: pathlib.Path, path: str,
+                is_dir: bool = False) -> bool:
+        # whether walk(root) yields the file, or directories(root) the
+        # directory, at path
+        relative = os.path.relpath(path, str(root)).replace(os.sep, "/")
+        if relative == ".." or relative.startswith("../"):
+            return False
+
+        *directories, name = relative.split("/")
+        if not is_dir and not name.endswith(self.extensions):
+            return False
+
+        prefix = ""
+        for directory in directories:
+            if self._excluded(directory, prefix + directory, True):
+                return False
+            prefix += directory + "/"
+
+        return not self._excluded(name, relative, is_dir)
+
+    def scan(self, path: pathlib.Path, jobs: int = 1, keep=None) -> list:
+        # a single file is always used as is, directories are walked and every
+        # candidate without a @startuml is dropped before any parsing. keep,
+        # when given, selects the candidates by their path before any of them
+        # is read.
+        if not path.is_dir():
+            return [path] if keep is None or keep(str(path)) else []
+
+        candidates = list(self.walk(path))
+        if keep is not None:
+            candidates = [c for c in candidates if keep(c)]
+
+        if self.prefilter:
+            if jobs > 1 and len(candidates) > 1:
+                # reading files releases the GIL, threads are enough here
+                import concurrent.futures
+                with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                    keep = list(executor.map(contains_diagram, candidates))
+            else:
+                keep = [contains_diagram(c) for c in candidates]
+            candidates = [c for c, k in zip(candidates, keep) if k]
+
+        # the walk order depends on the filesystem, sort so that every run
+        # (and every --jobs setting) processes and reports files identically
+        candidates.sort()
+        return [pathlib.Path(c) for c in candidates]
@@ -0,0 +1,457 @@
+import core.cache
+import core.diagnostics
+import core.pipeline
+import core.scanner
+import core.stateparser
+import json
+import os
+import pathlib
+import select
+import socket
+import socketserver
+import struct
+import threading
+
+# Watch mode: the templates and the parsed diagrams stay in memory, changed
+# inputs are regenerated as soon as the watcher notices them and build tools
+# ask for "everything up to date" over a unix socket instead of starting a
+# new generator process.
+#
+# Protocol: one JSON object per line in both directions.
+#   {"command": "ensure"}                      regenerate every changed input
+#   {"command": "ensure", "paths": [...]}      ... and check these files too
+#   {"command": "status"}
+#   {"command": "shutdown"}
+# Every response carries "ok", "ensure" responses also list the outputs that
+# were rewritten while handling the request ("generated") and the inputs that
+# failed ("failed"). Once an ensure response arrives, every change made before
+# the request was sent has been generated.
+
+
+def _signature(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class PollingWatcher:
+    # stat based fallback, every call of changes() walks the roots
+    def __init__(self, roots: list, scanner: core.scanner.Scanner):
+        self.roots = roots
+        self.scanner = scanner
+        self.signatures = self._snapshot()
+
+    def _snapshot(self) -> dict:
+        return {
+            path: _signature(path)
+            for root in self.roots for path in self.scanner.walk(root)
+        }
+
+    def wait(self, timeout: float, stopping: threading.Event) -> None:
+        stopping.wait(timeout)
+
+    def changes(self) -> set:
+        current = self._snapshot()
+        changed = {
+            path
+            for path, signature in current.items()
+            if self.signatures.get(path) != signature
+        }
+        changed.update(self.signatures.keys() - current.keys())
+        self.signatures = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CLOSE_WRITE = 0x00000008
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+            | IN_DELETE | IN_DELETE_SELF)
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, roots: list, scanner: core.scanner.Scanner):
+        import ctypes
+        import ctypes.util
+
+        self.roots = roots
+        self.scanner = scanner
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.watches = {}
+        try:
+            for root in roots:
+                for directory in scanner.directories(root):
+                    self._add_watch(root, directory)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_watch(self, root, directory: str) -> None:
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                         self.MASK)
+        if wd < 0:
+            # typically ENOSPC, fs.inotify.max_user_watches is exhausted
+            raise OSError(ctypes.get_errno(),
+                          f"cannot watch {directory}")
+        self.watches[wd] = (root, directory)
+
+    def _watch_new_directory(self, root, path: str, changed: set) -> None:
+        # files can land in the directory before the watch is in place, so
+        # everything already there is reported as changed
+        for is_dir, found in self.scanner.entries(root, path):
+            if is_dir:
+                self._add_watch(root, found)
+            else:
+                changed.add(found)
+
+    def wait(self, timeout: float, stopping: threading.Event) -> None:
+        select.select([self.fd], [], [], timeout)
+
+    def changes(self):
+        # returns the changed input files, or None when events were lost and
+        # everything has to be checked
+        changed = set()
+        overflow = False
+
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                watch = self.watches.get(wd)
+                if watch is None or not name:
+                    continue
+
+                root, directory = watch
+                path = os.path.join(directory, name)
+
+                if mask & self.IN_ISDIR:
+                    if (mask & (self.IN_CREATE | self.IN_MOVED_TO)
+                            and self.scanner.accepts(root, path, True)):
+                        try:
+                            self._watch_new_directory(root, path, changed)
+                        except OSError:
+                            overflow = True
+                    continue
+
+                if self.scanner.accepts(root, path):
+                    changed.add(path)
+
+        return None if overflow else changed
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(roots: list, scanner: core.scanner.Scanner,
+                 poll: bool = False):
+    if not poll:
+        try:
+            return InotifyWatcher(roots, scanner)
+        except (OSError, AttributeError, TypeError):
+            # not linux, no libc or out of watches
+            pass
+    return PollingWatcher(roots, scanner)
+
+
+class Workspace:
+    def __init__(self,
+                 roots: list,
+                 scanner: core.scanner.Scanner,
+                 template_dir: pathlib.Path = core.pipeline.template_path,
+                 cache: bool = True,
+                 log=print,
+                 options: dict = None,
+                 max_diagnostics: int = core.diagnostics.DEFAULT_LIMIT):
+        self.roots = [pathlib.Path(root).resolve() for root in roots]
+        self.scanner = scanner
+        self.template_dir = template_dir
+        self.use_cache = cache
+        self.options = options
+        self.max_diagnostics = max_diagnostics
+        self.log = log
+
+        # input path -> (stat signature, diagrams, cache key of the parsed
+        # content)
+        self.models = {}
+        self.lock = threading.RLock()
+        self._load_templates()
+
+    def _template_signature(self) -> tuple:
+        return tuple(
+            (str(path), _signature(str(path)))
+            for path in sorted(self.template_dir.rglob("*.jinja")))
+
+    def _load_templates(self) -> None:
+        self.template_signature = self._template_signature()
+        self.templates = core.pipeline.Templates(self.template_dir,
+                                                 self.options)
+        self.templates.load()
+        self.cache = (core.cache.BuildCache(
+            self.template_dir, core.pipeline.options_key(self.options))
+                      if self.use_cache else None)
+
+    def inputs(self) -> list:
+        inputs = []
+        for root in self.roots:
+            inputs += [str(path) for path in self.scanner.scan(root)]
+        return inputs
+
+    def _render(self, path: str, diagrams: list, key: str,
+                report: dict) -> None:
+        inputfile = pathlib.Path(path)
+        outputpath = core.pipeline.output_directory(inputfile)
+        outputpath.mkdir(parents=True, exist_ok=True)
+
+        outputs = []
+        for output, written in core.pipeline.render_diagrams(
+                diagrams, inputfile, self.templates, self.log):
+            outputs.append(output)
+            if written:
+                report["generated"].append(str(output))
+
+        # without a key the outputs are not recorded as up to date
+        if self.cache is not None:
+            if key is None:
+                self.cache.forget(inputfile, outputpath)
+            else:
+                self.cache.record(inputfile, outputpath, key, outputs)
+
+    def _update(self, path: str, report: dict) -> None:
+        signature = _signature(path)
+        model = self.models.get(path)
+        if model is not None and model[0] == signature:
+            return
+
+        if signature is None or not core.scanner.contains_diagram(path):
+            self.models.pop(path, None)
+            return
+
+        self.log(f"parsing {path}")
+        diagnostics = core.diagnostics.Diagnostics(path, self.max_diagnostics)
+        try:
+            # the key is that of the content parsed, the file can be saved
+            # again while it is rendered
+            data = pathlib.Path(path).read_bytes()
+            key = None if self.cache is None else self.cache.key(
+                pathlib.Path(path), data)
+            diagrams = list(
+                core.stateparser.iter_diagrams(data, diagnostics=diagnostics))
+            for line in diagnostics.lines():
+                self.log(line)
+            self.models[path] = (signature, diagrams, key)
+            self._render(path, diagrams, key, report)
+        except Exception as e:
+            self.models.pop(path, None)
+            report["failed"][path] = f"{type(e).__name__}: {e}"
+            self.log(f"error: {path}: {type(e).__name__}: {e}")
+
+    def _write_unity_directories(self, report: dict) -> None:
+        directories = {}
+        for path in self.models:
+            inputfile = pathlib.Path(path)
+            directories.setdefault(core.pipeline.output_directory(inputfile),
+                                   []).append(inputfile)
+        for directory, inputs in sorted(directories.items()):
+            output = core.pipeline.write_unity_directory(
+                directory, inputs, self.log)
+            if output is not None and output[1]:
+                report["generated"].append(str(output[0]))
+
+    def update(self, paths) -> dict:
+        # regenerates the given inputs (everything when paths is None) if
+        # they changed since they were last generated
+        report = {"generated": [], "failed": {}}
+
+        with self.lock:
+            if self._template_signature() != self.template_signature:
+                self.log("templates changed, rendering every diagram")
+                self._load_templates()
+                # the keys of the parsed content were those of the old
+                # templates, the inputs are recorded again once they change
+                for path, (_, diagrams, _) in sorted(self.models.items()):
+                    try:
+                        self._render(path, diagrams, None, report)
+                    except Exception as e:
+                        report["failed"][path] = f"{type(e).__name__}: {e}"
+
+            if paths is None:
+                paths = self.inputs()
+                for path in self.models.keys() - set(paths):
+                    del self.models[path]
+
+            for path in sorted(paths):
+                self._update(path, report)
+
+            if self.templates.options["unity"] == "directory":
+                self._write_unity_directories(report)
+
+            if self.cache is not None:
+                self.cache.save()
+
+        report["ok"] = not report["failed"]
+        return report
+
+
+class GeneratorServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workspace: Workspace, watcher):
+        self.workspace = workspace
+        self.watcher = watcher
+        self.stopping = threading.Event()
+        super().__init__(socket_path, _RequestHandler)
+
+    def refresh(self, paths: list = None) -> dict:
+        # regenerates the inputs the watcher saw change and the given paths.
+        # The lock is held from taking the changes until they are generated,
+        # a request arriving meanwhile waits for them instead of finding
+        # nothing left to do.
+        with self.workspace.lock:
+            changed = self.watcher.changes()
+            if changed is not None and paths:
+                changed |= {str(pathlib.Path(p).resolve()) for p in paths}
+            return self.workspace.update(changed)
+
+    def ensure(self, paths: list = None) -> dict:
+        return self.refresh(paths)
+
+    def handle_request_data(self, request: dict) -> dict:
+        command = request.get("command")
+        if command == "ensure":
+            return self.ensure(request.get("paths"))
+        if command == "status":
+            with self.workspace.lock:
+                return {
+                    "ok": True,
+                    "roots": [str(root) for root in self.workspace.roots],
+                    "inputs": len(self.workspace.models),
+                    "diagrams": sum(
+                        len(diagrams)
+                        for _, diagrams, _ in self.workspace.models.values()),
+                    "watcher": type(self.watcher).__name__
+                }
+        if command == "shutdown":
+            self.stopping.set()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command {command!r}"}
+
+    def watch(self, interval: float) -> None:
+        # runs until a shutdown request arrives
+        while not self.stopping.is_set():
+            self.watcher.wait(interval, self.stopping)
+            if not self.stopping.is_set():
+                self.refresh()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                response = {"ok": False, "error": f"invalid request: {e}"}
+            else:
+                response = self.server.handle_request_data(request)
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+def request(socket_path: str, command: str = "ensure", **fields) -> dict:
+    # client side, for build scripts written in python
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(
+            json.dumps(dict(fields, command=command)).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def _claim_socket(socket_path: str) -> None:
+    if not os.path.exists(socket_path):
+        return
+
+    try:
+        request(socket_path, "status")
+    except OSError:
+        # left behind by a server that did not shut down cleanly
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError(f"a generator is already serving {socket_path}")
+
+
+def serve(roots: list,
+          socket_path: str,
+          scanner: core.scanner.Scanner,
+          cache: bool = True,
+          poll: bool = False,
+          interval: float = 1.0,
+          log=print,
+          options: dict = None,
+          max_diagnostics: int = core.diagnostics.DEFAULT_LIMIT) -> None:
+    _claim_socket(socket_path)
+
+    workspace = Workspace(roots,
+                          scanner,
+                          cache=cache,
+                          log=log,
+                          options=options,
+                          max_diagnostics=max_diagnostics)
+    watcher = make_watcher(workspace.roots, scanner, poll)
+    workspace.update(None)
+
+    with GeneratorServer(socket_path, workspace, watcher) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        log(f"serving {socket_path}, watching with "
+            f"{type(watcher).__name__}")
+        try:
+            server.watch(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            watcher.close()
+            os.unlink(socket_path)
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import pathlib
+
+# Splitting one generation run over N machines without any coordination:
+# every input file belongs to a single shard, chosen by a hash of its path
+# relative to the searched directory, so every machine computes the same
+# split from its own checkout. With unity=directory the hash is that of the
+# input's directory instead, the directory's unity file needs all its inputs
+# generated together.
+#
+# Every shard can write a run manifest naming the outputs of its inputs,
+# merge() combines the manifests of all shards into the manifest of the whole
+# run and checks that the shards did not overlap and none is missing.
+
+MANIFEST_FORMAT = 1
+
+
+def shard(value: str) -> tuple:
+    # "i/N" to (i, N), shards count from 1
+    index, sep, count = value.partition("/")
+    if not sep:
+        raise ValueError(value)
+    index, count = int(index), int(count)
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(value)
+    return index, count
+
+
+def common_root(roots) -> pathlib.Path:
+    # the folder the inputs are named relative to: the names below it are
+    # unique across all the searched folders, and with one folder they are
+    # relative to that folder
+    return pathlib.Path(
+        os.path.commonpath([os.path.abspath(str(root)) for root in roots]))
+
+
+def relative_name(inputfile: pathlib.Path, root: pathlib.Path) -> str:
+    # the same on every machine and operating system
+    return pathlib.PurePath(
+        os.path.relpath(os.path.abspath(str(inputfile)),
+                        str(root))).as_posix()
+
+
+def shard_of(name: str, count: int) -> int:
+    # a stable hash, unlike hash() of a str which differs per process
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def in_shard(name: str,
+             index: int,
+             count: int,
+             by_directory: bool = False) -> bool:
+    # only the name is needed, so inputs can be selected before they are read
+    key = name.rpartition("/")[0] if by_directory else name
+    return shard_of(key, count) == index
+
+
+def select(inputs: list,
+           names: dict,
+           index: int,
+           count: int,
+           by_directory: bool = False) -> list:
+    # the inputs of shard `index` of `count`, in order. `names` holds the
+    # relative name of every input.
+    return [
+        inputfile for inputfile in inputs
+        if in_shard(names[inputfile], index, count, by_directory)
+    ]
+
+
+def manifest_entry(result, root: pathlib.Path) -> dict:
+    # what a core.pipeline.FileResult produced, with the paths relative to
+    # the searched directory
+    if not result.ok:
+        status = "failed"
+    elif result.skipped:
+        status = "up to date"
+    else:
+        status = "generated"
+    return {
+        "status": status,
+        "outputs": sorted({relative_name(output, root)
+                           for output in result.outputs})
+    }
+
+
+def run_manifest(entries: dict, shard: tuple = None) -> dict:
+    # `entries` maps the relative name of every input to its manifest_entry()
+    return {
+        "format": MANIFEST_FORMAT,
+        "shard": list(shard) if shard else None,
+        "inputs": entries
+    }
+
+
+def write_manifest(path: pathlib.Path, manifest: dict) -> None:
+    with open(str(path), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def read_manifest(path: pathlib.Path) -> dict:
+    with open(str(path), "r") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or manifest.get(
+            "format") != MANIFEST_FORMAT:
+        raise ValueError(f"{str(path)}: not a run manifest of format "
+                         f"{MANIFEST_FORMAT}")
+    return manifest
+
+
+def merge(manifests: list) -> dict:
+    # the run manifest of all shards of a run. Raises ValueError when the
+    # manifests are not of the same run, repeat a shard, miss one, or when two
+    # of them name the same input or output.
+    count = None
+    seen = set()
+    inputs = {}
+    owners = {}  # output to the input producing it
+    for manifest in manifests:
+        shard = manifest["shard"]
+        if shard is None:
+            if len(manifests) > 1:
+                raise ValueError("an unsharded run manifest cannot be merged")
+        else:
+            index, shard_count = shard
+            if count is None:
+                count = shard_count
+            elif shard_count != count:
+                raise ValueError(f"shard {index}/{shard_count} is not one of "
+                                 f"{count} shards")
+            if index in seen:
+                raise ValueError(f"shard {index}/{count} given twice")
+            seen.add(index)
+
+        for name, entry in manifest["inputs"].items():
+            if name in inputs:
+                raise ValueError(f"input {name} is in two shards")
+            inputs[name] = entry
+            for output in entry["outputs"]:
+                if output in owners:
+                    raise ValueError(f"output {output} is generated from both "
+                                     f"{owners[output]} and {name}")
+                owners[output] = name
+
+    if count is not None:
+        missing = [str(index) for index in range(1, count + 1)
+                   if index not in seen]
+        if missing:
+            raise ValueError(f"missing shard(s) {', '.join(missing)} of "
+                             f"{count}")
+
+    return run_manifest(dict(sorted(inputs.items())))
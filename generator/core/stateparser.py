@@ -1,7 +1,9 @@
+import core.diagnostics
+import core.model
 import re
-import pprint
-import jinja2
-from jinja2.runtime import V
+import locale
+import mmap
+import os
 
 
 def replace_non_ascii(text: str) -> str:
@@ -10,6 +12,16 @@ def replace_non_ascii(text: str) -> str:
     return text
 
 
+# The line regexes below only ever run with match() on a single line and are
+# written to take linear time in its length: a quantified part is never
+# followed by a part that can match the same characters, except for a single
+# character, so a failing line backtracks over every character at most a
+# constant number of times. A pattern like ` *([\w\s]+) +\/`, where three
+# parts compete for the same spaces, is cubic in the length of a run of
+# spaces instead. The values of the groups are all passed through
+# replace_non_ascii(), which strips the spaces such patterns left out.
+# benchmark/stress.py checks the time per kilobyte on adversarial lines.
+
 # matches:
 # @startuml state name will be derived from here
 start_diagram_regex = re.compile(r"@startuml (.*)")
@@ -29,7 +41,7 @@ end_diagram_regex = re.compile(r"@enduml")
 # state_name <-> state_name : event_name / event_action
 # state_name <-> state_name : event_name [condition] / event_action
 event_regex = re.compile(
-    r"(\w+) +(<-\w*-*|-*\w*->) +([\w]+|\[\*\])(?: +: +([\w][\w ]+[\w])(?: +\[([\w ]+)\])?(?: +\/ *([\w ]+))?)"
+    r"(\w+) +(<-\w*-*|-*\w*->) +([\w]+|\[\*\])(?: +: +([\w][\w ]+[\w])(?: +\[([\w ]+)\])?(?: +\/([\w ]+))?)"
 )
 
 
@@ -95,7 +107,7 @@ composite_state_end_regex = re.compile(r"(})")
 # state_name : entryexit / entry_exit_action
 # state_name : any words before entryexit / entry_exit_action
 state_action_regex = re.compile(
-    r"([\w\d]+) *: *[\w\d ]+([Ee](?:ntry|xit)) *\/ *([\w\d ]+)")
+    r"(\w+) *:[\w ]+([Ee](?:ntry|xit)) *\/([\w ]+)")
 
 
 def parse_state_action(match: re.match) -> dict:
@@ -106,8 +118,12 @@ def parse_state_action(match: re.match) -> dict:
     }
 
 
+# matches:
+# state_name : event_name / action
+# state_name : event_name [condition] / action
+# The event takes the spaces up to the last one before the [ or /
 state_inner_action_regex = re.compile(
-    r"([\w\d]+) *: *([\w\s]+)(?: +\[([\w ]+)\])? +\/ *([\w\d ]+)")
+    r"(\w+) *:([\w\s]+) (?:\[([\w ]+)\] +)?\/([\w ]+)")
 
 
 def parse_state_inner_action(match: re.match) -> dict:
@@ -120,181 +136,287 @@ def parse_state_inner_action(match: re.match) -> dict:
     }
 
 
+# matches:
+# ' yahsmg: name=value
+# ' yahsmg: name=value, other_name=other_value
+option_regex = re.compile(r"' *yahsmg *: *(.*)")
+# a name only starts at the start of a word, findall() would otherwise retry
+# every position inside a long word that is not followed by =
+option_value_regex = re.compile(r"(?<!\w)(\w+) *= *([\w.-]+)")
+
+
+def parse_option(match: re.match) -> dict:
+    return dict(option_value_regex.findall(match.group(1)))
+
+
 class StateObject:
     def __init__(self, name):
-        self.state_stack = ["Top"]
+        self.name = name
+        self.state_stack = [core.model.TOP]
 
-        self.state_set = set()
-        self.event_set = set()
         self.state_parent = {}
-        self.state_childs = {"Top": set()}
-
-        self.parsed = {
-            "states": [],
-            "state_parents": {},
-            "state_actions": {
-                "entry": {},
-                "exit": {}
-            },
-            "is_leaf_state": {},
-            "allEvents": set(),
-            "allActions": set(),
-            "allConditions": set(),
-            "events": {},
-            "inits": {},
-            "name": name
-        }
+        self.transitions = []
+        self.inits = {}
+        self.state_actions = {"entry": {}, "exit": {}}
+        self.options = {}
 
     def handleState(self, state: str) -> None:
-        self.state_set.add(state)
-        if state not in self.state_parent:
+        parent = self.state_parent.get(state)
+        if parent is None:
             self.state_parent[state] = self.state_stack[-1]
-            self.state_childs[state] = set()
-        elif self.state_parent[
-                state] == "Top" and self.state_stack[-1] != "Top":
+        elif parent == core.model.TOP:
             self.state_parent[state] = self.state_stack[-1]
 
-        self.state_childs[self.state_stack[-1]].add(state)
+    def handleEvent(self, event: dict) -> None:
+        self.transitions.append((event["source"], event["target"],
+                                 event["event"], event["condition"],
+                                 event["action"]))
 
+        self.handleState(event["source"])
+        if event["target"]:
+            self.handleState(event["target"])
 
-def parse_data(data) -> list:
-    diagrams = []
-    state_object = None
+    def handleInit(self, init: str) -> None:
+        self.inits[self.state_stack[-1]] = init
+        self.handleState(init)
 
-    if isinstance(data, str):
-        data = data.splitlines()
+    def handleStateDeclaration(self, state: dict) -> None:
+        self.handleState(state["name"])
+        if state["composite"]:
+            self.state_stack.append(state["name"])
 
-    for line in data:
-        line = line.strip()
-        match = start_diagram_regex.match(line)
-        if match:
-            state_object = StateObject(parse_start_diagram(match))
-            continue
+    def handleCompositeStateEnd(self) -> None:
+        self.state_stack.pop()
 
-        if state_object is None:
-            continue
+    def handleStateAction(self, state_action: dict) -> None:
+        actions = self.state_actions[state_action["entry_exit"]]
+        if state_action["name"] not in actions:
+            actions[state_action["name"]] = []
 
-        match = end_diagram_regex.match(line)
-        if match:
-            state_object.parsed["states"] = sorted(list(
-                state_object.state_set))
-            state_object.parsed["state_parents"] = state_object.state_parent
+        actions[state_action["name"]].append(state_action["action"])
 
-            state_object.parsed["depth"] = {}
+        self.handleState(state_action["name"])
 
-            for state in state_object.state_parent.keys():
-                state_object.parsed["depth"][state] = 0
+    def handleOption(self, options: dict) -> None:
+        self.options.update(options)
 
-                key = state
-                while state_object.state_parent[key] != "Top":
-                    state_object.parsed["depth"][state] += 1
-                    key = state_object.state_parent[key]
+    def finish(self) -> core.model.Diagram:
+        return core.model.build(self.name, self.state_parent,
+                                self.transitions, self.inits,
+                                self.state_actions["entry"],
+                                self.state_actions["exit"], self.options)
 
-            inv_depth = {}
-            for k, v in state_object.parsed["depth"].items():
-                inv_depth[v] = inv_depth.get(v, []) + [k]
 
-            for v in inv_depth.values():
-                v.sort()
-            state_object.parsed["depth"] = inv_depth
+# Line tokens, in the order in which they used to be tried one regex at a
+# time. Their relative order matters: a line like `state --> B : event` is an
+# event, not a state declaration.
+START, END, EVENT, INIT, STATE, STATE_END, STATE_ACTION, INNER_ACTION = (
+    "start", "end", "event", "init", "state", "state_end", "state_action",
+    "inner_action")
+OPTION = "option"
 
-            if None in state_object.parsed["allEvents"]:
-                state_object.parsed["allEvents"].remove(None)
-            state_object.parsed["allEvents"] = sorted(
-                list(state_object.parsed["allEvents"]))
 
-            if None in state_object.parsed["allActions"]:
-                state_object.parsed["allActions"].remove(None)
-            state_object.parsed["allActions"] = sorted(
-                list(state_object.parsed["allActions"]))
+class _SubMatch:
+    # presents the groups of one alternative of a combined pattern with the
+    # numbering of the standalone pattern, so the parse_* helpers work on both
+    __slots__ = ("match", "offset")
 
-            if None in state_object.parsed["allConditions"]:
-                state_object.parsed["allConditions"].remove(None)
-            state_object.parsed["allConditions"] = sorted(
-                list(state_object.parsed["allConditions"]))
+    def __init__(self, match: re.Match, offset: int):
+        self.match = match
+        self.offset = offset
 
-            state_object.parsed["is_leaf_state"] = {
-                k: len(v) == 0
-                for k, v in state_object.state_childs.items()
-            }
+    def group(self, index: int):
+        return self.match.group(self.offset + index)
 
-            diagrams.append(state_object.parsed)
-            state_object = None
-            continue
 
-        match = event_regex.match(line)
-        if match:
-            event = parse_event(match)
+def _combine(*tokens) -> tuple:
+    pattern = re.compile("|".join(f"(?P<{name}>{regex.pattern})"
+                                  for name, regex in tokens))
+    return pattern, pattern.groupindex
 
-            if not event["source"] in state_object.parsed["events"]:
-                state_object.parsed["events"][event["source"]] = []
 
-            state_object.parsed["events"][event["source"]].append(event)
-            state_object.parsed["allActions"].add(event["action"])
-            state_object.parsed["allConditions"].add(event["condition"])
-            state_object.parsed["allEvents"].add(event["event"])
+# Lines starting with a word character can be any of these. Alternation keeps
+# the first alternative that matches at the start of the line, exactly like
+# trying each regex in turn, but runs as a single pass of the regex engine.
+word_line_regex, _word_line_groups = _combine(
+    (EVENT, event_regex), (INIT, init_regex), (STATE, state_regex),
+    (STATE_ACTION, state_action_regex),
+    (INNER_ACTION, state_inner_action_regex))
 
-            state_object.handleState(event["source"])
-            state_object.handleState(event["target"])
-            continue
 
-        match = init_regex.match(line)
-        if match:
-            init = parse_init(match)
-            state_object.parsed["inits"][state_object.state_stack[-1]] = init
-            state_object.handleState(init)
-            continue
+def tokenize_line(line: str) -> tuple:
+    # returns (token, match) for a stripped line inside a diagram, the token
+    # is None for lines that are not part of the supported grammar
+    if not line:
+        return None, None
 
-        match = state_regex.match(line)
-        if match:
-            state = parse_state(match)
-            state_object.handleState(state["name"])
-            if state["composite"]:
-                state_object.state_stack.append(state["name"])
-            continue
+    first = line[0]
+    if first == "@":
+        match = end_diagram_regex.match(line)
+        return (END, match) if match else (None, None)
 
-        match = composite_state_end_regex.match(line)
-        if match:
-            state_object.state_stack.pop()
-            continue
+    if first == "}":
+        return STATE_END, None
 
-        match = state_action_regex.match(line)
+    if first == "[":
+        match = init_regex.match(line)
+        return (INIT, match) if match else (None, None)
+
+    if first == "'":
+        match = option_regex.match(line)
+        return (OPTION, match) if match else (None, None)
+
+    if first.isalnum() or first == "_":
+        match = word_line_regex.match(line)
         if match:
-            state_action = parse_state_action(match)
+            token = match.lastgroup
+            return token, _SubMatch(match, _word_line_groups[token])
 
-            if state_action["name"] not in state_object.parsed[
-                    "state_actions"][state_action["entry_exit"]]:
-                state_object.parsed["state_actions"][
-                    state_action["entry_exit"]][state_action["name"]] = []
+    return None, None
 
-            state_object.parsed["state_actions"][state_action["entry_exit"]][
-                state_action["name"]].append(state_action["action"])
 
-            state_object.parsed["allActions"].add(state_action["action"])
+class DiagramParser:
+    def __init__(self):
+        self.state_object = None
+        self.line_number = 0  # of the line fed last
+        self.diagnostics = core.diagnostics.Diagnostics()
 
-            state_object.handleState(state_action["name"])
-            continue
+    tokenize = staticmethod(tokenize_line)
+    state_object_type = StateObject
 
-        match = state_inner_action_regex.match(line)
-        if match:
-            state_inner_action = parse_state_inner_action(match)
+    def feed(self, line: str):
+        # consumes one line, returns the diagram once its @enduml is reached
+        self.line_number += 1
+        line = line.strip()
 
-            if not state_inner_action["source"] in state_object.parsed[
-                    "events"]:
-                state_object.parsed["events"][
-                    state_inner_action["source"]] = []
+        if line.startswith("@startuml "):
+            self.state_object = self.state_object_type(
+                parse_start_diagram(start_diagram_regex.match(line)))
+            return None
 
-            state_object.parsed["events"][state_inner_action["source"]].append(
-                state_inner_action)
-            state_object.parsed["allActions"].add(state_inner_action["action"])
-            state_object.parsed["allConditions"].add(
-                state_inner_action["condition"])
-            state_object.parsed["allEvents"].add(state_inner_action["event"])
+        state_object = self.state_object
+        if state_object is None:
+            return None
+
+        token, match = self.tokenize(line)
+
+        if token == EVENT:
+            state_object.handleEvent(parse_event(match))
+        elif token == INNER_ACTION:
+            state_object.handleEvent(parse_state_inner_action(match))
+        elif token == STATE_ACTION:
+            state_object.handleStateAction(parse_state_action(match))
+        elif token == INIT:
+            state_object.handleInit(parse_init(match))
+        elif token == STATE:
+            state_object.handleStateDeclaration(parse_state(match))
+        elif token == STATE_END:
+            state_object.handleCompositeStateEnd()
+        elif token == OPTION:
+            state_object.handleOption(parse_option(match))
+        elif token == END:
+            self.state_object = None
+            return state_object.finish()
+        elif line:
+            self.unparsed(line)
+
+        return None
+
+    def unparsed(self, line: str) -> None:
+        self.diagnostics.add("warning", f"unparsed line: {line}",
+                             self.line_number, self.state_object.name)
+
+
+def parse_data(data, diagnostics: list = None) -> list:
+    # the lines that are not understood are added to `diagnostics` as
+    # core.diagnostics.Diagnostic entries, when given
+    diagrams = []
+    parser = DiagramParser()
+    parser.diagnostics.limit = 0
 
-            state_object.handleState(state_inner_action["source"])
-            continue
+    if isinstance(data, str):
+        data = data.splitlines()
 
-        if line:
-            print(f"Unparsed line: {line}")
+    for line in data:
+        diagram = parser.feed(line)
+        if diagram is not None:
+            diagrams.append(diagram.as_dict())
 
+    if diagnostics is not None:
+        diagnostics.extend(parser.diagnostics.entries)
     return diagrams
+
+
+# count_lines() copies at most this much of an mmap at a time
+COUNT_BLOCK_SIZE = 1 << 20
+
+
+def count_lines(buffer, start: int = 0, end: int = None) -> int:
+    # the newlines in buffer[start:end]. mmap has no count(), so it is
+    # counted a block at a time to keep the copies small.
+    if end is None:
+        end = len(buffer)
+    return sum(buffer[pos:min(pos + COUNT_BLOCK_SIZE, end)].count(b"\n")
+               for pos in range(start, end, COUNT_BLOCK_SIZE))
+
+
+def _iter_buffer_diagrams(buffer, encoding: str, parser: DiagramParser):
+    # Only the lines from a @startuml onwards are decoded and parsed, the text
+    # between diagrams is skipped with buffer.find() without being decoded.
+    size = len(buffer)
+    pos = 0
+
+    while pos < size:
+        if parser.state_object is None:
+            start = buffer.find(b"@startuml", pos)
+            if start == -1:
+                return
+            skipped = pos
+            pos = max(buffer.rfind(b"\n", pos, start) + 1, pos)
+            parser.line_number += count_lines(buffer, skipped, pos)
+
+        end = buffer.find(b"\n", pos)
+        end = size if end == -1 else end + 1
+
+        # splitlines() so the line boundaries are the same as parse_data's
+        for line in buffer[pos:end].decode(encoding).splitlines():
+            diagram = parser.feed(line)
+            if diagram is not None:
+                yield diagram
+
+        pos = end
+
+
+def iter_diagrams(source,
+                  encoding: str = None,
+                  parser_type=DiagramParser,
+                  diagnostics=None):
+    # yields every diagram as soon as its @enduml has been parsed. `source` is
+    # a path, a bytes-like object (bytes, mmap) or text / an iterable of lines.
+    # The lines that are not understood are added to `diagnostics`, a
+    # core.diagnostics.Diagnostics, when given.
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    parser = parser_type()
+    if diagnostics is not None:
+        parser.diagnostics = diagnostics
+
+    if isinstance(source, os.PathLike):
+        with open(source, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from _iter_buffer_diagrams(buffer, encoding, parser)
+        return
+
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        yield from _iter_buffer_diagrams(source, encoding, parser)
+        return
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    for line in source:
+        diagram = parser.feed(line)
+        if diagram is not None:
+            yield diagram
@@ -0,0 +1,143 @@
+import core
+import core.stateparser
+import time
+
+# Statistics for --stats. Everything here is only reached when statistics were
+# asked for: the pipeline passes stats=None otherwise and then neither wraps
+# the template output nor swaps in the counting parser.
+
+PHASES = ("scan", "parse", "finalise", "render", "write")
+
+clock = time.perf_counter
+
+
+class FileStats:
+    __slots__ = ("times", "lines", "diagram_lines", "unparsed", "diagrams",
+                 "states", "events", "transitions", "outputs", "written",
+                 "bytes_written")
+
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.lines = 0  # in the whole input file
+        self.diagram_lines = 0  # between @startuml and @enduml
+        self.unparsed = 0
+        self.diagrams = 0
+        self.states = 0
+        self.events = 0
+        self.transitions = 0
+        self.outputs = 0
+        self.written = 0  # outputs whose content changed
+        self.bytes_written = 0
+
+    def add_diagram(self, diagram) -> None:
+        self.diagrams += 1
+        self.states += len(diagram.states) - 1
+        self.events += len(diagram.events)
+        self.transitions += sum(
+            len(state.transitions) for state in diagram.states)
+
+    def timed_chunks(self, chunks):
+        # template.generate() renders lazily, so the time spent in the
+        # generator is the render time and the rest of the write is I/O
+        chunks = iter(chunks)
+        times = self.times
+        while True:
+            start = clock()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                times["render"] += clock() - start
+                return
+            times["render"] += clock() - start
+            yield chunk
+
+    def parser(self):
+        # a parser_type for core.stateparser.iter_diagrams
+        return StatsParser(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "times": dict(self.times),
+            "lines": self.lines,
+            "diagram_lines": self.diagram_lines,
+            "unparsed_lines": self.unparsed,
+            "diagrams": self.diagrams,
+            "states": self.states,
+            "events": self.events,
+            "transitions": self.transitions,
+            "outputs": self.outputs,
+            "outputs_written": self.written,
+            "bytes_written": self.bytes_written
+        }
+
+
+class _StatsStateObject(core.stateparser.StateObject):
+    def __init__(self, name, stats: FileStats):
+        super().__init__(name)
+        self.stats = stats
+
+    def finish(self):
+        start = clock()
+        diagram = super().finish()
+        self.stats.times["finalise"] += clock() - start
+        self.stats.add_diagram(diagram)
+        return diagram
+
+
+class StatsParser(core.stateparser.DiagramParser):
+    # counts the diagram lines and times finalising every diagram
+    def __init__(self, stats: FileStats):
+        super().__init__()
+        self.stats = stats
+
+    def state_object_type(self, name):
+        return _StatsStateObject(name, self.stats)
+
+    def feed(self, line: str):
+        if self.state_object is not None:
+            self.stats.diagram_lines += 1
+        elif line.lstrip().startswith("@startuml "):
+            self.stats.diagram_lines += 1
+        return super().feed(line)
+
+    def unparsed(self, line: str) -> None:
+        self.stats.unparsed += 1
+        super().unparsed(line)
+
+
+def summary(results: list, scan_time: float, total_time: float,
+            jobs: int) -> dict:
+    # the --stats=json document for a list of pipeline FileResults
+    files = []
+    totals = dict.fromkeys(PHASES, 0.0)
+    counts = {}
+    for result in results:
+        entry = {
+            "input": str(result.inputfile),
+            "ok": result.ok,
+            "skipped": result.skipped
+        }
+        if result.error is not None:
+            entry["error"] = result.error
+        if result.stats is not None:
+            entry.update(result.stats.as_dict())
+            for phase, seconds in result.stats.times.items():
+                totals[phase] += seconds
+            for name, value in entry.items():
+                if name not in ("input", "ok", "skipped", "error", "times"):
+                    counts[name] = counts.get(name, 0) + value
+        files.append(entry)
+
+    totals["scan"] += scan_time
+    return {
+        "version": core.__version__,
+        "jobs": jobs,
+        "inputs": len(results),
+        "failed": sum(not result.ok for result in results),
+        "skipped": sum(result.skipped for result in results),
+        "scan_time": scan_time,
+        "total_time": total_time,
+        "times": totals,
+        "counts": counts,
+        "files": files
+    }
@@ -1,6 +1,31 @@
 import unittest
+import benchmark.corpus as corpus
+import core.api as api
+import core.cache as cache
+import core.diagnostics as diagnostics_
+import core.dispatch as dispatch
+import core.executor as executor
+import core.pipeline as pipeline
+import core.reachability as reachability_
+import core.scanner as scanner
+import core.server as server
+import core.shard as shard_
 import core.stateparser as stateparser
+import tools.trace as trace
+import functools
+import json
+import os
+import pathlib
 import pprint
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 
 def hppdiagram(input, name):
@@ -380,5 +405,1973 @@ State3 --> End : Aborted""", "inner event action")
         self.expected = [{}]
 
 
+class TestTokenizer(unittest.TestCase):
+    def assertToken(self, line, token):
+        self.assertEqual(stateparser.tokenize_line(line)[0], token)
+
+    def test_tokens(self):
+        self.assertToken("@enduml", stateparser.END)
+        self.assertToken("A --> B : event", stateparser.EVENT)
+        self.assertToken("state --> B : event", stateparser.EVENT)
+        self.assertToken("[*] -> A", stateparser.INIT)
+        self.assertToken("A <- [*]", stateparser.INIT)
+        self.assertToken("state A {", stateparser.STATE)
+        self.assertToken("}", stateparser.STATE_END)
+        self.assertToken("A : Entry / action", stateparser.STATE_ACTION)
+        self.assertToken("A : event [cond] / action",
+                         stateparser.INNER_ACTION)
+
+    def test_unparsed(self):
+        for line in ("", "// comment", "#define X", "* note", "int foo;",
+                     "@startuml"):
+            self.assertToken(line, None)
+
+    def test_groups_match_standalone_regex(self):
+        line = "A --> B : an event [a cond] / an action"
+        _, match = stateparser.tokenize_line(line)
+        self.assertEqual(stateparser.parse_event(match),
+                         stateparser.parse_event(
+                             stateparser.event_regex.match(line)))
+
+    def test_linear_time(self):
+        import benchmark.stress as stress
+        # a backtracking regex takes quadratic time or worse on these lines,
+        # so 8 times the line would take 64 times as long. The short line
+        # takes at least 50 us, below that the timer and the rest of the
+        # parser make the ratio noise.
+        for case in stress.CASES:
+            short = stress.measure(stress.stress_line(case, 2 * 1024), 3)
+            long = stress.measure(stress.stress_line(case, 16 * 1024), 3)
+            self.assertLess(long, 16 * max(short, 50e-6), case)
+
+    def test_linear_regexes_parse_the_same(self):
+        # the regexes before they were made linear
+        before = (
+            (stateparser.event_regex, stateparser.parse_event,
+             r"(\w+) +(<-\w*-*|-*\w*->) +([\w]+|\[\*\])(?: +: +([\w][\w ]+[\w])"
+             r"(?: +\[([\w ]+)\])?(?: +\/ *([\w ]+))?)"),
+            (stateparser.state_action_regex, stateparser.parse_state_action,
+             r"([\w\d]+) *: *[\w\d ]+([Ee](?:ntry|xit)) *\/ *([\w\d ]+)"),
+            (stateparser.state_inner_action_regex,
+             stateparser.parse_state_inner_action,
+             r"([\w\d]+) *: *([\w\s]+)(?: +\[([\w ]+)\])? +\/ *([\w\d ]+)"),
+        )
+        pieces = ("A : ", "A --> B : ", "ev ", "ev", " [c] ", " [c]",
+                  "entry ", "Exit", "\u00a0", " \t ", "x1", "_", " ", "  ",
+                  "\t", ":", "->", "<-", "[", "]", "[*]", "/", " / ", "é")
+        rng = random.Random(0)
+        for _ in range(20000):
+            line = "".join(
+                rng.choice(pieces) for _ in range(rng.randint(1, 10))).strip()
+            for regex, parse, pattern in before:
+                old = re.match(pattern, line)
+                new = regex.match(line)
+                self.assertEqual(old and parse(old), new and parse(new), line)
+
+        old_values = re.compile(r"(\w+) *= *([\w.-]+)")
+        for text in ("a=1, b = x.y", "trace=1 queue=8", "x a=b", "a b=c"):
+            self.assertEqual(stateparser.option_value_regex.findall(text),
+                             old_values.findall(text))
+
+
+class TestModel(unittest.TestCase):
+    def test_hierarchy(self):
+        diag = plantumldiagram(
+            """state B {
+    [*] -> C
+}
+[*] -> B
+C -> A : event
+A : entry / enter a""", "model")
+        diagram = next(stateparser.iter_diagrams(diag))
+
+        self.assertEqual([s.name for s in diagram.states],
+                         ["Top", "A", "B", "C"])
+        self.assertEqual([s.index for s in diagram.states], [0, 1, 2, 3])
+        self.assertEqual([s.depth for s in diagram.states], [0, 1, 1, 2])
+
+        a, b, c = diagram.index["A"], diagram.index["B"], diagram.index["C"]
+        self.assertIs(c.parent, b)
+        self.assertEqual(list(c.ancestors()), [b, diagram.top])
+        self.assertEqual(diagram.top.children, [a, b])
+        self.assertEqual(diagram.leaves, [a, c])
+        self.assertIs(diagram.top.init, b)
+        self.assertIs(b.init, c)
+        self.assertEqual(a.entry, ["enter_a"])
+        self.assertIs(c.transitions[0].target, a)
+        self.assertEqual(diagram.actions, ["enter_a"])
+
+    def test_nested_in_each_other(self):
+        diag = plantumldiagram(
+            """state A {
+    state B {
+        A : entry / enter
+    }
+}""", "cyclic")
+        with self.assertRaises(ValueError):
+            stateparser.parse_data(diag)
+
+    def test_deep_hierarchy_is_linear(self):
+        depth = 3000
+        lines = [f"state S{n} {{" for n in range(depth)]
+        lines += ["}"] * depth
+        lines += [f"S{n} --> S{n + 1} : event{n}" for n in range(depth - 1)]
+
+        start = time.perf_counter()
+        diagram = next(stateparser.iter_diagrams(
+            plantumldiagram("\n".join(lines), "deep")))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(diagram.states[-1].depth, depth)
+        self.assertLess(elapsed, 2.0)
+
+
+demodiagram = plantumldiagram(
+    """[*] -> State1
+State1 --> State2 : Succeeded [Condition goes HeRe] /ActionAG fds
+State1 --> End : Aborted
+State1 : Entry / do something
+State1 : Exit / DoNothing
+State2 --> State3 : Succeeded
+state State3 {
+  state "Accumulate Enough Data Long State Name" as long1
+  [*] --> long1
+  long1 --> ProcessData : Enough Data
+  state ProcessData {
+    [*] --> ExecData
+    ExecData -> Finished : Done
+  }
+}
+State3 : Entry / test
+State3 : testevent / detest1
+State3 --> State3 : Failed
+State3 --> End : Succeeded / Save Result""", "demo")
+
+
+class TestDispatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.diagram = next(stateparser.iter_diagrams(demodiagram))
+        self.state = self.diagram.index.__getitem__
+
+    def names(self, states):
+        return [state.name for state in states]
+
+    def test_paths(self):
+        state = self.state
+        self.assertEqual(
+            self.names(
+                dispatch.exit_path(state("ExecData"), state("State3"),
+                                   state("End"))),
+            ["ExecData", "ProcessData", "State3"])
+        self.assertEqual(
+            self.names(dispatch.entry_path(state("State3"), state("End"))),
+            ["End"])
+
+        # a self transition leaves and re-enters the source
+        self.assertEqual(
+            self.names(
+                dispatch.exit_path(state("long1"), state("State3"),
+                                   state("State3"))), ["long1", "State3"])
+        self.assertEqual(
+            self.names(dispatch.entry_path(state("State3"),
+                                           state("State3"))), ["State3"])
+
+        self.assertEqual(
+            self.names(dispatch.init_path(self.diagram, state("State3"))),
+            ["long1"])
+
+    def test_table(self):
+        table = dispatch.build(self.diagram)
+
+        self.assertEqual(table.initial.actions, ("do_something", ))
+        self.assertIs(table.initial.leaf, self.state("State1"))
+
+        def handler(leaf, signal):
+            row = table.rows[table.leaves.index(self.state(leaf))]
+            return table.handlers[row[table.signals.index(signal)]]
+
+        # guarded in State1 itself
+        (guard, routine), = handler("State1", "Succeeded").candidates
+        self.assertEqual(guard, "Condition_goes_HeRe")
+        self.assertEqual(routine.actions, ("DoNothing", "ActionAG_fds"))
+
+        # handled two levels up, by State3
+        (guard, routine), = handler("ExecData", "Succeeded").candidates
+        self.assertIsNone(guard)
+        self.assertEqual(routine.actions, ("Save_Result", ))
+        self.assertIs(routine.leaf, self.state("End"))
+
+        # internal transitions stay in the current state
+        (_, routine), = handler("long1", "testevent").candidates
+        self.assertEqual(routine.actions, ("detest1", ))
+        self.assertIsNone(routine.leaf)
+
+        self.assertEqual(handler("End", "Done").index, 0)
+
+    def test_missing_initial_state(self):
+        diagram = next(
+            stateparser.iter_diagrams(
+                plantumldiagram("[*] -> A\nstate B {\nstate C\n}\n"
+                                "A -> B : start", "noinit")))
+        with self.assertRaisesRegex(ValueError, "B has no initial state"):
+            dispatch.build(diagram)
+
+    def test_diagram_options(self):
+        diagram = next(
+            stateparser.iter_diagrams(
+                plantumldiagram("' yahsmg: backend=table\n[*] -> A",
+                                "options")))
+        self.assertEqual(diagram.options, {"backend": "table"})
+
+        templates = pipeline.Templates()
+        self.assertEqual(templates.options_for(diagram)["backend"], "table")
+
+        diagram.options = {"backend": "fast"}
+        with self.assertRaisesRegex(ValueError, "backend must be one of"):
+            templates.options_for(diagram)
+
+    def test_table_backend_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "demo.puml")
+            source.write_text(demodiagram)
+
+            result, = pipeline.generate_files([source],
+                                              options={"backend": "table"})
+            self.assertTrue(result.ok)
+            cpp = source.parent.joinpath("generated", "demo_HSM.cpp")
+            self.assertIn("struct demo_HSM::Table", cpp.read_text())
+
+    def test_precomputed_paths_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "demo.puml")
+            source.write_text(demodiagram)
+
+            result, = pipeline.generate_files([source],
+                                              options={"paths": "precomputed"})
+            self.assertTrue(result.ok)
+            cpp = source.parent.joinpath("generated",
+                                         "demo_HSM.cpp").read_text()
+            self.assertNotIn("Tran<", cpp)
+            self.assertNotIn("Init<", cpp)
+            self.assertIn("h.Save_Result();\n    h.next(End::obj);", cpp)
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_backends_behave_the_same(self):
+        import benchmark.dispatch
+
+        lines = corpus.diagram_source("bench", states=25, depth=5, seed=3)
+        diagram, = stateparser.iter_diagrams(lines)
+        variants = benchmark.dispatch.variants()
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            sources = benchmark.dispatch.write_variants(
+                directory, lines, variants)
+            driver = directory.joinpath("driver.cpp")
+            driver.write_text(
+                benchmark.dispatch.render_driver(
+                    "dispatch.cpp.jinja",
+                    variants=variants,
+                    conditions=diagram.conditions,
+                    actions=diagram.actions,
+                    signals=len(diagram.events),
+                    seed=3,
+                    count=20000,
+                    repeat=1))
+            output = benchmark.dispatch.compile_and_run(
+                ["g++", "-std=c++17", "-O1"], [driver] + sources,
+                [benchmark.dispatch.resources_path, sources[0].parent],
+                directory)
+
+        traces = {timing["trace"] for timing in json.loads(output).values()}
+        self.assertEqual(len(traces), 1)
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_compact_instances(self):
+        machine = """' yahsmg: layout=compact, {options}
+[*] -> Off
+Off --> On : toggle / count
+On --> Off : toggle"""
+        variants = {
+            "c_hsm": "backend=hsm",
+            "c_precomputed": "paths=precomputed",
+            "c_table": "backend=table"
+        }
+        driver = "#include <cstdio>\n#include \"hsm/instances.hpp\"\n"
+        for name in variants:
+            driver += f"""#include "{name}_HSM.hpp"
+static_assert(sizeof({name}_HSM::Signal) == 1);
+static_assert(sizeof({name}_HSM::StateId) == 1);
+static_assert(sizeof(Instances<{name}_HSM, 4>) == 4);
+struct {name}: {name}_HSM {{
+    int counts[4]{{}};
+    std::size_t current{{}};
+    void select(std::size_t instance) {{ current = instance; }}
+    void count() override {{ ++counts[current]; }}
+}};
+"""
+        driver += "int main() {\n"
+        for name in variants:
+            driver += f"""    {{
+        {name} m;
+        Instances<{name}, 4> instances;
+        instances.init(m);
+        instances.dispatch(m, 1, {name}_HSM::Signal::toggle);
+        instances.broadcast(m, {name}_HSM::Signal::toggle);
+        for (std::size_t i = 0; i < instances.size(); ++i)
+        {{
+            std::printf("%d%s", m.counts[i],
+                        instances.state(i) == {name}_HSM::StateId::On ? "on" : "off");
+        }}
+        std::printf("\\n");
+    }}
+"""
+        driver += "}\n"
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            inputs = []
+            for name, options in variants.items():
+                source = directory.joinpath(f"{name}.puml")
+                source.write_text(
+                    plantumldiagram(machine.format(options=options), name))
+                inputs.append(source)
+            for result in pipeline.generate_files(inputs):
+                self.assertTrue(result.ok, result.error)
+
+            generated = directory.joinpath("generated")
+            directory.joinpath("driver.cpp").write_text(driver)
+            resources = pathlib.Path(__file__).parent.parent.joinpath(
+                "resources")
+            executable = directory.joinpath("instances")
+            compiled = subprocess.run(
+                ["g++", "-std=c++17", f"-I{resources}", f"-I{generated}",
+                 str(directory.joinpath("driver.cpp"))] +
+                [str(path) for path in generated.glob("*.cpp")] +
+                ["-o", str(executable)],
+                capture_output=True,
+                text=True)
+            self.assertEqual(compiled.returncode, 0, compiled.stderr)
+            output = subprocess.run([str(executable)],
+                                    check=True,
+                                    capture_output=True,
+                                    text=True).stdout
+            self.assertEqual(output.split(), ["1on1off1on1on"] * 3)
+
+    def test_queue_option(self):
+        templates = pipeline.Templates(options={"queue": "8"})
+        self.assertEqual(templates.options["queue"], 8)
+        self.assertEqual(pipeline.options_key({"queue": 8}),
+                         "backend=hsm,bench=off,layout=default,"
+                         "paths=template,prune=off,queue=8,trace=0,unity=off")
+
+        diagram = next(
+            stateparser.iter_diagrams(
+                plantumldiagram("' yahsmg: queue=-1\n[*] -> A", "queue")))
+        with self.assertRaisesRegex(ValueError, "queue must be a capacity"):
+            templates.options_for(diagram)
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_run_to_completion(self):
+        # begin posts tick and stop, which are handled before the next
+        # signal of the batch
+        machine = """' yahsmg: queue=2, {options}
+[*] -> Idle
+Idle --> Busy : start / begin
+Busy --> Idle : stop / end
+Busy : tick / work"""
+        variants = {
+            "q_hsm": "backend=hsm",
+            "q_precomputed": "paths=precomputed",
+            "q_table": "backend=table"
+        }
+        driver = "#include <cstdio>\n#include <string>\n"
+        for name in variants:
+            driver += f"""#include "{name}_HSM.hpp"
+struct {name}: {name}_HSM {{
+    std::string trace;
+    void begin() override {{
+        trace += 'b';
+        trace += post(Signal::tick) ? 'p' : 'x';
+        trace += post(Signal::stop) ? 'p' : 'x';
+        trace += post(Signal::tick) ? 'p' : 'x';
+    }}
+    void end() override {{ trace += 'e'; }}
+    void work() override {{ trace += 'w'; }}
+}};
+"""
+        driver += "int main() {\n"
+        for name in variants:
+            driver += f"""    {{
+        {name} m;
+        m.init();
+        const {name}_HSM::Signal batch[] = {{{name}_HSM::Signal::start,
+                                            {name}_HSM::Signal::start}};
+        m.dispatch_batch(batch, 2);
+#ifdef HSM_QUEUE_SPAN
+        m.dispatch_batch(std::span<const {name}_HSM::Signal>(batch, 1));
+#endif
+        std::printf("%s\\n", m.trace.c_str());
+    }}
+"""
+        driver += "}\n"
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            inputs = []
+            for name, options in variants.items():
+                source = directory.joinpath(f"{name}.puml")
+                source.write_text(
+                    plantumldiagram(machine.format(options=options), name))
+                inputs.append(source)
+            for result in pipeline.generate_files(inputs):
+                self.assertTrue(result.ok, result.error)
+
+            generated = directory.joinpath("generated")
+            directory.joinpath("driver.cpp").write_text(driver)
+            resources = pathlib.Path(__file__).parent.parent.joinpath(
+                "resources")
+            for standard, trace in (("c++17", "bppxwebppxwe"),
+                                    ("c++20", "bppxwebppxwebppxwe")):
+                with self.subTest(standard=standard):
+                    executable = directory.joinpath(f"queue_{standard}")
+                    compiled = subprocess.run(
+                        ["g++", f"-std={standard}", f"-I{resources}",
+                         f"-I{generated}",
+                         str(directory.joinpath("driver.cpp"))] +
+                        [str(path) for path in generated.glob("*.cpp")] +
+                        ["-o", str(executable)],
+                        capture_output=True,
+                        text=True)
+                    if compiled.returncode and standard != "c++17":
+                        self.skipTest(f"g++ does not support {standard}")
+                    self.assertEqual(compiled.returncode, 0, compiled.stderr)
+                    output = subprocess.run([str(executable)],
+                                            check=True,
+                                            capture_output=True,
+                                            text=True).stdout
+                    self.assertEqual(output.split(), [trace] * 3)
+
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_crtp_queue_compact(self):
+        # the crtp backend with the queue and the compact layout, both as one
+        # machine and as the storage of Instances
+        machine = """' yahsmg: backend=crtp, queue=2, layout=compact
+[*] -> Idle
+Idle --> Busy : start [ready] / begin
+Busy --> Idle : stop / end
+Busy : tick / work"""
+        driver = """#include <cstdio>
+#include <string>
+#include "hsm/instances.hpp"
+#include "crtp_HSM.hpp"
+struct Machine: crtp_HSM<Machine> {
+    std::string trace;
+    std::size_t current{};
+    void select(std::size_t instance) { current = instance; }
+    bool ready() const { return current != 2; }
+    void begin() {
+        trace += 'b';
+        trace += post(Signal::tick) ? 'p' : 'x';
+        trace += post(Signal::stop) ? 'p' : 'x';
+        trace += post(Signal::tick) ? 'p' : 'x';
+    }
+    void end() { trace += 'e'; }
+    void work() { trace += 'w'; }
+};
+static_assert(sizeof(Machine::Signal) == 1);
+static_assert(sizeof(Machine::StateId) == 1);
+static_assert(sizeof(Instances<Machine, 4>) == 4);
+int main() {
+    Machine m;
+    m.init();
+    const Machine::Signal batch[] = {Machine::Signal::start,
+                                     Machine::Signal::start};
+    m.dispatch_batch(batch, 2);
+    std::printf("%s\\n", m.trace.c_str());
+
+    Machine shared;
+    Instances<Machine, 4> instances;
+    instances.init(shared);
+    instances.broadcast(shared, Machine::Signal::start);
+    instances.dispatch(shared, 2, Machine::Signal::tick);
+    std::printf("%s\\n", shared.trace.c_str());
+    for (std::size_t i = 0; i < instances.size(); ++i)
+    {
+        std::printf("%s", instances.state(i) == Machine::StateId::Idle ? "i" : "b");
+    }
+    std::printf("\\n");
+}
+"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            source = directory.joinpath("crtp.puml")
+            source.write_text(plantumldiagram(machine, "crtp"))
+            for result in pipeline.generate_files([source]):
+                self.assertTrue(result.ok, result.error)
+
+            generated = directory.joinpath("generated")
+            directory.joinpath("driver.cpp").write_text(driver)
+            resources = pathlib.Path(__file__).parent.parent.joinpath(
+                "resources")
+            executable = directory.joinpath("crtp")
+            compiled = subprocess.run(
+                ["g++", "-std=c++17", f"-I{resources}", f"-I{generated}",
+                 str(directory.joinpath("driver.cpp"))] +
+                [str(path) for path in generated.glob("*.cpp")] +
+                ["-o", str(executable)],
+                capture_output=True,
+                text=True)
+            self.assertEqual(compiled.returncode, 0, compiled.stderr)
+            output = subprocess.run([str(executable)],
+                                    check=True,
+                                    capture_output=True,
+                                    text=True).stdout
+            # the third instance is not ready, so ignores start and tick
+            self.assertEqual(output.split(),
+                             ["bppxwebppxwe", "bppxwebppxwebppxwe", "iiii"])
+
+
+class TestReachability(unittest.TestCase):
+    machine = """[*] -> Idle
+Idle --> Busy : start [ready]
+Idle --> Done : start
+Idle --> Busy : start
+Done --> Idle : reset
+Orphan --> Idle : back / forget
+state Busy {
+  [*] --> Working
+  Working --> Working : stop
+}
+Busy --> Idle : stop
+Busy --> Idle : reset"""
+
+    def diagram(self, options="", machine=None):
+        return next(
+            stateparser.iter_diagrams(
+                plantumldiagram(options + (machine or self.machine),
+                                "reach")))
+
+    def test_analyse(self):
+        diagram = self.diagram()
+        reachability = reachability_.analyse(diagram)
+        self.assertEqual(
+            [state.name for state in reachability.unreachable_states],
+            ["Orphan"])
+        self.assertEqual(reachability.report(), [
+            "diagram reach: state Orphan is unreachable",
+            "diagram reach: Busy --> Idle : stop never fires",
+            "diagram reach: Idle --> Busy : start never fires"
+        ])
+
+    def test_initial_states_are_reached(self):
+        # Outer is only entered through its child Second, its initial state
+        # First still counts as reached
+        diagram = next(
+            stateparser.iter_diagrams(
+                plantumldiagram(
+                    """[*] -> Start
+state Outer {
+  [*] --> First
+  First --> Second : next
+}
+Start --> Second : jump""", "inits")))
+        self.assertIs(diagram.index["Second"].parent, diagram.index["Outer"])
+        self.assertEqual(
+            reachability_.analyse(diagram).unreachable_states, [])
+
+    def test_linear(self):
+        # a chain of states, each only reached from the one before it
+        count = 20000
+        lines = ["[*] -> S0"]
+        lines += [f"S{n} --> S{n + 1} : next" for n in range(count)]
+        diagram = next(
+            stateparser.iter_diagrams(
+                plantumldiagram("\n".join(lines), "chain")))
+
+        start = time.perf_counter()
+        reachability = reachability_.analyse(diagram)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(reachability.reached), count + 2)
+        self.assertEqual(reachability.dead_transitions, [])
+        self.assertLess(elapsed, 1.0)
+
+    def test_wide_composite(self):
+        # one composite state with k leaves and k transitions of its own,
+        # checking every transition against every leaf takes k * k
+        def wide(count):
+            lines = ["[*] -> Wide", "state Wide {", "  [*] --> L0"]
+            lines += [f"  L{n} --> L{n + 1} : next" for n in range(count)]
+            lines += ["}"]
+            lines += [f"Wide --> Wide : ev{n}" for n in range(count)]
+            return next(
+                stateparser.iter_diagrams(
+                    plantumldiagram("\n".join(lines), "wide")))
+
+        def elapsed(diagram):
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                reachability = reachability_.analyse(diagram)
+                took = time.perf_counter() - start
+                best = took if best is None else min(best, took)
+            self.assertEqual(reachability.dead_transitions, [])
+            return best
+
+        short = elapsed(wide(500))
+        long = elapsed(wide(4000))
+        # 8 times the states, linear takes about 8 times as long
+        self.assertLess(long, 16 * max(short, 1e-3))
+
+    def test_prune(self):
+        diagram = self.diagram()
+        pruned = reachability_.prune(diagram)
+        self.assertEqual([state.name for state in pruned.states],
+                         ["Top", "Busy", "Done", "Idle", "Working"])
+        self.assertEqual(
+            [(t.source.name, t.target.name, t.event, t.condition)
+             for state in pruned.states for t in state.transitions],
+            [("Busy", "Idle", "reset", None),
+             ("Done", "Idle", "reset", None),
+             ("Idle", "Busy", "start", "ready"),
+             ("Idle", "Done", "start", None),
+             ("Working", "Working", "stop", None)])
+        # the interface of the class stays the same
+        self.assertEqual(pruned.events, diagram.events)
+        self.assertEqual(pruned.actions, diagram.actions)
+        self.assertEqual(pruned.conditions, diagram.conditions)
+        self.assertEqual(reachability_.analyse(pruned).report(), [])
+
+    def test_prune_option(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            messages = []
+            templates = pipeline.Templates(options={"prune": "report"})
+            pipeline.render_diagram(self.diagram(), directory, templates,
+                                    messages.append)
+            self.assertIn("diagram reach: state Orphan is unreachable",
+                          messages)
+            self.assertIn("Orphan", directory.joinpath(
+                "reach_HSM.cpp").read_text())
+
+            with self.assertRaisesRegex(ValueError, "prune must be one of"):
+                pipeline.Templates(options={"prune": "yes"})
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_pruned_output_compiles(self):
+        # the hsm backend takes a single transition per signal and state
+        machine = self.machine.replace(
+            "Idle --> Busy : start [ready]\nIdle --> Done : start\n", "")
+        resources = pathlib.Path(__file__).parent.parent.joinpath(
+            "resources")
+        for backend in pipeline.BACKENDS:
+            with self.subTest(backend=backend), \
+                    tempfile.TemporaryDirectory() as directory:
+                directory = pathlib.Path(directory)
+                diagram = self.diagram(
+                    f"' yahsmg: prune=on, backend={backend}\n", machine)
+                templates = pipeline.Templates()
+                pipeline.render_diagram(diagram, directory, templates,
+                                        lambda message: None)
+                header = directory.joinpath("reach_HSM.hpp").read_text()
+                self.assertNotIn("Orphan", header)
+                if backend != "crtp":
+                    # still declared, crtp calls the actions it uses only
+                    self.assertIn("forget", header)
+                compiled = subprocess.run(
+                    ["g++", "-std=c++17", "-fsyntax-only",
+                     f"-I{resources}", f"-I{directory}",
+                     str(directory.joinpath("reach_HSM.cpp"))],
+                    capture_output=True,
+                    text=True)
+                self.assertEqual(compiled.returncode, 0, compiled.stderr)
+
+
+def have_numpy() -> bool:
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.diagram = next(stateparser.iter_diagrams(demodiagram))
+
+    def test_demo(self):
+        calls = []
+        machine = executor.Executor(
+            self.diagram,
+            guards={"Condition_goes_HeRe": True},
+            actions={
+                action: lambda machine, action=action: calls.append(action)
+                for action in self.diagram.actions
+            })
+        machine.init()
+        self.assertEqual(machine.state_name, "State1")
+        self.assertEqual(calls, ["do_something"])
+
+        steps = [("Succeeded", "State2", ["DoNothing", "ActionAG_fds"]),
+                 ("Succeeded", "long1", ["test"]),
+                 ("Enough_Data", "ExecData", []),
+                 ("testevent", "ExecData", ["detest1"]),
+                 ("Succeeded", "End", ["Save_Result"]),
+                 ("Succeeded", "End", [])]
+        for signal, state, actions in steps:
+            calls.clear()
+            machine.dispatch(signal)
+            self.assertEqual((machine.state_name, calls),
+                             (state, actions), signal)
+
+    def test_guards(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "no guard for Condition_goes_HeRe"):
+            executor.Executor(self.diagram)
+        with self.assertRaisesRegex(ValueError, "unknown action nothing"):
+            executor.Executor(self.diagram,
+                              guards={"Condition_goes_HeRe": True},
+                              actions={"nothing": print})
+
+        machine = executor.Executor(self.diagram,
+                                    guards={"Condition_goes_HeRe": False})
+        machine.init()
+        self.assertFalse(machine.dispatch("Succeeded"))
+        self.assertEqual(machine.state_name, "State1")
+        with self.assertRaisesRegex(ValueError, "unknown signal 'Go'"):
+            machine.dispatch("Go")
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_matches_generated_code(self):
+        # the guards and actions of both fold their calls into a trace, the
+        # guards return the bits of the same xorshift sequence
+        lines = corpus.diagram_source("bench", states=25, depth=5, seed=3)
+        diagram, = stateparser.iter_diagrams(lines)
+        rng = random.Random(3)
+        signals = [rng.randrange(len(diagram.events)) for _ in range(5000)]
+
+        trace = [14695981039346656037, 2463534242]
+
+        def record(value):
+            trace[0] = ((trace[0] ^ value) * 1099511628211) % (1 << 64)
+
+        def guard(value):
+            random = trace[1]
+            random ^= (random << 13) & 0xffffffff
+            random ^= random >> 17
+            random ^= (random << 5) & 0xffffffff
+            trace[1] = random
+            record(value)
+            return bool(random & 1)
+
+        machine = executor.Executor(
+            diagram,
+            guards={
+                condition: lambda machine, n=n: guard(n)
+                for n, condition in enumerate(diagram.conditions, 1)
+            },
+            actions={
+                action: lambda machine, n=n: record(n)
+                for n, action in enumerate(diagram.actions, 1001)
+            })
+        machine.init()
+        machine.replay(signals)
+
+        driver = """#include "bench_HSM.hpp"
+#include <cstdint>
+#include <cstdio>
+struct Impl final: bench_HSM {
+    mutable std::uint64_t trace{14695981039346656037ull};
+    mutable std::uint32_t random{2463534242u};
+    void record(std::uint64_t id) const { trace = (trace ^ id) * 1099511628211ull; }
+    bool guard(std::uint64_t id) const {
+        random ^= random << 13;
+        random ^= random >> 17;
+        random ^= random << 5;
+        record(id);
+        return random & 1;
+    }
+"""
+        for n, condition in enumerate(diagram.conditions, 1):
+            driver += f"    bool {condition}() const override {{ return guard({n}); }}\n"
+        for n, action in enumerate(diagram.actions, 1001):
+            driver += f"    void {action}() override {{ record({n}); }}\n"
+        driver += "};\nstatic const int signals[] = {"
+        driver += ", ".join(map(str, signals))
+        driver += """};
+int main() {
+    Impl machine;
+    machine.init();
+    for (int signal: signals) {
+        machine.dispatch(static_cast<bench_HSM::Signal>(signal));
+    }
+    std::printf("%016llx %s\\n", static_cast<unsigned long long>(machine.trace), machine.getState());
+}
+"""
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            source = directory.joinpath("bench.puml")
+            source.write_text("\n".join(lines) + "\n")
+            result, = pipeline.generate_files([source])
+            self.assertTrue(result.ok, result.error)
+
+            generated = directory.joinpath("generated")
+            directory.joinpath("driver.cpp").write_text(driver)
+            resources = pathlib.Path(__file__).parent.parent.joinpath(
+                "resources")
+            executable = directory.joinpath("replay")
+            subprocess.run([
+                "g++", "-std=c++17", f"-I{resources}", f"-I{generated}",
+                str(directory.joinpath("driver.cpp")),
+                str(generated.joinpath("bench_HSM.cpp")), "-o",
+                str(executable)
+            ],
+                           check=True)
+            output = subprocess.run([str(executable)],
+                                    check=True,
+                                    capture_output=True,
+                                    text=True).stdout
+
+        self.assertEqual(output.split(),
+                         [f"{trace[0]:016x}", machine.state_name])
+
+    @unittest.skipUnless(have_numpy(), "needs numpy")
+    def test_batch(self):
+        import numpy
+
+        lines = corpus.diagram_source("bench", states=30, depth=4, seed=5)
+        diagram, = stateparser.iter_diagrams(lines)
+        count = 64
+        rng = random.Random(5)
+        sequences = [[
+            rng.choice(diagram.events) for _ in range(rng.randrange(50, 100))
+        ] for _ in range(count)]
+        # a guard holds for an instance when its bit in the instance is set
+        flags = [rng.getrandbits(len(diagram.conditions)) for _ in range(count)]
+
+        def calls():
+            return {
+                action: numpy.zeros(count, dtype=int)
+                for action in diagram.actions
+            }
+
+        single = calls()
+        states = []
+        for instance, sequence in enumerate(sequences):
+
+            def count_call(machine, action=None, instance=instance):
+                single[action][instance] += 1
+
+            machine = executor.Executor(
+                diagram,
+                guards={
+                    condition:
+                    lambda machine, n=n, instance=instance: bool(flags[
+                        instance] >> n & 1)
+                    for n, condition in enumerate(diagram.conditions)
+                },
+                actions={
+                    action: functools.partial(count_call, action=action)
+                    for action in diagram.actions
+                })
+            machine.init()
+            machine.replay(sequence)
+            states.append(machine.state_name)
+
+        batch_calls = calls()
+
+        def count_batch(batch, instances, action=None):
+            numpy.add.at(batch_calls[action], instances, 1)
+
+        guards = {}
+        for n, condition in enumerate(diagram.conditions):
+            mask = numpy.array([bool(flag >> n & 1) for flag in flags])
+            # both kinds of guard
+            guards[condition] = mask if n % 2 else (
+                lambda batch, instances, mask=mask: mask[instances])
+        batch = executor.BatchExecutor(
+            diagram,
+            count,
+            guards=guards,
+            actions={
+                action: functools.partial(count_batch, action=action)
+                for action in diagram.actions
+            })
+        batch.init()
+        batch.run(batch.encode(sequences))
+
+        self.assertEqual(batch.state_names(), states)
+        for action in diagram.actions:
+            self.assertEqual(list(batch_calls[action]), list(single[action]),
+                             action)
+
+
+class TestTrace(unittest.TestCase):
+    metadata = {
+        "format": "yahsmg-trace",
+        "states": ["Top", "A", "B"],
+        "signals": ["go", "back"]
+    }
+
+    def dump(self, capacity, written, records):
+        return trace.HEADER.pack(trace.MAGIC, 1, 16, capacity,
+                                 written) + b"".join(
+                                     trace.RECORD.pack(*record, 0)
+                                     for record in records)
+
+    def test_read_dump(self):
+        dump = trace.read_dump(
+            self.dump(2, 3, [(1000, 1, 0, 2), (3500, 2, 1, 1)]))
+        self.assertEqual(dump.overwritten, 1)
+        self.assertEqual(dump.records, [(1000, 1, 0, 2), (3500, 2, 1, 1)])
+        self.assertEqual(trace.timeline(dump, self.metadata), [
+            "(1 older records were overwritten)",
+            "         0.000 us  A --go--> B",
+            "         2.500 us  B --back--> A"
+        ])
+
+        # ids the metadata does not know are numbered
+        dump = trace.read_dump(self.dump(4, 1, [(0, 7, 9, 1)]))
+        self.assertEqual(trace.events(dump, self.metadata)[0], {
+            "time": 0,
+            "source": "#7",
+            "signal": "#9",
+            "target": "A"
+        })
+
+    def test_bad_dumps(self):
+        with self.assertRaisesRegex(ValueError, "not a trace dump"):
+            trace.read_dump(b"x" * 64)
+        with self.assertRaisesRegex(ValueError, "truncated"):
+            trace.read_dump(self.dump(4, 2, [(0, 1, 0, 2)]))
+
+    def test_trace_needs_hsm_backend(self):
+        with self.assertRaisesRegex(ValueError, "trace needs backend hsm"):
+            pipeline.Templates(options={"backend": "table", "trace": 8})
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_traced_transitions(self):
+        # the internal transition is not recorded and the first transition
+        # is overwritten in the 3 record buffer
+        machine = """' yahsmg: trace=3, {options}
+[*] -> Idle
+Idle --> Busy : start
+state Busy {{
+  [*] --> Working
+  Working --> Done : finish
+}}
+Busy --> Idle : stop
+Done : tick / work"""
+        variants = {"t_template": "paths=template",
+                    "t_precomputed": "paths=precomputed"}
+        driver = "#include <cstdio>\n#include <initializer_list>\n"
+        for name in variants:
+            driver += f"""#include "{name}_HSM.hpp"
+struct {name}: {name}_HSM {{
+    void work() override {{}}
+}};
+"""
+        driver += "int main(int, char** argv) {\n"
+        for n, name in enumerate(variants):
+            driver += f"""    {{
+        using S = {name}_HSM::Signal;
+        {name} m;
+        m.init();
+        for (S signal: {{S::start, S::finish, S::tick, S::stop, S::start}})
+        {{
+            m.dispatch(signal);
+        }}
+        if (!{name}_HSM::Tracer::buffer.dump(argv[{n + 1}]))
+        {{
+            return 1;
+        }}
+    }}
+"""
+        driver += "}\n"
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            inputs = []
+            for name, options in variants.items():
+                source = directory.joinpath(f"{name}.puml")
+                source.write_text(
+                    plantumldiagram(machine.format(options=options), name))
+                inputs.append(source)
+            for result in pipeline.generate_files(inputs):
+                self.assertTrue(result.ok, result.error)
+
+            generated = directory.joinpath("generated")
+            directory.joinpath("driver.cpp").write_text(driver)
+            resources = pathlib.Path(__file__).parent.parent.joinpath(
+                "resources")
+            executable = directory.joinpath("traced")
+            compiled = subprocess.run(
+                ["g++", "-std=c++17", f"-I{resources}", f"-I{generated}",
+                 str(directory.joinpath("driver.cpp"))] +
+                [str(path) for path in generated.glob("*.cpp")] +
+                ["-o", str(executable)],
+                capture_output=True,
+                text=True)
+            self.assertEqual(compiled.returncode, 0, compiled.stderr)
+            dumps = [directory.joinpath(f"{name}.trace") for name in variants]
+            subprocess.run([str(executable)] + [str(dump) for dump in dumps],
+                           check=True)
+
+            for name, path in zip(variants, dumps):
+                metadata = trace.load_metadata(
+                    generated.joinpath(f"{name}_HSM.trace.json"))
+                dump = trace.read_dump(path.read_bytes())
+                self.assertEqual(dump.overwritten, 1)
+                self.assertEqual(
+                    [(event["source"], event["signal"], event["target"])
+                     for event in trace.events(dump, metadata)],
+                    [("Working", "finish", "Done"), ("Done", "stop", "Idle"),
+                     ("Idle", "start", "Busy")])
+
+
+class TestIterDiagrams(unittest.TestCase):
+    def test_matches_parse_data(self):
+        data = hppdiagram_multi("[*] -> StateA\r\nStateA -> B : event",
+                                "diagramA", "state B {\n[*] -> C\n}",
+                                "diagramB")
+        expected = stateparser.parse_data(data)
+
+        def parse(source):
+            return [d.as_dict() for d in stateparser.iter_diagrams(source)]
+
+        self.assertEqual(parse(data), expected)
+        self.assertEqual(parse(data.encode()), expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp).joinpath("diagram.hpp")
+            path.write_bytes(data.encode())
+            self.assertEqual(parse(path), expected)
+
+            path.write_bytes(b"")
+            self.assertEqual(parse(path), [])
+
+    def test_yields_each_diagram_when_closed(self):
+        data = plantumldiagram_multi("[*] -> A", "first", "[*] -> B",
+                                     "second").encode()
+        # text between and after diagrams is skipped without being decoded
+        data = data.replace(b"\n\n@startuml second", b"\n\xff\xfe\n")
+
+        diagrams = stateparser.iter_diagrams(data, encoding="utf-8")
+        self.assertEqual(next(diagrams).name, "first")
+        self.assertEqual(list(diagrams), [])
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+
+        for relative, text in (
+            ("a.puml", plantumldiagram("[*] -> A", "a")),
+            ("empty.puml", ""),
+            ("src/b.hpp", hppdiagram("[*] -> B", "b")),
+            ("src/plain.hpp", "int foo;"),
+            ("src/generated/b_HSM.hpp", "@startuml not really"),
+            ("build/c.puml", plantumldiagram("[*] -> C", "c")),
+            (".git/d.puml", plantumldiagram("[*] -> D", "d")),
+        ):
+            path = self.root.joinpath(relative)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def scan(self, *args, **kwargs):
+        found = scanner.Scanner(*args, **kwargs).scan(self.root)
+        return [p.relative_to(self.root).as_posix() for p in found]
+
+    def test_defaults(self):
+        self.assertEqual(self.scan(), ["a.puml", "build/c.puml", "src/b.hpp"])
+
+    def test_extensions_and_excludes(self):
+        self.assertEqual(
+            self.scan(extensions=(".puml", ".hpp"),
+                      excludes=(".git", "generated", "build/")),
+            ["a.puml", "src/b.hpp"])
+        self.assertEqual(
+            self.scan(extensions=(".hpp", ), excludes=("src/generated", )),
+            ["src/b.hpp"])
+
+    def test_prefilter_across_blocks(self):
+        path = self.root.joinpath("large.puml")
+        path.write_bytes(b"x" * 30 + b"@startuml x\n@enduml")
+        default_block_size = scanner.BLOCK_SIZE
+        try:
+            for size in range(1, 45):
+                scanner.BLOCK_SIZE = size
+                self.assertTrue(scanner.contains_diagram(str(path)), size)
+        finally:
+            scanner.BLOCK_SIZE = default_block_size
+
+    def test_keep_before_reading(self):
+        contains_diagram = scanner.contains_diagram
+        read = []
+
+        def reading(path):
+            read.append(os.path.basename(path))
+            return contains_diagram(path)
+
+        scanner.contains_diagram = reading
+        try:
+            found = scanner.Scanner().scan(
+                self.root, keep=lambda path: not path.endswith(".hpp"))
+        finally:
+            scanner.contains_diagram = contains_diagram
+        self.assertEqual([p.relative_to(self.root).as_posix() for p in found],
+                         ["a.puml", "build/c.puml"])
+        self.assertEqual(sorted(read), ["a.puml", "c.puml", "empty.puml"])
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, relative, text):
+        path = self.root.joinpath(relative)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+        return path
+
+    def test_bad_diagram_does_not_stop_run(self):
+        self.write("b/good.puml", plantumldiagram("[*] -> A", "good"))
+        self.write("a/bad.puml", plantumldiagram("}\n}", "bad"))
+
+        inputs = pipeline.collect_inputs(self.root)
+        results = list(pipeline.generate_files(inputs, jobs=2))
+
+        self.assertEqual([r.inputfile.name for r in results],
+                         ["bad.puml", "good.puml"])
+        self.assertFalse(results[0].ok)
+        self.assertTrue(results[1].ok)
+        self.assertTrue(
+            self.root.joinpath("b", "generated", "good_HSM.hpp").exists())
+
+    def test_jobs_output_is_deterministic(self):
+        for i in range(4):
+            self.write(f"d{i}/m{i}.puml",
+                       plantumldiagram(f"[*] -> S{i}", f"m{i}"))
+
+        inputs = pipeline.collect_inputs(self.root)
+        serial = [r.messages for r in pipeline.generate_files(inputs, 1)]
+        for i in range(4):
+            shutil.rmtree(self.root.joinpath(f"d{i}", "generated"))
+        parallel = [r.messages for r in pipeline.generate_files(inputs, 3)]
+
+        self.assertEqual(serial, parallel)
+
+    def test_unchanged_output_is_not_rewritten(self):
+        source = self.write("m.puml", plantumldiagram("[*] -> A", "m"))
+        output = self.root.joinpath("generated", "m_HSM.hpp")
+
+        list(pipeline.generate_files([source]))
+        os.utime(output, (0, 0))
+
+        result = next(pipeline.generate_files([source]))
+        self.assertIn(f"unchanged {str(output)}", result.messages)
+        self.assertEqual(output.stat().st_mtime, 0)
+
+        source.write_text(plantumldiagram("[*] -> A\nA -> B : start", "m"))
+        result = next(pipeline.generate_files([source]))
+        self.assertIn(f"generated {str(output)}", result.messages)
+        self.assertNotEqual(output.stat().st_mtime, 0)
+        self.assertEqual(
+            sorted(p.name for p in output.parent.iterdir()
+                   if not p.name.startswith(".yahsmg")),
+            ["m_HSM.cpp", "m_HSM.hpp"])
+
+    @unittest.skipIf(os.name == "nt", "no permission bits")
+    def test_output_permissions(self):
+        # the same as open(path, "w") would give
+        source = self.write("m.puml", plantumldiagram("[*] -> A", "m"))
+        umask = os.umask(0o027)
+        try:
+            list(pipeline.generate_files([source]))
+        finally:
+            os.umask(umask)
+        output = self.root.joinpath("generated", "m_HSM.hpp")
+        self.assertEqual(output.stat().st_mode & 0o777, 0o640)
+
+    def test_cache_skips_unchanged_files(self):
+        source = self.write("m.puml", plantumldiagram("[*] -> A", "m"))
+        inputs = [source]
+
+        build_cache = cache.BuildCache(pipeline.template_path)
+        first = list(pipeline.generate_files(inputs, cache=build_cache))
+        self.assertFalse(first[0].skipped)
+
+        build_cache = cache.BuildCache(pipeline.template_path)
+        second = list(pipeline.generate_files(inputs, cache=build_cache))
+        self.assertTrue(second[0].skipped)
+
+        source.write_text(plantumldiagram("[*] -> B", "m"))
+        build_cache = cache.BuildCache(pipeline.template_path)
+        third = list(pipeline.generate_files(inputs, cache=build_cache))
+        self.assertFalse(third[0].skipped)
+
+        self.root.joinpath("generated", "m_HSM.cpp").unlink()
+        build_cache = cache.BuildCache(pipeline.template_path)
+        fourth = list(pipeline.generate_files(inputs, cache=build_cache))
+        self.assertFalse(fourth[0].skipped)
+
+        # another version of the generator's code
+        build_cache = cache.BuildCache(pipeline.template_path)
+        self.assertTrue(
+            list(pipeline.generate_files(inputs,
+                                         cache=build_cache))[0].skipped)
+        build_cache = cache.BuildCache(pipeline.template_path)
+        build_cache.generator = "upgraded"
+        fifth = list(pipeline.generate_files(inputs, cache=build_cache))
+        self.assertFalse(fifth[0].skipped)
+
+    # two diagrams with the same state names in one translation unit
+    unity_machine = """[*] -> Idle
+Idle --> Busy : start
+Busy --> Idle : stop
+Busy : entry / work"""
+
+    def compile_unity(self, sources):
+        resources = pathlib.Path(__file__).parent.parent.joinpath(
+            "resources")
+        generated = self.root.joinpath("generated")
+        compiled = subprocess.run(
+            ["g++", "-std=c++17", "-fsyntax-only", f"-I{resources}",
+             f"-I{generated}"] + [str(generated.joinpath(source))
+                                  for source in sources],
+            capture_output=True,
+            text=True)
+        self.assertEqual(compiled.returncode, 0, compiled.stderr)
+
+    def test_unity_file(self):
+        source = self.write(
+            "m.puml",
+            plantumldiagram_multi(
+                self.unity_machine, "first",
+                "' yahsmg: paths=precomputed\n" + self.unity_machine,
+                "second"))
+        result = next(
+            pipeline.generate_files([source], options={"unity": "file"}))
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(
+            sorted(output.name for output in result.outputs),
+            ["first_HSM.hpp", "m_unity.cpp", "second_HSM.hpp"])
+
+        unity = self.root.joinpath("generated", "m_unity.cpp").read_text()
+        self.assertIn('#include "first_HSM.hpp"', unity)
+        self.assertIn("using second_Idle = ", unity)
+        if shutil.which("g++"):
+            self.compile_unity(["m_unity.cpp"])
+
+        diagram = plantumldiagram("' yahsmg: unity=file\n[*] -> A", "own")
+        self.write("own.puml", diagram)
+        result = next(
+            pipeline.generate_files([self.root.joinpath("own.puml")]))
+        self.assertIn("unity can only be set for a whole run", result.error)
+
+    def test_unity_directory(self):
+        inputs = [
+            self.write("a.puml", plantumldiagram(self.unity_machine, "first")),
+            self.write("b.puml",
+                       plantumldiagram(self.unity_machine, "second")),
+            self.write("c.puml", "no diagram here")
+        ]
+        options = {"unity": "directory"}
+        build_cache = cache.BuildCache(pipeline.template_path,
+                                       pipeline.options_key(options))
+        results = list(
+            pipeline.generate_files(inputs, cache=build_cache,
+                                    options=options))
+        self.assertTrue(all(result.ok for result in results))
+
+        generated = self.root.joinpath("generated")
+        unity = generated.joinpath(f"{self.root.name}_unity.cpp")
+        self.assertEqual(unity.read_text(), '#include "a_unity.inc"\n'
+                         '#include "b_unity.inc"\n')
+        self.assertFalse(generated.joinpath("first_HSM.cpp").exists())
+        if shutil.which("g++"):
+            self.compile_unity([unity.name])
+
+        # rewritten when an input changes while the others are up to date
+        inputs[0].unlink()
+        build_cache = cache.BuildCache(pipeline.template_path,
+                                       pipeline.options_key(options))
+        results = list(
+            pipeline.generate_files(inputs[1:], cache=build_cache,
+                                    options=options))
+        self.assertTrue(results[0].skipped)
+        self.assertEqual(unity.read_text(), '#include "b_unity.inc"\n')
+
+
+class TestApi(unittest.TestCase):
+    def test_generate_text(self):
+        artifacts = api.generate(plantumldiagram("[*] -> A\nA -> B : next", "m"))
+        self.assertEqual([(a.kind, str(a.path)) for a in artifacts],
+                         [("source", "m_HSM.cpp"), ("header", "m_HSM.hpp")])
+        self.assertIn("struct m_HSM", artifacts[1].text)
+        self.assertEqual(artifacts[0].diagram.name, "m")
+        self.assertIsNone(artifacts[0].written)
+
+    def test_same_output_as_generate_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            source = directory.joinpath("demo.puml")
+            source.write_text(demodiagram)
+            list(pipeline.generate_files([source]))
+            generated = directory.joinpath("generated")
+            expected = {
+                path.name: path.read_text()
+                for path in generated.glob("*_HSM.*")
+            }
+
+            templates = pipeline.Templates()
+            artifacts = api.generate([source], templates=templates)
+            self.assertEqual({a.path.name: a.text for a in artifacts},
+                             expected)
+            self.assertEqual({a.path.parent for a in artifacts}, {generated})
+
+            # nothing changed, so nothing is rewritten
+            artifacts = api.generate([("other/demo.puml", demodiagram)],
+                                     templates=templates,
+                                     output_dir=generated,
+                                     write=True)
+            self.assertEqual([a.written for a in artifacts], [False, False])
+            self.assertEqual(artifacts[0].source,
+                             pathlib.Path("other/demo.puml"))
+
+    def test_options(self):
+        text = plantumldiagram("[*] -> A\nB -> A : next", "m")
+        messages = []
+        artifacts = api.generate(
+            [("a.puml", text), ("b.puml", text.replace("@startuml m",
+                                                        "@startuml n"))],
+            options={"unity": "directory", "prune": "report"},
+            output_dir="out",
+            log=messages.append)
+        self.assertEqual([str(a.path) for a in artifacts], [
+            "out/m_HSM.hpp", "out/a_unity.inc", "out/n_HSM.hpp",
+            "out/b_unity.inc", "out/out_unity.cpp"
+        ])
+        self.assertEqual(artifacts[-1].text, '#include "a_unity.inc"\n'
+                         '#include "b_unity.inc"\n')
+        self.assertEqual(messages, [
+            "diagram m: state B is unreachable",
+            "diagram n: state B is unreachable"
+        ])
+
+        with self.assertRaisesRegex(ValueError, "set by the templates"):
+            api.generate(text,
+                         templates=pipeline.Templates(),
+                         options={"backend": "table"})
+
+    def test_unity_names(self):
+        m = plantumldiagram("[*] -> A", "m")
+        n = plantumldiagram("[*] -> A", "n")
+        with tempfile.TemporaryDirectory() as directory:
+            output_dir = pathlib.Path(directory, "out")
+            artifacts = api.generate([("src/a.puml", m), ("src/b.puml", n)],
+                                     options={"unity": "directory"},
+                                     output_dir=output_dir)
+            self.assertEqual(artifacts[-1].path,
+                             output_dir.joinpath("out_unity.cpp"))
+
+        artifacts = api.generate([("src/a.puml", m), ("src/b.puml", n)],
+                                 options={"unity": "directory"})
+        self.assertEqual(str(artifacts[-1].path),
+                         "src/generated/src_unity.cpp")
+
+        # both unnamed texts would go to diagrams_unity.cpp
+        with self.assertRaisesRegex(
+                ValueError, "two artifacts would be written to "
+                "diagrams_unity.cpp"):
+            api.generate([m, n], options={"unity": "file"})
+        artifacts = api.generate([("a.puml", m), ("b.puml", n)],
+                                 options={"unity": "file"},
+                                 output_dir="out")
+        self.assertEqual([str(a.path) for a in artifacts], [
+            "out/m_HSM.hpp", "out/a_unity.cpp", "out/n_HSM.hpp",
+            "out/b_unity.cpp"
+        ])
+
+
+class TestBench(unittest.TestCase):
+    def test_bench_option(self):
+        artifacts = api.generate(plantumldiagram("[*] -> A\nA -> B : next",
+                                                 "m"),
+                                 options={"bench": "on"})
+        self.assertEqual([(a.kind, str(a.path)) for a in artifacts],
+                         [("source", "m_HSM.cpp"), ("header", "m_HSM.hpp"),
+                          ("benchmark", "m_HSM.bench.cpp")])
+        self.assertIn("struct Bench final: m_HSM\n", artifacts[2].text)
+
+        artifacts = api.generate(plantumldiagram("[*] -> A", "m"))
+        self.assertNotIn("benchmark", [a.kind for a in artifacts])
+
+    @unittest.skipUnless(shutil.which("g++"), "needs g++")
+    def test_drivers(self):
+        import benchmark.machines
+
+        lines = corpus.diagram_source("bench", states=12, depth=3, seed=2)
+        diagram, = stateparser.iter_diagrams(lines)
+        depths = {str(leaf.depth) for leaf in diagram.leaves}
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            replay = directory.joinpath("signals.txt")
+            replay.write_text(" ".join(diagram.events * 50) + " 0\n")
+            for backend in ("hsm", "crtp"):
+                output = directory.joinpath(backend)
+                artifacts = api.generate([("bench.puml", "\n".join(lines))],
+                                         options={
+                                             "bench": "on",
+                                             "backend": backend
+                                         },
+                                         output_dir=output,
+                                         write=True)
+                executable, = benchmark.machines.build(
+                    artifacts, ["g++", "-std=c++17", "-O1"],
+                    output).values()
+
+                result = benchmark.machines.measure(
+                    executable, ["--count", "2000", "--repeat", "1"])
+                self.assertEqual(result["signals"], 2000)
+                self.assertGreater(result["transitions"], 0)
+                self.assertGreater(result["ns_per_event"], 0)
+                self.assertLessEqual(set(result["depths"]), depths)
+                self.assertEqual(
+                    sum(depth["events"]
+                        for depth in result["depths"].values()), 2000)
+
+                replayed = benchmark.machines.measure(
+                    executable, ["--replay", str(replay)])
+                self.assertEqual(replayed["signals"],
+                                 len(diagram.events) * 50 + 1)
+
+
+class TestDiagnostics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_line_numbers(self):
+        text = ("// a header\n\n" +
+                hppdiagram_multi("[*] -> A\nscale 2", "m",
+                                 "[*] -> B\nskinparam x", "n"))
+        lines = text.splitlines()
+        expected = [(lines.index("scale 2") + 1, "m", "unparsed line: scale 2"),
+                    (lines.index("skinparam x") + 1, "n",
+                     "unparsed line: skinparam x")]
+        source = self.root.joinpath("m.hpp")
+        source.write_text(text)
+
+        # read from the file, from lines and from bytes
+        for source in (source, text, text.encode()):
+            diagnostics = diagnostics_.Diagnostics("m.hpp")
+            list(stateparser.iter_diagrams(source, diagnostics=diagnostics))
+            self.assertEqual([(entry.line, entry.diagram, entry.message)
+                              for entry in diagnostics.entries], expected)
+        self.assertEqual(diagnostics.lines()[0],
+                         f"m.hpp:{expected[0][0]}: warning: unparsed line: "
+                         "scale 2 (diagram m)")
+
+    def test_parse_data(self):
+        diagnostics = []
+        stateparser.parse_data(plantumldiagram("[*] -> A\nscale 2", "m"),
+                               diagnostics)
+        self.assertEqual([(entry.line, entry.diagram, entry.message)
+                          for entry in diagnostics],
+                         [(3, "m", "unparsed line: scale 2")])
+
+    def test_limit(self):
+        lines = "\n".join(f"scale {n}" for n in range(30))
+        source = self.root.joinpath("m.puml")
+        source.write_text(plantumldiagram(lines, "m"))
+
+        result, = pipeline.generate_files([source], max_diagnostics=5)
+        self.assertEqual(len(result.diagnostics.entries), 5)
+        self.assertEqual(len(result.diagnostics), 30)
+        self.assertEqual(result.diagnostics.lines()[-1],
+                         f"{str(source)}: note: 25 more diagnostics not shown")
+
+        result, = pipeline.generate_files([source], max_diagnostics=0)
+        self.assertEqual(len(result.diagnostics.entries), 30)
+
+    def test_json(self):
+        source = self.root.joinpath("m.puml")
+        source.write_text(plantumldiagram("[*] -> A\nscale 2", "m"))
+        self.root.joinpath("n.puml").write_text(
+            plantumldiagram("[*] -> A", "n"))
+        process = subprocess.run(
+            [sys.executable,
+             str(pathlib.Path(__file__).parent), "--diagnostics", "json",
+             str(self.root)],
+            capture_output=True,
+            text=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertIn("generated", process.stderr)
+        self.assertEqual([json.loads(line) for line in
+                          process.stdout.splitlines()], [{
+                              "file": str(source),
+                              "diagnostics": [{
+                                  "file": str(source),
+                                  "line": 3,
+                                  "severity": "warning",
+                                  "diagram": "m",
+                                  "message": "unparsed line: scale 2"
+                              }],
+                              "dropped": 0
+                          }])
+
+
+class TestShard(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def run_generator(self, *args):
+        process = subprocess.run(
+            [sys.executable,
+             str(pathlib.Path(__file__).parent), *args],
+            capture_output=True,
+            text=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process.stdout
+
+    def test_shard(self):
+        self.assertEqual(shard_.shard("2/3"), (2, 3))
+        for value in ("0/3", "4/3", "1/0", "3", "a/b"):
+            with self.assertRaises(ValueError):
+                shard_.shard(value)
+
+    def test_select(self):
+        inputs = [pathlib.Path(f"d{n % 4}", f"f{n}.puml") for n in range(200)]
+        names = {inputfile: inputfile.as_posix() for inputfile in inputs}
+        for by_directory in (False, True):
+            shards = [
+                shard_.select(inputs, names, index, 3, by_directory)
+                for index in (1, 2, 3)
+            ]
+            # every input in exactly one shard, in order
+            self.assertEqual(sorted(sum(shards, []), key=inputs.index),
+                             inputs)
+            self.assertTrue(all(shards))
+            if by_directory:
+                for part in shards:
+                    for other in shards:
+                        if part is not other:
+                            self.assertFalse({i.parent for i in part} &
+                                             {i.parent for i in other})
+        # the same on every machine and in every process
+        self.assertEqual(shard_.shard_of("d0/f0.puml", 3), 1)
+        self.assertEqual(shard_.shard_of("d1/f1.puml", 3), 2)
+
+    def test_merge(self):
+        def manifest(index, count, *names):
+            return shard_.run_manifest(
+                {
+                    name: {
+                        "status": "generated",
+                        "outputs": [f"generated/{name}.hpp"]
+                    }
+                    for name in names
+                }, (index, count))
+
+        merged = shard_.merge([manifest(2, 2, "b"), manifest(1, 2, "a")])
+        self.assertEqual(merged["shard"], None)
+        self.assertEqual(list(merged["inputs"]), ["a", "b"])
+
+        for manifests, message in (
+            ([manifest(1, 2, "a")], "missing shard(s) 2 of 2"),
+            ([manifest(1, 2, "a"), manifest(1, 2, "b")],
+             "shard 1/2 given twice"),
+            ([manifest(1, 2, "a"), manifest(2, 3, "b")],
+             "shard 2/3 is not one of 2 shards"),
+            ([manifest(1, 2, "a"), manifest(2, 2, "a")],
+             "input a is in two shards"),
+        ):
+            with self.assertRaises(ValueError) as error:
+                shard_.merge(manifests)
+            self.assertEqual(str(error.exception), message)
+
+    def test_sharded_run(self):
+        for n in range(8):
+            directory = self.root.joinpath("src", f"d{n % 2}")
+            directory.mkdir(parents=True, exist_ok=True)
+            directory.joinpath(f"m{n}.puml").write_text(
+                plantumldiagram("[*] -> A\nA --> B : event", f"m{n}"))
+        src = str(self.root.joinpath("src"))
+
+        everything = self.run_generator("--list", src).splitlines()
+        self.assertEqual(len(everything), 8)
+        self.assertFalse(self.root.joinpath("src", "d0", "generated").exists())
+
+        listed = []
+        manifests = []
+        for index in (1, 2, 3):
+            listed += self.run_generator("--shard", f"{index}/3", "--list",
+                                         src).splitlines()
+            manifests.append(str(self.root.joinpath(f"{index}.json")))
+            self.run_generator("--shard", f"{index}/3", "--manifest",
+                               manifests[-1], src)
+        self.assertEqual(sorted(listed), sorted(everything))
+
+        merged = subprocess.run(
+            [sys.executable, "-m", "tools.manifest", *manifests],
+            cwd=str(pathlib.Path(__file__).parent),
+            capture_output=True,
+            text=True)
+        self.assertEqual(merged.returncode, 0, merged.stderr)
+        inputs = json.loads(merged.stdout)["inputs"]
+        self.assertEqual(len(inputs), 8)
+        self.assertEqual(inputs["d1/m3.puml"], {
+            "status": "generated",
+            "outputs": ["d1/generated/m3_HSM.cpp", "d1/generated/m3_HSM.hpp"]
+        })
+
+        # the outputs of an input that is up to date come from the cache
+        self.run_generator("--shard", "1/3", "--manifest", manifests[0], src)
+        with open(manifests[0]) as f:
+            entries = json.load(f)["inputs"].values()
+        self.assertTrue(entries)
+        for entry in entries:
+            self.assertEqual(entry["status"], "up to date")
+            self.assertEqual(len(entry["outputs"]), 2)
+
+    def test_several_roots(self):
+        # the same relative path below two of the searched directories
+        roots = []
+        for name in ("a", "b"):
+            root = self.root.joinpath("src", name)
+            root.mkdir(parents=True)
+            root.joinpath("x.puml").write_text(
+                plantumldiagram("[*] -> A", f"x{name}"))
+            roots.append(str(root))
+
+        manifest = self.root.joinpath("run.json")
+        self.run_generator("--manifest", str(manifest), *roots)
+        with open(manifest) as f:
+            inputs = json.load(f)["inputs"]
+        self.assertEqual(
+            inputs, {
+                "a/x.puml": {
+                    "status": "generated",
+                    "outputs":
+                    ["a/generated/xa_HSM.cpp", "a/generated/xa_HSM.hpp"]
+                },
+                "b/x.puml": {
+                    "status": "generated",
+                    "outputs":
+                    ["b/generated/xb_HSM.cpp", "b/generated/xb_HSM.hpp"]
+                }
+            })
+
+        listed = []
+        for index in (1, 2, 3, 4):
+            listed += self.run_generator("--shard", f"{index}/4", "--list",
+                                         *roots).splitlines()
+        self.assertEqual(sorted(listed),
+                         [str(pathlib.Path(root, "x.puml")) for root in roots])
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.source = self.root.joinpath("m.puml")
+        self.source.write_text(
+            plantumldiagram("[*] -> A\nA -> B : start\nscale 2", "m") +
+            "\n" + plantumldiagram("[*] -> C", "n") + "\n")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_disabled_by_default(self):
+        result, = pipeline.generate_files([self.source])
+        self.assertIsNone(result.stats)
+
+    def test_counts(self):
+        result, = pipeline.generate_files([self.source], stats=True)
+        stats = result.stats
+
+        self.assertEqual(stats.lines, 8)
+        self.assertEqual(stats.diagram_lines, 8)
+        self.assertEqual(stats.unparsed, 1)
+        self.assertEqual(stats.diagrams, 2)
+        self.assertEqual(stats.states, 3)
+        self.assertEqual(stats.events, 1)
+        self.assertEqual((stats.outputs, stats.written), (4, 4))
+        self.assertEqual(stats.bytes_written,
+                         sum(path.stat().st_size for path in result.outputs))
+        self.assertTrue(all(seconds >= 0 for seconds in stats.times.values()))
+
+        result, = pipeline.generate_files([self.source], jobs=2, stats=True)
+        self.assertEqual((result.stats.outputs, result.stats.written), (4, 0))
+
+    def test_json_output(self):
+        process = subprocess.run(
+            [sys.executable,
+             str(pathlib.Path(__file__).parent), "--stats=json",
+             str(self.root)],
+            capture_output=True,
+            text=True)
+        self.assertEqual(process.returncode, 0)
+
+        summary = json.loads(process.stdout)
+        self.assertEqual(summary["inputs"], 1)
+        self.assertEqual(summary["counts"]["diagrams"], 2)
+        self.assertEqual(summary["files"][0]["input"], str(self.source))
+        self.assertEqual(sorted(summary["times"]),
+                         ["finalise", "parse", "render", "scan", "write"])
+        self.assertIn(f"{str(self.source)}:4: warning: unparsed line: "
+                      "scale 2 (diagram m)", process.stderr)
+
+
+class TestBenchmarkCorpus(unittest.TestCase):
+    def test_diagram_shape(self):
+        for states, depth in ((1, 1), (12, 1), (30, 4), (5, 9)):
+            lines = corpus.diagram_source("m", states, depth, events=3)
+            diagram, = stateparser.iter_diagrams(lines)
+
+            self.assertEqual(len(diagram.states), states + 1)
+            self.assertEqual(max(s.depth for s in diagram.states),
+                             min(depth, states))
+            for state in diagram.states[1:]:
+                self.assertEqual(
+                    sum(not t.is_internal for t in state.transitions), 3)
+                self.assertEqual(state.entry, [f"enter_{state.name}"])
+                if not state.is_leaf:
+                    self.assertIn(state.init, state.children)
+
+    def test_header_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = corpus.write_corpus(pathlib.Path(directory),
+                                        files=3,
+                                        diagrams=2,
+                                        header=True,
+                                        padding=10,
+                                        states=4)
+            found = scanner.Scanner(extensions=(".hpp", )).scan(
+                pathlib.Path(directory))
+            self.assertEqual(found, sorted(paths))
+
+            for path in paths:
+                self.assertEqual(
+                    [d.name for d in stateparser.iter_diagrams(path)],
+                    [f"{path.stem}_0", f"{path.stem}_1"])
+
+    def test_benchmark_run(self):
+        import benchmark.__main__ as suite
+
+        with tempfile.TemporaryDirectory() as directory:
+            root = pathlib.Path(directory)
+            corpus.write_corpus(root, files=1, diagrams=2, states=4)
+            phases, counts = suite.run(root, scanner.Scanner(), 1)
+        self.assertEqual(set(phases), set(suite.PHASES))
+        self.assertEqual((counts["diagrams"], counts["outputs"]), (2, 4))
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs unix sockets")
+class TestServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name).resolve()
+        self.socket = str(self.root.joinpath("yahsmg.sock"))
+        self.source = self.root.joinpath("m.puml")
+        self.source.write_text(plantumldiagram("[*] -> A", "m"))
+        self.messages = []
+
+        # a long interval, so only requests regenerate anything
+        self.thread = threading.Thread(target=server.serve,
+                                       args=([self.root], self.socket,
+                                             scanner.Scanner()),
+                                       kwargs={
+                                           "poll": True,
+                                           "interval": 60,
+                                           "log": self.messages.append
+                                       })
+        self.thread.start()
+
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def tearDown(self) -> None:
+        server.request(self.socket, "shutdown")
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket))
+        self.tmp.cleanup()
+
+    def test_initial_generation(self):
+        self.assertTrue(
+            self.root.joinpath("generated", "m_HSM.cpp").is_file())
+        status = server.request(self.socket, "status")
+        self.assertEqual(status["inputs"], 1)
+        self.assertEqual(status["diagrams"], 1)
+
+    def test_ensure(self):
+        response = server.request(self.socket, "ensure")
+        self.assertEqual(response, {"ok": True, "generated": [], "failed": {}})
+
+        self.source.write_text(plantumldiagram("[*] -> A\nA -> B : start",
+                                               "m"))
+        other = self.root.joinpath("sub", "n.puml")
+        other.parent.mkdir()
+        other.write_text(plantumldiagram("[*] -> A\n}\n}", "n"))
+
+        response = server.request(self.socket, "ensure")
+        self.assertFalse(response["ok"])
+        self.assertEqual(list(response["failed"]), [str(other)])
+        self.assertEqual(response["generated"], [
+            str(self.root.joinpath("generated", "m_HSM.cpp")),
+            str(self.root.joinpath("generated", "m_HSM.hpp"))
+        ])
+
+    def test_invalid_request(self):
+        self.assertFalse(server.request(self.socket, "unknown")["ok"])
+
+    def test_saved_while_rendering(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "m.puml")
+            source.write_text(plantumldiagram("[*] -> A", "m"))
+
+            class SavedWorkspace(server.Workspace):
+                def _render(self, path, diagrams, key, report):
+                    source.write_text(plantumldiagram("[*] -> B", "m"))
+                    super()._render(path, diagrams, key, report)
+
+            workspace = SavedWorkspace([directory],
+                                       scanner.Scanner(),
+                                       log=self.messages.append)
+            workspace.update(None)
+
+            def fresh():
+                build_cache = cache.BuildCache(pipeline.template_path,
+                                               pipeline.options_key(None))
+                return build_cache.is_fresh(
+                    source, source.parent.joinpath("generated"),
+                    build_cache.key(source))
+
+            # the outputs of A are not up to date for the content with B
+            self.assertFalse(fresh())
+            server.Workspace([directory],
+                             scanner.Scanner(),
+                             log=self.messages.append).update(None)
+            self.assertTrue(fresh())
+
+    def test_ensure_while_watching(self):
+        # an ensure request arriving after the watcher took the changes but
+        # before they are generated has to wait for them
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory).resolve()
+            source = directory.joinpath("m.puml")
+            source.write_text(plantumldiagram("[*] -> A", "m"))
+            header = directory.joinpath("generated", "m_HSM.hpp")
+            results = []
+
+            def ensure():
+                response = generator.ensure()
+                results.append((response, header.read_text()))
+
+            class RacedWorkspace(server.Workspace):
+                def update(self, paths):
+                    if paths and not generator.stopping.is_set():
+                        generator.stopping.set()
+                        request = threading.Thread(target=ensure)
+                        request.start()
+                        request.join(0.5)
+                    return super().update(paths)
+
+            workspace = RacedWorkspace([directory],
+                                       scanner.Scanner(),
+                                       log=self.messages.append)
+            workspace.update(None)
+            watcher = server.PollingWatcher(workspace.roots,
+                                            workspace.scanner)
+            source.write_text(plantumldiagram("[*] -> A\nA -> B : start",
+                                              "m"))
+            socket_path = str(directory.joinpath("yahsmg.sock"))
+            with server.GeneratorServer(socket_path, workspace,
+                                        watcher) as generator:
+                generator.watch(0)
+                deadline = time.monotonic() + 10
+                while not results:
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.01)
+
+            response, text = results[0]
+            self.assertTrue(response["ok"])
+            self.assertIn("start", text)
+
+
+class TestStartup(unittest.TestCase):
+    generator = pathlib.Path(__file__).parent.resolve()
+
+    run_generator = (
+        "import runpy, sys\n"
+        "generator = sys.argv[1]\n"
+        "sys.argv = ['generator'] + sys.argv[2:]\n"
+        "try:\n"
+        "    runpy.run_path(generator, run_name='__main__')\n"
+        "finally:\n"
+        "    print('jinja2' in sys.modules)\n")
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def run_python(self, *args):
+        return subprocess.run([sys.executable, *args],
+                              cwd=self.root,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout
+
+    def imports_jinja(self, path):
+        output = self.run_python("-c", self.run_generator,
+                                 str(self.generator), str(path))
+        return output.splitlines()[-1] == "True"
+
+    def test_jinja_is_only_imported_to_render(self):
+        source = self.root.joinpath("m.puml")
+        source.write_text("no diagrams here")
+        self.assertFalse(self.imports_jinja(source))
+
+        source.write_text(plantumldiagram("[*] -> A", "m"))
+        self.assertTrue(self.imports_jinja(source))
+        # up to date according to the build manifest
+        self.assertFalse(self.imports_jinja(source))
+
+    def test_pipeline_does_not_import_jinja(self):
+        # importing jinja2 and compiling the templates used to make up most
+        # of the startup time
+        output = self.run_python(
+            "-c", "import sys\n"
+            "sys.path.insert(0, sys.argv[1])\n"
+            "import core.pipeline\n"
+            "print('jinja2' in sys.modules)\n", str(self.generator))
+        self.assertEqual(output.strip(), "False")
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+# Combines the run manifests written with --manifest by every shard of a
+# generation run split with --shard into the manifest of the whole run, and
+# fails when a shard is missing, given twice or overlaps another one.
+#
+# usage (from the generator directory):
+#   python -m tools.manifest MANIFEST [MANIFEST ...] [--output FILE]
+
+import core.shard
+import argparse
+import json
+import pathlib
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tools.manifest")
+    parser.add_argument("manifests",
+                        type=pathlib.Path,
+                        nargs="+",
+                        help="the --manifest file of every shard")
+    parser.add_argument("--output",
+                        "-o",
+                        type=pathlib.Path,
+                        metavar="FILE",
+                        help="write the merged manifest to FILE instead of "
+                        "stdout")
+    args = parser.parse_args()
+
+    try:
+        manifests = [
+            core.shard.read_manifest(path) for path in args.manifests
+        ]
+        merged = core.shard.merge(manifests)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise SystemExit(f"error: {e}")
+
+    if args.output:
+        core.shard.write_manifest(args.output, merged)
+    else:
+        json.dump(merged, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write("\n")
+
+    failed = sorted(name for name, entry in merged["inputs"].items()
+                    if entry["status"] == "failed")
+    for name in failed:
+        print(f"error: {name} failed", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Decodes the transition trace dumps written by TraceBuffer::dump() of
+# resources/hsm/trace.hpp into timelines, naming the state and signal ids with
+# the <name>_HSM.trace.json file generated with the trace option.
+#
+# usage (from the generator directory):
+#   python -m tools.trace METADATA DUMP [DUMP ...] [--json]
+
+import argparse
+import json
+import pathlib
+import struct
+import sys
+
+MAGIC = b"YHSMTRC1"
+VERSION = 1
+
+# TraceHeader and TraceRecord, little endian like the machines we run on
+HEADER = struct.Struct("<8sIIQQ")
+RECORD = struct.Struct("<QHHHH")
+
+
+class Dump:
+    # records are (timestamp, source, signal, target) tuples, oldest first
+    __slots__ = ("capacity", "written", "records")
+
+    def __init__(self, capacity: int, written: int, records: list):
+        self.capacity = capacity
+        self.written = written
+        self.records = records
+
+    @property
+    def overwritten(self) -> int:
+        # records lost because the ring buffer wrapped
+        return self.written - len(self.records)
+
+
+def read_dump(data: bytes) -> Dump:
+    if len(data) < HEADER.size:
+        raise ValueError("trace dump too short")
+    magic, version, record_size, capacity, written = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a trace dump")
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"unsupported trace dump version {version} "
+                         f"with {record_size} byte records")
+
+    count = min(written, capacity)
+    end = HEADER.size + count * RECORD.size
+    if len(data) < end:
+        raise ValueError(f"trace dump truncated, expected {count} records")
+    records = [
+        record[:4]
+        for record in RECORD.iter_unpack(memoryview(data)[HEADER.size:end])
+    ]
+    return Dump(capacity, written, records)
+
+
+def load_metadata(path: pathlib.Path) -> dict:
+    metadata = json.loads(pathlib.Path(path).read_text())
+    if metadata.get("format") != "yahsmg-trace":
+        raise ValueError(f"{path}: not a trace metadata file")
+    return metadata
+
+
+def _name(names: list, index: int) -> str:
+    return names[index] if index < len(names) else f"#{index}"
+
+
+def events(dump: Dump, metadata: dict) -> list:
+    # the records with names, times in nanoseconds since the first record
+    states = metadata["states"]
+    signals = metadata["signals"]
+    start = dump.records[0][0] if dump.records else 0
+    return [{
+        "time": timestamp - start,
+        "source": _name(states, source),
+        "signal": _name(signals, signal),
+        "target": _name(states, target)
+    } for timestamp, source, signal, target in dump.records]
+
+
+def timeline(dump: Dump, metadata: dict) -> list:
+    lines = []
+    if dump.overwritten:
+        lines.append(f"({dump.overwritten} older records were overwritten)")
+    for event in events(dump, metadata):
+        lines.append(f"{event['time'] / 1000:14.3f} us  {event['source']} "
+                     f"--{event['signal']}--> {event['target']}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tools.trace")
+    parser.add_argument("metadata",
+                        type=pathlib.Path,
+                        help="the <name>_HSM.trace.json of the machine")
+    parser.add_argument("dumps", type=pathlib.Path, nargs="+")
+    parser.add_argument("--json",
+                        action="store_true",
+                        help="print the decoded records as JSON")
+    args = parser.parse_args()
+
+    metadata = load_metadata(args.metadata)
+    decoded = {}
+    for path in args.dumps:
+        try:
+            decoded[path] = read_dump(path.read_bytes())
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"{path}: {e}")
+
+    if args.json:
+        json.dump(
+            {
+                str(path): {
+                    "written": dump.written,
+                    "overwritten": dump.overwritten,
+                    "events": events(dump, metadata)
+                }
+                for path, dump in decoded.items()
+            },
+            sys.stdout,
+            indent=2)
+        sys.stdout.write("\n")
+        return
+
+    for path, dump in decoded.items():
+        if len(decoded) > 1:
+            print(f"== {path}")
+        print("\n".join(timeline(dump, metadata)))
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,8 @@ struct CompState: B
     using Base = B;
     using This = CompState<H, id, Base>;
 
+    static constexpr std::size_t stateId = id;
+
     template <typename X>
     void handle(H& h, const X& x) const
     {
@@ -62,6 +64,8 @@ struct CompState<H, 0, TopState<H>>: TopState<H>
     using Base = TopState<H>;
     using This = CompState<H, 0, Base>;
 
+    static constexpr std::size_t stateId = 0;
+
     template <typename X>
     void handle(H&, const X&) const
     {}
@@ -82,6 +86,8 @@ struct LeafState: B
     using Base = B;
     using This = LeafState<H, id, Base>;
 
+    static constexpr std::size_t stateId = id;
+
     template <typename X>
     void handle(H& h, const X& x) const
     {
@@ -112,6 +118,24 @@ struct LeafState: B
 template <typename H, std::size_t id, typename B>
 const LeafState<H, id, B> LeafState<H, id, B>::obj;
 
+// Tracing Policy
+
+// Every transition calls TransitionTracer<H>::transition(h, source, target) with the
+// ids of the current leaf state and of the target state. That does nothing
+// unless the host names a tracer type with a `using Tracer = ...;` member,
+// see hsm/trace.hpp.
+
+template <typename H, typename = void>
+struct TransitionTracer
+{
+    static void transition(const H&, std::size_t, std::size_t)
+    {}
+};
+
+template <typename H>
+struct TransitionTracer<H, std::void_t<typename H::Tracer>>: H::Tracer
+{};
+
 // Transition Object
 
 template <typename C, typename S, typename T>
@@ -134,12 +158,14 @@ struct Tran
     Tran(Host& h)
         : host_(h)
     {
+        TransitionTracer<Host>::transition(h, C::stateId, T::stateId);
         exitActions(host_, std::false_type{});
     }
 
     Tran(Host& h, void (Host::*func)())
         : host_(h)
     {
+        TransitionTracer<Host>::transition(h, C::stateId, T::stateId);
         exitActions(host_, std::false_type{});
         (h.*func)();
     }
@@ -0,0 +1,101 @@
+#ifndef HSM_INSTANCES_HPP
+#define HSM_INSTANCES_HPP
+
+#include <cstddef>
+#include <type_traits>
+#include <utility>
+
+// Struct of arrays storage for many instances of one machine generated with
+// the layout=compact option: only the state id of every instance is kept, in
+// one array, and a single Machine object runs the signals of all of them.
+//
+// The Machine holds the actions and guards. When it has a
+// select(std::size_t) member that is called with the index of the instance
+// before its actions run, so they can find that instance's own data (in more
+// arrays of the user's). Signals post()ed by the actions of an instance are
+// handled before going on with the next instance.
+
+template <typename Machine, std::size_t N>
+class Instances
+{
+public:
+    using Signal = typename Machine::Signal;
+    using StateId = typename Machine::StateId;
+
+    // runs the initial transitions of every instance
+    void init(Machine& machine)
+    {
+        for (std::size_t i = 0; i < N; ++i)
+        {
+            select(machine, i);
+            machine.init();
+            complete(machine);
+            states_[i] = machine.getStateId();
+        }
+    }
+
+    void dispatch(Machine& machine, std::size_t instance, Signal signal)
+    {
+        select(machine, instance);
+        machine.setStateId(states_[instance]);
+        machine.dispatch(signal);
+        complete(machine);
+        states_[instance] = machine.getStateId();
+    }
+
+    // dispatches the signal to every instance in turn
+    void broadcast(Machine& machine, Signal signal)
+    {
+        for (std::size_t i = 0; i < N; ++i)
+        {
+            dispatch(machine, i, signal);
+        }
+    }
+
+    StateId state(std::size_t instance) const
+    {
+        return states_[instance];
+    }
+
+    static constexpr std::size_t size()
+    {
+        return N;
+    }
+
+private:
+    template <typename M, typename = void>
+    struct HasSelect: std::false_type
+    {};
+
+    template <typename M>
+    struct HasSelect<M, std::void_t<decltype(std::declval<M&>().select(std::size_t{}))>>: std::true_type
+    {};
+
+    template <typename M, typename = void>
+    struct HasQueue: std::false_type
+    {};
+
+    template <typename M>
+    struct HasQueue<M, std::void_t<decltype(std::declval<M&>().dispatch_all())>>: std::true_type
+    {};
+
+    static void select(Machine& machine, std::size_t instance)
+    {
+        if constexpr (HasSelect<Machine>::value)
+        {
+            machine.select(instance);
+        }
+    }
+
+    static void complete(Machine& machine)
+    {
+        if constexpr (HasQueue<Machine>::value)
+        {
+            machine.dispatch_all();
+        }
+    }
+
+    StateId states_[N]{};
+};
+
+#endif // HSM_INSTANCES_HPP
@@ -0,0 +1,85 @@
+#ifndef HSM_QUEUE_HPP
+#define HSM_QUEUE_HPP
+
+#include <cstddef>
+#include <cstdint>
+#include <type_traits>
+
+#if __cplusplus >= 202002L && defined(__has_include)
+#if __has_include(<span>)
+#include <span>
+#define HSM_QUEUE_SPAN 1
+#endif
+#endif
+
+// Fixed capacity first in first out queue of events, used by the generated
+// post() / dispatch_all() / dispatch_batch() for run to completion
+// processing. It never allocates, push() fails when the queue is full.
+
+template <typename T, std::size_t Capacity>
+class EventQueue
+{
+    static_assert(Capacity > 0, "an event queue needs room for an event");
+
+    // the smallest type that can count up to Capacity
+    using Index = std::conditional_t<
+        (Capacity <= UINT8_MAX), std::uint8_t,
+        std::conditional_t<(Capacity <= UINT16_MAX), std::uint16_t, std::size_t>>;
+
+public:
+    bool push(const T& item)
+    {
+        if (count_ == Capacity)
+        {
+            return false;
+        }
+        items_[(head_ + count_) % Capacity] = item;
+        ++count_;
+        return true;
+    }
+
+    bool pop(T& item)
+    {
+        if (count_ == 0)
+        {
+            return false;
+        }
+        item = items_[head_];
+        head_ = static_cast<Index>((head_ + 1) % Capacity);
+        --count_;
+        return true;
+    }
+
+    void clear()
+    {
+        head_ = 0;
+        count_ = 0;
+    }
+
+    bool empty() const
+    {
+        return count_ == 0;
+    }
+
+    bool full() const
+    {
+        return count_ == Capacity;
+    }
+
+    std::size_t size() const
+    {
+        return count_;
+    }
+
+    static constexpr std::size_t capacity()
+    {
+        return Capacity;
+    }
+
+private:
+    T items_[Capacity]{};
+    Index head_{0};
+    Index count_{0};
+};
+
+#endif // HSM_QUEUE_HPP
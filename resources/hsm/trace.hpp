@@ -0,0 +1,118 @@
+#ifndef HSM_TRACE_HPP
+#define HSM_TRACE_HPP
+
+#include <atomic>
+#include <chrono>
+#include <cstddef>
+#include <cstdint>
+#include <cstdio>
+
+// Transition tracing for machines generated with the trace=N option: every
+// transition that fires is recorded in a fixed size ring buffer shared by all
+// instances of the machine. dump() writes the buffer to a file that
+// `python -m tools.trace` decodes, using the <name>_HSM.trace.json file the
+// generator writes next to the header to name the states and signals.
+//
+// Writers only reserve a slot with an atomic increment, so recording never
+// locks. A record that is being overwritten while dump() reads it can come
+// out torn, dump the buffer while the machines are quiet to avoid that.
+
+struct TraceRecord
+{
+    std::uint64_t timestamp; // Clock ticks, nanoseconds for steady_clock
+    std::uint16_t source;    // state id of the current leaf state
+    std::uint16_t signal;
+    std::uint16_t target;    // state id of the target of the transition
+    std::uint16_t reserved;
+};
+
+static_assert(sizeof(TraceRecord) == 16, "the trace decoder reads 16 byte records");
+
+// the start of a dump, followed by the records oldest first
+struct TraceHeader
+{
+    char magic[8];
+    std::uint32_t version;
+    std::uint32_t recordSize;
+    std::uint64_t capacity;
+    std::uint64_t written; // records ever written, the oldest are overwritten
+};
+
+template <std::size_t Capacity, typename Clock = std::chrono::steady_clock>
+class TraceBuffer
+{
+    static_assert(Capacity > 0, "a trace buffer needs room for a record");
+
+public:
+    void write(std::size_t source, std::size_t signal, std::size_t target)
+    {
+        const auto now = std::chrono::duration_cast<std::chrono::nanoseconds>(
+            Clock::now().time_since_epoch());
+        const std::uint64_t n = next_.fetch_add(1, std::memory_order_relaxed);
+        records_[n % Capacity] = TraceRecord{static_cast<std::uint64_t>(now.count()),
+                                             static_cast<std::uint16_t>(source),
+                                             static_cast<std::uint16_t>(signal),
+                                             static_cast<std::uint16_t>(target), 0};
+    }
+
+    std::uint64_t written() const
+    {
+        return next_.load(std::memory_order_relaxed);
+    }
+
+    void clear()
+    {
+        next_.store(0, std::memory_order_relaxed);
+    }
+
+    bool dump(std::FILE* file) const
+    {
+        const std::uint64_t written = this->written();
+        const TraceHeader header{{'Y', 'H', 'S', 'M', 'T', 'R', 'C', '1'},
+                                 1,
+                                 sizeof(TraceRecord),
+                                 Capacity,
+                                 written};
+        if (std::fwrite(&header, sizeof(header), 1, file) != 1)
+        {
+            return false;
+        }
+
+        // oldest first: once the buffer has wrapped the oldest record is the
+        // one the next write overwrites
+        const std::size_t count = written < Capacity ? written : Capacity;
+        const std::size_t first = written < Capacity ? 0 : written % Capacity;
+        const std::size_t tail = count - first;
+        return std::fwrite(records_ + first, sizeof(TraceRecord), tail, file) == tail &&
+               std::fwrite(records_, sizeof(TraceRecord), first, file) == first;
+    }
+
+    bool dump(const char* path) const
+    {
+        std::FILE* file = std::fopen(path, "wb");
+        if (file == nullptr)
+        {
+            return false;
+        }
+        const bool ok = dump(file);
+        return std::fclose(file) == 0 && ok;
+    }
+
+private:
+    std::atomic<std::uint64_t> next_{0};
+    TraceRecord records_[Capacity]{};
+};
+
+// the tracer policy of a generated machine H: `using Tracer = RingTracer<H, N>;`
+template <typename H, std::size_t Capacity, typename Clock = std::chrono::steady_clock>
+struct RingTracer
+{
+    static inline TraceBuffer<Capacity, Clock> buffer;
+
+    static void transition(const H& h, std::size_t source, std::size_t target)
+    {
+        buffer.write(source, static_cast<std::size_t>(h.getSig()), target);
+    }
+};
+
+#endif // HSM_TRACE_HPP